@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+
+from loguru import logger
+
+# Период фоновой сверки с базой в секундах; 0 отключает сверку
+ACCESS_CACHE_TTL = float(os.getenv("ACCESS_CACHE_TTL", "60"))
+
+
+def parse_usernames(value):
+    """Разбирает список имён через запятую, как в ADMIN_USERNAMES."""
+    return frozenset(name.strip() for name in (value or "").split(",") if name.strip())
+
+
+class AccessCache:
+    """Список администраторов и разрешённых пользователей в памяти.
+
+    Проверки не обращаются ни к окружению, ни к базе. Изменения из админ-панели
+    записываются в базу и сразу применяются к кэшу; правки базы в обход бота
+    подхватываются фоновой сверкой раз в ``ttl`` секунд.
+    """
+
+    def __init__(self, storage, admin_usernames, ttl=ACCESS_CACHE_TTL):
+        self.storage = storage
+        self.admins = parse_usernames(admin_usernames)
+        self.ttl = ttl
+        self._allowed = frozenset()
+        self._lock = threading.Lock()
+        self.reload()
+        if ttl > 0:
+            threading.Thread(target=self._run_refresh, name="access-refresh", daemon=True).start()
+
+    def is_admin(self, username):
+        return username in self.admins
+
+    def is_allowed(self, username):
+        return username in self.admins or username in self._allowed
+
+    def reload(self):
+        """Перечитывает таблицу allowed_users и атомарно заменяет кэш."""
+        with self._lock:
+            with self.storage.connection() as conn:
+                rows = conn.execute("SELECT username FROM allowed_users").fetchall()
+            allowed = frozenset(row[0] for row in rows)
+            if allowed != self._allowed:
+                logger.info(f"Access cache reloaded: {len(allowed)} allowed users")
+            self._allowed = allowed
+
+    def add_user(self, username):
+        with self._lock:
+            with self.storage.connection() as conn:
+                conn.execute("INSERT OR IGNORE INTO allowed_users (username) VALUES (?)", (username,))
+            self._allowed = self._allowed | {username}
+
+    def remove_user(self, username):
+        with self._lock:
+            with self.storage.connection() as conn:
+                conn.execute("DELETE FROM allowed_users WHERE username = ?", (username,))
+            self._allowed = self._allowed - {username}
+
+    def _run_refresh(self):
+        while True:
+            time.sleep(self.ttl)
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Error refreshing access cache: {e}")
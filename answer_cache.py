@@ -0,0 +1,142 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from loguru import logger
+
+# Минимальное косинусное сходство вопросов для повторного использования ответа
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+# Кэшируются только вопросы не короче стольких символов
+ANSWER_CACHE_MIN_LENGTH = int(os.getenv("ANSWER_CACHE_MIN_LENGTH", "20"))
+
+# Термины нумерологии: вопрос без них — скорее продолжение разговора («Почему?», «Объясни»)
+NUMEROLOGY_PATTERN = re.compile(
+    r"\b(числ\w*|цифр\w*|нумеролог\w*|судьб\w*|жизненн\w*|пут[иья]\b|душ[аиеуы]\w*|карм\w*|вибрац\w*"
+    r"|аркан\w*|матриц\w*|психоматриц\w*|пифагор\w*|совместимост\w*|гармони\w*|энерги\w*)",
+    re.IGNORECASE)
+
+# Слова, которыми вопрос ссылается на себя или на прошлые реплики, и личные данные: даты и годы
+PERSONAL_PATTERN = re.compile(
+    r"^\s*(а|и|но)\b"
+    r"|\b(я|мне|меня|мной|мой|моя|моё|мое|мои|моего|моей|моему|моих|моим|мы|нас|нам|наш\w*"
+    r"|это\w*|этот|эта|эти|тот|та|те|выше|ранее|раньше|предыдущ\w*|тогда|ещё|еще|тоже|также"
+    r"|сказал\w*|родил\w*|рождени\w*|зовут|имя)\b"
+    r"|\b\d{1,2}[./-]\d{1,2}([./-]\d{2,4})?\b|\b(19|20)\d{2}\b"
+    r"|\b\d{1,2}\s+(январ|феврал|март|апрел|ма[йя]|июн|июл|август|сентябр|октябр|ноябр|декабр)",
+    re.IGNORECASE)
+
+
+def is_personal(question):
+    """Вопрос о самом клиенте или со ссылкой на прошлые реплики."""
+    return PERSONAL_PATTERN.search(question) is not None
+
+
+def is_standalone(question):
+    """Вопрос понятен без истории диалога, и ответ на него можно отдавать другим клиентам.
+
+    Нужны признаки самостоятельного вопроса — длина и термин нумерологии, — и
+    никаких признаков личного.
+    """
+    question = question.strip()
+    return (len(question) >= ANSWER_CACHE_MIN_LENGTH and NUMEROLOGY_PATTERN.search(question) is not None
+            and not is_personal(question))
+
+
+def mentions_client(answer, client_texts):
+    """Упоминает ли ответ слова с заглавной буквы из реплик клиента, прежде всего его имя."""
+    words = {word for text in client_texts for word in re.findall(r"\b[А-ЯЁA-Z][а-яёa-z]+", text)}
+    return any(re.search(rf"\b{re.escape(word)}\b", answer) for word in words)
+
+
+def numbers_signature(text):
+    """Числа из вопроса: ответы для разных дат и чисел не должны подменять друг друга."""
+    return tuple(re.findall(r'\d+', text))
+
+
+class AnswerCache:
+    """Кэш ответов GPT по эмбеддингу вопроса.
+
+    Векторы хранятся в заранее выделенной матрице на ``max_entries`` строк, поэтому
+    память ограничена; при переполнении вытесняется давно не использованная запись,
+    устаревшие по ``ttl`` записи не выдаются. Ответ переиспользуется, только если
+    сходство не ниже ``threshold`` и в вопросах совпадают все числа. Кэшируются
+    только вопросы, для которых ``is_standalone`` истинно.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._matrix = None
+        self._entries = OrderedDict()  # строка матрицы -> (числа, ответ, время записи, задержка генерации)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, question, vector):
+        """Возвращает сохранённый ответ на похожий вопрос или None."""
+        if not self.max_entries:
+            return None
+        vector = self._normalize(vector)
+        signature = numbers_signature(question)
+        now = time.monotonic()
+        with self._lock:
+            best_row, best_score = None, self.threshold
+            if self._entries:
+                rows = np.fromiter(self._entries.keys(), dtype=np.int64)
+                scores = self._matrix[rows] @ vector
+                for i in np.argsort(-scores):
+                    if scores[i] < best_score:
+                        break
+                    numbers, _, created, _ = self._entries[rows[i]]
+                    if numbers == signature and now - created <= self.ttl:
+                        best_row, best_score = int(rows[i]), float(scores[i])
+                        break
+
+            if best_row is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_row)
+            _, answer, _, latency = self._entries[best_row]
+            self.hits += 1
+            self.saved_seconds += latency
+        logger.info(f"Answer cache hit (similarity {best_score:.3f}); {self.stats()}")
+        return answer
+
+    def store(self, question, vector, answer, latency):
+        """Сохраняет ответ; ``latency`` — сколько заняла генерация, для учёта сэкономленного времени."""
+        if not self.max_entries:
+            return
+        vector = self._normalize(vector)
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            if len(self._entries) < self.max_entries:
+                row = len(self._entries)
+            else:
+                row, _ = self._entries.popitem(last=False)
+            self._matrix[row] = vector
+            self._entries[row] = (numbers_signature(question), answer, time.monotonic(), latency)
+
+    def clear(self):
+        """Сбрасывает сохранённые ответы, например после обновления базы знаний."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (f"hits={self.hits} misses={self.misses} hit_rate={hit_rate:.2%} "
+                f"saved={self.saved_seconds:.1f}s size={len(self._entries)}")
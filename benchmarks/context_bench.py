@@ -0,0 +1,143 @@
+"""Размер промпта и задержка ответа: прежний запрос против ContextBuilder.
+
+База знаний содержит обновлённый раздел, почти повторяющий старый, поэтому
+поиск часто возвращает похожие отрывки. Локальный сервер OpenAI замедляет
+первый токен пропорционально длине промпта и, как OpenAI, кэширует
+повторяющийся префикс от 1024 токенов. Для сравнения порядка частей
+отдельно прогоняется запрос, где изменчивые части стоят перед системным промптом.
+Прогон с ``vector=`` отключает быстрый путь BM25: так ищутся вопросы, для
+которых ключевые слова неоднозначны и поиск гибридный.
+
+Запуск: python benchmarks/context_bench.py [--questions 96] [--chats 16]
+"""
+import argparse
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+from fake_openai import FakeOpenAIServer
+from fakes import FakeEmbeddings, synthetic_database, synthetic_questions
+from langchain.docstore.document import Document
+from langchain.text_splitter import CharacterTextSplitter
+from langchain.vectorstores import FAISS
+from loguru import logger
+
+from context_builder import CONTEXT_CANDIDATES, ContextBuilder, legacy_prompt
+from memory import ConversationMemory
+from retrieval import HybridRetriever, QueryEmbeddingCache
+from tracing import OPENAI_COMPLETION_PRICE, OPENAI_PROMPT_PRICE
+
+SYSTEM = ("Ты — нумеролог-консультант. Отвечай доброжелательно и по существу, опираясь только на "
+          "отрывки документа. Если ответа в отрывках нет, честно скажи об этом и предложи уточнить вопрос. "
+          "Не давай медицинских, юридических и финансовых советов. ") * 24
+
+
+def knowledge_base():
+    """Синтетическая база, в конец которой добавлена слегка изменённая копия первых разделов."""
+    database = synthetic_database()
+    rng = random.Random(5)
+    updated = []
+    for line in database.splitlines()[:150]:
+        words = line.split(" ")
+        words[rng.randrange(4, len(words))] = "обновлено"
+        updated.append(" ".join(words))
+    return database + "\n" + "\n".join(updated)
+
+
+def run(label, make_messages, questions, chats):
+    ttft, total, prompt_tokens, cached_tokens, cost, found = [], [], [], [], [], 0
+
+    def ask(item):
+        question, marker = item
+        memory = ConversationMemory()
+        memory.add("user", "Меня зовут Анна, я родилась 7 марта 1990 года.")
+        memory.add("bot", "Приятно познакомиться, Анна! Ваше число судьбы — 2.")
+        memory.add("user", question)
+        messages = make_messages(question, memory.render())
+        started = time.perf_counter()
+        first = None
+        usage = None
+        for chunk in openai.ChatCompletion.create(model="gpt-4o", messages=messages, stream=True,
+                                                  stream_options={"include_usage": True}):
+            if chunk.choices and first is None:
+                first = time.perf_counter() - started
+            usage = chunk.get("usage") or usage
+        return first, time.perf_counter() - started, usage, marker in messages[-1]["content"] + messages[0]["content"]
+
+    # Свой сервер на каждый прогон, чтобы кэш префикса не переходил из прошлого прогона
+    with FakeOpenAIServer(first_token_latency=0.2, token_latency=0.002, prompt_token_latency=0.0004) as server, \
+            ThreadPoolExecutor(max_workers=chats) as pool:
+        openai.api_base = server.api_base
+        for first, elapsed, usage, hit in pool.map(ask, questions):
+            ttft.append(first)
+            total.append(elapsed)
+            cached = usage["prompt_tokens_details"]["cached_tokens"]
+            prompt_tokens.append(usage["prompt_tokens"])
+            cached_tokens.append(cached)
+            # Кэшированные токены промпта OpenAI берёт за полцены
+            cost.append(((usage["prompt_tokens"] - cached / 2) * OPENAI_PROMPT_PRICE
+                         + usage["completion_tokens"] * OPENAI_COMPLETION_PRICE) / 1e6)
+            found += hit
+    print(f"{label:<30} {statistics.mean(prompt_tokens):8.0f} {sum(cached_tokens) / sum(prompt_tokens):8.0%} "
+          f"{statistics.median(ttft) * 1000:9.0f} {statistics.median(total) * 1000:9.0f} "
+          f"{statistics.mean(cost) * 1000:9.3f} {found / len(questions):7.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=96)
+    parser.add_argument("--chats", type=int, default=16)
+    args = parser.parse_args()
+    logger.remove()
+
+    database = knowledge_base()
+    splitter = CharacterTextSplitter(separator="\n", chunk_size=1024, chunk_overlap=0)
+    chunks = [Document(page_content=chunk, metadata={}) for chunk in splitter.split_text(database)]
+    embeddings = FakeEmbeddings(latency=0)
+    retriever = HybridRetriever(FAISS.from_documents(chunks, embeddings), chunks, QueryEmbeddingCache(embeddings))
+    questions = synthetic_questions(database, count=args.questions)
+    builder = ContextBuilder()
+    dropped = {}
+
+    def before(question, dialogue):
+        docs = retriever.search(question, k=4)
+        return [{"role": "system", "content": SYSTEM}, {"role": "user", "content": legacy_prompt(docs, dialogue)}]
+
+    def packer(label, with_vector):
+        counts = dropped.setdefault(label, {"duplicates": 0, "low_score": 0, "over_budget": 0})
+
+        def packed(question, dialogue):
+            # С готовым эмбеддингом поиск всегда гибридный, без быстрого пути BM25
+            vector = retriever.embed_query(question) if with_vector else None
+            scored = retriever.search_scored(question, k=CONTEXT_CANDIDATES, vector=vector)
+            context = builder.build(SYSTEM, scored, dialogue)
+            for reason in counts:
+                counts[reason] += getattr(context, reason)
+            return context.messages
+        return packed
+
+    def varying_first(packed):
+        def reordered(question, dialogue):
+            system, user = packed(question, dialogue)
+            return [user, system]
+        return reordered
+
+    openai.api_key = "test"
+    print(f"{len(chunks)} chunks, {args.questions} questions from {args.chats} chats")
+    print(f"{'prompt':<30} {'tokens':>8} {'cached':>8} {'TTFT, ms':>9} {'total, ms':>9} {'m$/msg':>9} "
+          f"{'found':>7}")
+    run("before: 4 raw chunks", before, questions, args.chats)
+    run("ContextBuilder", packer("ContextBuilder", False), questions, args.chats)
+    run("ContextBuilder, vector=", packer("ContextBuilder, vector=", True), questions, args.chats)
+    run("ContextBuilder, varying first", varying_first(packer("varying first", False)), questions, args.chats)
+
+    print(f"\ncontext builder: {builder.requests} prompts, {builder.saved / builder.requests:.0f} tokens saved "
+          f"per prompt (memory.count_tokens)")
+    for label, counts in dropped.items():
+        print(f"dropped chunks, {label}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Пиковая память просмотра и выгрузки диалога пользователя со 100 тыс. сообщений.
+
+Запуск: python benchmarks/dialogue_export_bench.py [--messages 100000] [--pdf-messages 5000]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import fakes  # noqa: F401  (добавляет корень репозитория в sys.path)
+from loguru import logger
+
+from dialogue_export import export_dialogue, fetch_page
+from storage import Storage
+
+MESSAGE = "Расскажи подробнее, что означает моё число судьбы и как оно влияет на карьеру и отношения. " * 3
+
+
+def fetchall_baseline(storage, username):
+    """Прежний fetch_dialogue: все строки в память и одна большая строка."""
+    with storage.connection() as conn:
+        messages = conn.execute("SELECT message, direction, timestamp FROM messages WHERE username = ? "
+                                "ORDER BY timestamp", (username,)).fetchall()
+    dialogue = [f"{timestamp} {'Входящее' if direction == 'incoming' else 'Исходящее'}: {message}"
+                for message, direction, timestamp in messages]
+    return "\n".join(dialogue)
+
+
+def measure(label, fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size = os.path.getsize(result) / 2 ** 20 if isinstance(result, str) and os.path.exists(result) else None
+    print(f"{label:<26} {peak / 2 ** 20:>10.1f} {elapsed:>8.2f}" + (f"   file {size:.1f} MB" if size else ""))
+    if size:
+        os.remove(result)
+
+
+def fill(storage, username, count):
+    with storage.connection() as conn:
+        conn.executemany("INSERT INTO messages (username, message, direction) VALUES (?, ?, ?)",
+                         ((username, MESSAGE, "incoming" if i % 2 else "outgoing") for i in range(count)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--pdf-messages", type=int, default=5000)
+    args = parser.parse_args()
+    logger.remove()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "dialogue.db"))
+        storage.init_schema()
+        fill(storage, "heavy", args.messages)
+        fill(storage, "pdf", args.pdf_messages)
+
+        print(f"{args.messages} messages")
+        print(f"{'mode':<26} {'peak, MB':>10} {'time, s':>8}")
+        measure("fetchall (before)", lambda: fetchall_baseline(storage, "heavy"))
+        measure("first page", lambda: fetch_page(storage, "heavy"))
+        measure("export txt", lambda: export_dialogue(storage, "heavy", "txt"))
+        measure("export jsonl", lambda: export_dialogue(storage, "heavy", "jsonl"))
+        measure(f"export pdf ({args.pdf_messages})", lambda: export_dialogue(storage, "pdf", "pdf"))
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Нагрузочный тест диспетчера сообщений на заглушках Telegram и OpenAI.
+
+Каждый чат отправляет несколько сообщений подряд; задержка ответа считается от
+постановки сообщения в очередь до отправки ответа. Для сравнения тот же поток
+прогоняется через один воркер — так вёл себя прежний цикл ``bot.polling``.
+
+Запуск: python benchmarks/dispatcher_load.py [--openai-latency 0.3]
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+
+import fakes  # noqa: F401  (добавляет корень репозитория в sys.path)
+from loguru import logger
+
+from dispatcher import ChatDispatcher
+
+
+class FakeBot:
+    """Записывает время отправки ответа по каждому сообщению."""
+
+    def __init__(self, send_latency=0.005):
+        self.send_latency = send_latency
+        self.replies = {}
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, message_id):
+        time.sleep(self.send_latency)
+        with self._lock:
+            self.replies[message_id] = time.perf_counter()
+
+
+class FakeOpenAI:
+    """Ответ GPT с логнормальной задержкой вокруг заданной медианы."""
+
+    def __init__(self, median_latency, seed=1):
+        self.median_latency = median_latency
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def create(self, prompt):
+        with self._lock:
+            delay = self.median_latency * self._rng.lognormvariate(0, 0.3)
+        time.sleep(delay)
+        return f"Ответ на: {prompt}"
+
+
+def run(chats, messages_per_chat, workers, openai_latency):
+    dispatcher = ChatDispatcher(max_workers=workers, llm_concurrency=workers,
+                                max_pending=chats * messages_per_chat, max_pending_per_chat=messages_per_chat)
+    bot = FakeBot()
+    gpt = FakeOpenAI(openai_latency)
+    submitted = {}
+    order_violations = []
+    last_seen = {}
+
+    def process(chat_id, seq, message_id):
+        if last_seen.get(chat_id, -1) != seq - 1:
+            order_violations.append((chat_id, seq))
+        last_seen[chat_id] = seq
+        time.sleep(0.002)  # запись в SQLite и поиск по индексу
+        with dispatcher.llm_slot():
+            answer = gpt.create(message_id)
+        bot.send_message(chat_id, answer, message_id)
+
+    for seq in range(messages_per_chat):
+        for chat_id in range(chats):
+            message_id = (chat_id, seq)
+            submitted[message_id] = time.perf_counter()
+            dispatcher.submit(chat_id, process, chat_id, seq, message_id)
+    dispatcher.shutdown(wait=True)
+
+    latencies = sorted(bot.replies[key] - submitted[key] for key in submitted)
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return p50, p99, len(order_violations)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages-per-chat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    args = parser.parse_args()
+    logger.remove()
+
+    print(f"{'chats':>6} {'mode':<12} {'p50, s':>8} {'p99, s':>8} {'order errors':>13}")
+    for chats in (1, 10, 100):
+        modes = [("dispatcher", args.workers)]
+        if chats <= 10:
+            modes.append(("serial", 1))
+        for mode, workers in modes:
+            p50, p99, violations = run(chats, args.messages_per_chat, workers, args.openai_latency)
+            print(f"{chats:>6} {mode:<12} {p50:>8.2f} {p99:>8.2f} {violations:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Эмбеддинги: прямые запросы к API против EmbeddingService.
+
+API имитируется бэкендом с задержкой на запрос и на каждый текст; в сценарии
+с ошибками каждый N-й запрос отвечает временной ошибкой. Замеряются число
+запросов и эмбеддингов в секунду для пересборки базы знаний и для
+одновременных вопросов из многих чатов.
+
+Запуск: python benchmarks/embedding_bench.py [--texts 3000] [--chats 64] [--failure-every 3]
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fakes import synthetic_database, synthetic_questions
+from loguru import logger
+
+import embedding_service
+from embedding_service import EmbeddingService, LocalBackend
+
+
+class TransientError(Exception):
+    pass
+
+
+class SimulatedApi:
+    """Бэкенд с задержкой как у API эмбеддингов: один вызов — один HTTP-запрос."""
+
+    retryable = (TransientError,)
+
+    def __init__(self, request_latency=0.15, text_latency=0.0005, failure_every=0):
+        self.model = "simulated"
+        self.request_latency = request_latency
+        self.text_latency = text_latency
+        self.failure_every = failure_every
+        self.requests = 0
+        self._vectors = LocalBackend()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.requests += 1
+            failed = bool(self.failure_every) and self.requests % self.failure_every == 0
+        time.sleep(self.request_latency + self.text_latency * len(texts))
+        if failed:
+            raise TransientError("429 Too Many Requests")
+        return self._vectors.embed_documents(texts)
+
+
+def direct_documents(api, texts, chunk_size=1000):
+    """Как OpenAIEmbeddings: последовательные пачки по chunk_size, без повторов и дедупликации."""
+    vectors = []
+    for start in range(0, len(texts), chunk_size):
+        vectors.extend(api.embed_documents(texts[start:start + chunk_size]))
+    return vectors
+
+
+def run_bulk(label, embed, api, texts):
+    started = time.perf_counter()
+    try:
+        embed(texts)
+        status = "ok"
+    except TransientError:
+        status = "failed"
+    elapsed = time.perf_counter() - started
+    print(f"{label:<34} {len(texts) / elapsed:8.0f} {api.requests:9} {elapsed:8.2f}s  {status}")
+
+
+def run_queries(label, embed_query, api, questions, chats):
+    latencies = []
+
+    def chat(i):
+        rng = random.Random(i)
+        for _ in range(5):
+            time.sleep(rng.uniform(0, 0.2))
+            started = time.perf_counter()
+            embed_query(rng.choice(questions))
+            latencies.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=chats) as pool:
+        list(pool.map(chat, range(chats)))
+    latencies.sort()
+    print(f"{label:<34} {len(latencies):8} {api.requests:9} {statistics.median(latencies) * 1000:8.0f} "
+          f"{latencies[int(len(latencies) * 0.99)] * 1000:8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=int, default=3000)
+    parser.add_argument("--chats", type=int, default=64)
+    parser.add_argument("--failure-every", type=int, default=3)
+    args = parser.parse_args()
+    logger.remove()
+    embedding_service.EMBED_RETRY_DELAY = 0.05
+
+    paragraphs = synthetic_database(args.texts).split("\n")
+    # Около 10% отрывков повторяются, как одинаковые абзацы в документе
+    texts = paragraphs + paragraphs[:len(paragraphs) // 10]
+    questions = [question for question, _ in synthetic_questions("\n".join(paragraphs), count=100)]
+
+    print(f"{'bulk, ' + str(len(texts)) + ' texts':<34} {'texts/s':>8} {'requests':>9} {'time':>9}")
+    api = SimulatedApi()
+    run_bulk("direct, sequential", lambda items: direct_documents(api, items), api, texts)
+    api = SimulatedApi()
+    run_bulk("EmbeddingService", EmbeddingService(api).embed_documents, api, texts)
+    errors = f"every {args.failure_every} fails"
+    api = SimulatedApi(failure_every=args.failure_every)
+    run_bulk(f"direct, {errors}", lambda items: direct_documents(api, items), api, texts)
+    api = SimulatedApi(failure_every=args.failure_every)
+    run_bulk(f"EmbeddingService, {errors}", EmbeddingService(api).embed_documents, api, texts)
+    local = EmbeddingService(LocalBackend())
+    started = time.perf_counter()
+    local.embed_documents(texts)
+    print(f"{'EmbeddingService, local backend':<34} {len(texts) / (time.perf_counter() - started):8.0f} "
+          f"{local.requests:9}")
+
+    print()
+    print(f"{'queries, ' + str(args.chats) + ' chats':<34} {'queries':>8} {'requests':>9} {'p50, ms':>8} "
+          f"{'p99, ms':>8}")
+    api = SimulatedApi(request_latency=0.1)
+    run_queries("direct, one request per query", lambda text: api.embed_documents([text])[0], api, questions,
+                args.chats)
+    api = SimulatedApi(request_latency=0.1)
+    service = EmbeddingService(api)
+    run_queries("EmbeddingService, micro-batched", service.embed_query, api, questions, args.chats)
+    print(f"service stats: {service.stats()}")
+
+
+if __name__ == "__main__":
+    main()
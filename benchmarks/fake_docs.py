@@ -0,0 +1,49 @@
+"""Локальная замена экспорта Google Docs для бенчмарков.
+
+Отдаёт текст документа по ``/document/d/<id>/export`` с задержкой, ETag и
+ответом 304 на условный запрос; может имитировать недоступность сервиса.
+"""
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class DocumentServer:
+    def __init__(self, documents, latency):
+        self.documents = documents
+        self.latency = latency
+        self.failing = False
+        self.requests = 0
+        self.not_modified = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                time.sleep(server.latency)
+                server.requests += 1
+                doc_id = self.path.split("/")[3]
+                if server.failing or doc_id not in server.documents:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                data = server.documents[doc_id].encode("utf-8")
+                etag = f'"{hashlib.sha256(data).hexdigest()[:16]}"'
+                if self.headers.get("If-None-Match") == etag:
+                    server.not_modified += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.export_url = f"http://127.0.0.1:{self._httpd.server_address[1]}/document/d/{{}}/export"
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
@@ -0,0 +1,173 @@
+"""Локальная замена OpenAI Chat Completions API для бенчмарков.
+
+Сервер отвечает в формате ``/v1/chat/completions`` (обычном и потоковом SSE) с
+настраиваемой задержкой до первого токена и между токенами. С
+``stream_options.include_usage`` поток, как у OpenAI, завершается фрагментом с
+``usage`` и пустым ``choices``.
+
+С ``prompt_token_latency`` задержка до первого токена растёт с длиной промпта.
+Как у OpenAI, префикс промпта от 1024 токенов, уже встречавшийся в прошлых
+запросах, кэшируется: такие токены обрабатываются в ``cached_speedup`` раз
+быстрее и возвращаются в ``usage.prompt_tokens_details.cached_tokens``.
+
+Для проверки устойчивости клиента сервер умеет вносить сбои: доля запросов
+``failure_rate`` получает ответ 500, доля ``stall_rate`` начинает отвечать
+только через ``stall_latency`` секунд, модели из ``down_models`` отвечают 503.
+У каждой модели может быть своя задержка до первого токена (``model_latency``).
+Поток отдаётся с chunked-кодированием, поэтому соединения переиспользуются;
+``connections`` — сколько TCP-соединений открыли клиенты.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = ("Число судьбы 7 — число мудреца и исследователя. Такие люди ищут смысл за внешней "
+          "стороной событий, ценят уединение и глубокие знания. ") * 12
+
+
+class FakeOpenAIServer:
+    # Токены считаются как четыре символа; кэш префикса — от 1024 токенов с шагом 128
+    CACHE_MIN_CHARS = 4096
+    CACHE_STEP_CHARS = 512
+
+    def __init__(self, first_token_latency=0.5, token_latency=0.02, answer=ANSWER, prompt_token_latency=0.0,
+                 cached_speedup=10, model_latency=None, failure_rate=0.0, stall_rate=0.0, stall_latency=10.0,
+                 down_models=(), seed=1):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.answer = answer
+        self.prompt_token_latency = prompt_token_latency
+        self.cached_speedup = cached_speedup
+        self.model_latency = model_latency or {}
+        self.failure_rate = failure_rate
+        self.stall_rate = stall_rate
+        self.stall_latency = stall_latency
+        self.down_models = set(down_models)
+        self.requests = 0
+        self.model_requests = {}
+        self.connections = 0
+        self._random = random.Random(seed)
+        self._prefixes = set()
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with server._lock:
+                    server.requests += 1
+                    server.model_requests[body["model"]] = server.model_requests.get(body["model"], 0) + 1
+                try:
+                    server.handle(self, body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент отменил запрос, не дочитав ответ
+                    self.close_connection = True
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.api_base = f"http://127.0.0.1:{self._httpd.server_address[1]}/v1"
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    @staticmethod
+    def _send_json(handler, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def tokens(self, body):
+        return [word + " " for word in self.answer.split()]
+
+    def cached_chars(self, prompt):
+        """Длина самого длинного уже встречавшегося префикса промпта; запоминает префиксы этого."""
+        steps = range(self.CACHE_MIN_CHARS, len(prompt) + 1, self.CACHE_STEP_CHARS)
+        keys = [hashlib.sha256(prompt[:end].encode("utf-8")).digest() for end in steps]
+        with self._lock:
+            cached = 0
+            for end, key in zip(steps, keys):
+                if key not in self._prefixes:
+                    break
+                cached = end
+            self._prefixes.update(keys)
+        return cached
+
+    @staticmethod
+    def _write_chunk(handler, data):
+        handler.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        handler.wfile.flush()
+
+    def fault(self, model):
+        """Сбой для очередного запроса: код ответа с ошибкой, 'stall' или None."""
+        if model in self.down_models:
+            return 503
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.failure_rate:
+            return 500
+        if roll < self.failure_rate + self.stall_rate:
+            return "stall"
+        return None
+
+    def handle(self, handler, body):
+        fault = self.fault(body["model"])
+        if isinstance(fault, int):
+            time.sleep(0.05)
+            self._send_json(handler, fault, {"error": {"message": "Injected failure", "type": "server_error"}})
+            return
+        tokens = self.tokens(body)
+        prompt = "".join(f"{m['role']}:{m['content']}" for m in body["messages"])
+        prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+        cached_tokens = min(prompt_tokens, self.cached_chars(prompt) // 4)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens),
+                 "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        prefill = (prompt_tokens - cached_tokens + cached_tokens / self.cached_speedup) * self.prompt_token_latency
+        first_token_latency = self.model_latency.get(body["model"], self.first_token_latency)
+        time.sleep((self.stall_latency if fault == "stall" else first_token_latency) + prefill)
+        if not body.get("stream"):
+            time.sleep(self.token_latency * len(tokens))
+            self._send_json(handler, 200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        for token in tokens:
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "model": body["model"],
+                     "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            self._write_chunk(handler, f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            time.sleep(self.token_latency)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "model": body["model"],
+                     "choices": [], "usage": usage}
+            self._write_chunk(handler, f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self._write_chunk(handler, b"data: [DONE]\n\n")
+        self._write_chunk(handler, b"")
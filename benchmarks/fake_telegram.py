@@ -0,0 +1,112 @@
+"""Локальная замена Telegram Bot API для бенчмарков.
+
+Сервер принимает вызовы вида ``/bot<token>/<method>``, как настоящий Bot API, и
+ограничивает частоту так же: около одного сообщения в секунду в чат (с небольшим
+запасом) и ``global_rate`` сообщений в секунду всего. При превышении отвечает 429
+с ``retry_after``. Доставленные тексты запоминаются по чатам для проверки порядка.
+"""
+import json
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import telebot
+
+MESSAGE_METHODS = {"sendMessage", "sendSticker", "sendDocument", "editMessageText"}
+
+
+class FakeTelegramServer:
+    def __init__(self, chat_rate=1.0, chat_burst=3, global_rate=30, latency=0.03):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_rate = global_rate
+        self.latency = latency
+        self.delivered = defaultdict(list)
+        self.calls = defaultdict(int)
+        self.rate_limited = 0
+        self._buckets = {}
+        self._global = [global_rate, time.monotonic()]
+        self._message_ids = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._dispatch()
+
+            def do_POST(self):
+                self._dispatch()
+
+            def _dispatch(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if body and self.headers.get("Content-Type", "").startswith("application/json"):
+                    params.update(json.loads(body))
+                status, payload = server.handle(url.path.rsplit("/", 1)[-1], params)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self.api_url = self.base_url + "/bot{0}/{1}"
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        self._previous_url = telebot.apihelper.API_URL
+        telebot.apihelper.API_URL = self.api_url
+        return self
+
+    def __exit__(self, *exc):
+        telebot.apihelper.API_URL = self._previous_url
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _take(self, bucket, rate, capacity, now):
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+        bucket[0] = tokens - 1
+        return 0.0
+
+    def handle(self, method, params):
+        time.sleep(self.latency)
+        self.calls[method] += 1
+        if method not in MESSAGE_METHODS:
+            return 200, {"ok": True, "result": True}
+        chat_id = int(params["chat_id"])
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.setdefault(chat_id, [self.chat_burst, now])
+            wait = self._take(bucket, self.chat_rate, self.chat_burst, now)
+            if not wait:
+                wait = self._take(self._global, self.global_rate, self.global_rate, now)
+                if wait:
+                    bucket[0] += 1  # Сообщение не ушло — возвращаем токен чата
+            if wait:
+                self.rate_limited += 1
+                retry_after = max(1, round(wait))
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {retry_after}",
+                             "parameters": {"retry_after": retry_after}}
+            self._message_ids += 1
+            message_id = self._message_ids
+            self.delivered[chat_id].append(params.get("text") or method)
+        return 200, {"ok": True, "result": {"message_id": int(params.get("message_id", message_id)), "date": 0,
+                                            "chat": {"id": chat_id, "type": "private"},
+                                            "text": params.get("text", "")}}
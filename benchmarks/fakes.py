@@ -0,0 +1,131 @@
+"""Офлайн-заглушки для бенчмарков: эмбеддинги и синтетическая база знаний."""
+import hashlib
+import os
+import random
+import re
+import sys
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Модули бота лежат в корне репозитория
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SYLLABLES = ["ра", "ми", "ко", "ле", "ту", "на", "си", "во", "ди", "пе", "жа", "лу", "ро", "те", "ва"]
+
+NUMEROLOGY_WORDS = [
+    "число", "судьбы", "жизненного", "пути", "душа", "личность", "карма", "вибрация",
+    "энергия", "гармония", "лидер", "партнёрство", "творчество", "стабильность", "свобода",
+    "ответственность", "мудрость", "изобилие", "завершение", "мастер", "дата", "рождения",
+]
+
+
+class FakeEmbeddings(Embeddings):
+    """Детерминированные эмбеддинги с имитацией задержки API на каждый запрос.
+
+    Вектор текста — сумма случайных векторов его слов, поэтому тексты с общими
+    словами оказываются близки, как у настоящей модели.
+    """
+
+    def __init__(self, dim=256, latency=0.05, batch_size=16, model="fake-embedding"):
+        self.dim = dim
+        self.latency = latency
+        self.batch_size = batch_size
+        self.model = model
+        self.requests = 0
+        self.documents = 0  # Сколько текстов прошло через embed_documents
+
+    def _word_vector(self, word):
+        seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(self.dim)
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim)
+        for word in re.findall(r'\w+', text.lower()):
+            vector += self._word_vector(word)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).astype(np.float32).tolist()
+
+    def embed_documents(self, texts):
+        self.documents += len(texts)
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            self.requests += 1
+            time.sleep(self.latency)
+            vectors.extend(self._vector(text) for text in texts[start:start + self.batch_size])
+        return vectors
+
+    def embed_query(self, text):
+        self.requests += 1
+        time.sleep(self.latency)
+        return self._vector(text)
+
+
+def vocabulary(size=400, seed=3):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def synthetic_database(paragraphs=600, seed=7):
+    """Текст, похожий по структуре на документ `database`."""
+    rng = random.Random(seed)
+    vocab = vocabulary()
+    lines = []
+    for i in range(paragraphs):
+        number = i % 9 + 1
+        words = [rng.choice(NUMEROLOGY_WORDS) for _ in range(rng.randint(10, 20))]
+        words += [rng.choice(vocab) for _ in range(rng.randint(10, 20))]
+        rng.shuffle(words)
+        lines.append(f"Число {number}, раздел {i}: {' '.join(words)}.")
+    return "\n".join(lines)
+
+
+def synthetic_questions(database, count=200, seed=11):
+    """Вопросы к случайным строкам базы: пары (вопрос, маркер строки с ответом).
+
+    Половина вопросов называет номер раздела, остальные пересказывают строку
+    несколькими её словами.
+    """
+    rng = random.Random(seed)
+    lines = database.splitlines()
+    questions = []
+    for n in range(count):
+        line = rng.choice(lines)
+        marker, text = line.split(": ", 1)
+        section = marker.split("раздел ")[1]
+        words = rng.sample(text.rstrip(".").split(), 4)
+        if n % 2:
+            questions.append((f"Что сказано в разделе {section}?", f"{marker}:"))
+        else:
+            questions.append((f"Расскажи, что значит {' '.join(words)}", f"{marker}:"))
+    return questions
+
+
+
+# Справки на обычном русском и вопросы к ним, где слова стоят в других падежах и числах
+WORD_FORM_PASSAGES = [
+    ("Справка 1:", "Число судьбы показывает главную задачу человека в этой жизни.",
+     "Что показывает судьба числа?"),
+    ("Справка 2:", "Числа души показывают внутренние желания и скрытые мотивы.", "О чём говорит число души?"),
+    ("Справка 3:", "Душа и судьба человека связаны через дату рождения.", None),
+    ("Справка 4:", "Карма рода передаётся по линии отца вместе с фамилией.", "Как передаётся карма по линии отца?"),
+    ("Справка 5:", "Кармические уроки человек получает в отношениях с близкими.", None),
+    ("Справка 6:", "Год рождения влияет на характер сильнее, чем месяц.",
+     "Что влияет на характер: годы рождения или месяцы?"),
+    ("Справка 7:", "Личный месяц рассчитывается сложением личного года и номера месяца.",
+     "Как рассчитать личные месяцы?"),
+    ("Справка 8:", "Имя ребёнка выбирают так, чтобы его вибрация совпадала с числом пути.",
+     "Как выбрать имя по числу пути ребенку?"),
+    ("Справка 9:", "Путь человека определяется полной датой рождения.", "Как определить путь по дате рождения?"),
+    ("Справка 10:", "Дата свадьбы подбирается по числам имён супругов.", "Как подобрать даты свадеб по именам?"),
+]
+
+
+def word_form_questions():
+    """Пары (вопрос, маркер) к ``WORD_FORM_PASSAGES``; справки без вопроса только мешают поиску."""
+    return [(question, marker) for marker, _, question in WORD_FORM_PASSAGES if question]
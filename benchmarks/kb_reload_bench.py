@@ -0,0 +1,107 @@
+"""Горячее обновление базы знаний: полная пересборка против инкрементального обновления.
+
+Документ отдаёт локальный сервер с ETag. Пока идёт обновление, несколько
+потоков непрерывно ищут по базе знаний — замеряется, сколько запросов
+завершилось ошибкой и какой была самая долгая выдача.
+
+Запуск: python benchmarks/kb_reload_bench.py [--paragraphs 600] [--edits 3]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from fake_docs import DocumentServer
+from fakes import FakeEmbeddings, synthetic_database, synthetic_questions
+from loguru import logger
+
+
+class SearchLoad:
+    """Фоновые потоки, которые без остановки ищут по текущему поиску базы знаний."""
+
+    def __init__(self, knowledge, questions, threads=4):
+        self.knowledge = knowledge
+        self.questions = questions
+        self.searches = 0
+        self.errors = 0
+        self.slowest = 0.0
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._run, args=(i,), daemon=True) for i in range(threads)]
+
+    def __enter__(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, offset):
+        i = offset
+        while not self._stop.is_set():
+            question = self.questions[i % len(self.questions)][0]
+            started = time.perf_counter()
+            try:
+                self.knowledge.retriever.search(question, k=4)
+            except Exception:
+                self.errors += 1
+            self.slowest = max(self.slowest, time.perf_counter() - started)
+            self.searches += 1
+            i += 4
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paragraphs", type=int, default=600)
+    parser.add_argument("--edits", type=int, default=3)
+    args = parser.parse_args()
+    logger.remove()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["INDEX_CACHE_DIR"] = os.path.join(cache_dir, "index")
+        import knowledge_base
+        from knowledge_base import KnowledgeBase
+
+        database = synthetic_database(args.paragraphs)
+        questions = synthetic_questions(database)
+        server = DocumentServer({"system": "Ты — нумеролог.", "database": database}, latency=0.02)
+        knowledge_base.DOCUMENT_EXPORT_URL = server.export_url
+        embeddings = FakeEmbeddings(latency=0.05)
+        knowledge = KnowledgeBase("/document/d/system/edit", "/document/d/database/edit", lambda: embeddings,
+                                  cache_dir=os.path.join(cache_dir, "documents"), refresh_interval=0)
+
+        started = time.perf_counter()
+        knowledge.load()
+        chunks = len(knowledge.retriever.documents)
+        print(f"full build:           {(time.perf_counter() - started) * 1000:8.1f} ms, "
+              f"{embeddings.documents} chunks embedded, {chunks} chunks")
+
+        with SearchLoad(knowledge, questions) as load:
+            started = time.perf_counter()
+            changed = knowledge.refresh()
+            print(f"unchanged document:   {(time.perf_counter() - started) * 1000:8.1f} ms, reloaded: {changed}, "
+                  f"304 responses: {server.not_modified}")
+
+            edited = database
+            for i in range(args.edits):
+                edited = edited.replace(f"раздел {10 + i * 7}:", f"раздел {10 + i * 7} (дополнено, версия 2):", 1)
+            server.documents["database"] = edited
+            embedded_before = embeddings.documents
+            started = time.perf_counter()
+            knowledge.refresh()
+            elapsed = time.perf_counter() - started
+        print(f"{args.edits} paragraphs edited: {elapsed * 1000:8.1f} ms, "
+              f"{embeddings.documents - embedded_before} chunks embedded, "
+              f"{knowledge.retriever.vector_store.index.ntotal} vectors")
+        print(f"searches during reload: {load.searches}, errors: {load.errors}, "
+              f"slowest: {load.slowest * 1000:.1f} ms")
+
+        found = knowledge.retriever.search("дополнено версия 2", k=4)
+        print(f"edited content searchable: {any('версия 2' in doc.page_content for doc in found)}")
+
+
+if __name__ == "__main__":
+    main()
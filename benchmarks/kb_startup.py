@@ -0,0 +1,44 @@
+"""Время старта базы знаний: холодная сборка индекса против загрузки из кэша.
+
+Запуск: python benchmarks/kb_startup.py
+"""
+import tempfile
+import time
+
+from fakes import FakeEmbeddings, synthetic_database
+from langchain.docstore.document import Document
+from langchain.text_splitter import CharacterTextSplitter
+from langchain.vectorstores import FAISS
+
+from index_cache import IndexCache
+
+
+def split(text):
+    splitter = CharacterTextSplitter(separator="\n", chunk_size=1024, chunk_overlap=0)
+    return [Document(page_content=chunk, metadata={}) for chunk in splitter.split_text(text)]
+
+
+def measure(label, build):
+    embeddings = FakeEmbeddings()
+    started = time.perf_counter()
+    store = build(embeddings)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms  {embeddings.requests:4d} embedding requests  "
+          f"{store.index.ntotal} vectors")
+
+
+def main():
+    database = synthetic_database()
+    chunks = split(database)
+    edited = split(database.replace("раздел 10:", "раздел 10 (обновлён):", 1))
+    print(f"{len(chunks)} chunks")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        measure("from_documents (baseline)", lambda emb: FAISS.from_documents(chunks, emb))
+        measure("IndexCache cold build", lambda emb: IndexCache(cache_dir).load_or_build(chunks, emb))
+        measure("IndexCache warm load", lambda emb: IndexCache(cache_dir).load_or_build(chunks, emb))
+        measure("IndexCache one chunk edited", lambda emb: IndexCache(cache_dir).load_or_build(edited, emb))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Запросы к GPT напрямую через openai против LLMClient на сервере со сбоями.
+
+Локальный сервер OpenAI отвечает потоком; в сценариях он возвращает ошибки 500,
+зависает перед первым токеном или целиком отключает основную модель.
+Замеряются доля успешных ответов, время до первого фрагмента, число запросов
+к каждой модели и открытых соединений. Отдельно проверяется лимит запросов
+одного пользователя.
+
+Запуск: python benchmarks/llm_client_bench.py [--requests 200] [--concurrency 16]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fakes  # noqa: F401  (добавляет корень репозитория в sys.path)
+import openai
+from fake_openai import FakeOpenAIServer
+from loguru import logger
+
+import llm_client
+from llm_client import LLMClient, QuotaExceeded, UserLimiter, install_session
+
+MESSAGES = [{"role": "system", "content": "Ты — нумеролог."}, {"role": "user", "content": "Что значит число 7?"}]
+SCENARIOS = [
+    ("healthy", {}),
+    ("10% errors", {"failure_rate": 0.1}),
+    ("5% stalls of 8s", {"stall_rate": 0.05, "stall_latency": 8.0}),
+    ("gpt-4o down", {"down_models": ["gpt-4o"]}),
+]
+
+
+def direct(user):
+    return openai.ChatCompletion.create(model="gpt-4o", messages=MESSAGES, stream=True)
+
+
+def run(label, create, requests, concurrency, server_options):
+    def ask(i):
+        started = time.perf_counter()
+        try:
+            first = None
+            for _ in create(f"user{i}"):
+                if first is None:
+                    first = time.perf_counter() - started
+            return first
+        except Exception:
+            return None
+
+    with FakeOpenAIServer(token_latency=0.005, model_latency={"gpt-4o": 0.4, "gpt-4o-mini": 0.2},
+                          **server_options) as server:
+        openai.api_base = server.api_base
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(ask, range(requests)))
+        elapsed = time.perf_counter() - started
+    ok = sorted(r for r in results if r is not None)
+    p50, p95, p99 = (ok[min(len(ok) - 1, int(len(ok) * q))] * 1000 if ok else float("nan")
+                     for q in (0.5, 0.95, 0.99))
+    models = ", ".join(f"{model} {count}" for model, count in sorted(server.model_requests.items()))
+    print(f"{label:<34} {len(ok) / requests:6.0%} {p50:8.0f} {p95:8.0f} {p99:8.0f} {elapsed:7.1f}s "
+          f"{server.connections:5}  {models}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    logger.remove()
+    openai.api_key = "test"
+    llm_client.LLM_RETRY_DELAY = 0.1
+
+    print(f"{'':<34} {'ok':>6} {'TTFT p50':>8} {'p95':>8} {'p99, ms':>8} {'time':>8} {'conns':>5}  "
+          f"requests by model")
+    for name, options in SCENARIOS:
+        openai.requestssession = None  # openai по умолчанию: своя сессия в каждом потоке
+        run(f"{name}: direct", direct, args.requests, args.concurrency, options)
+        install_session()  # как при запуске бота: общий пул соединений
+        client = LLMClient(hedge_after=1.0, deadline=20, read_timeout=30)
+        run(f"{name}: LLMClient", lambda user: client.create(MESSAGES, user=user, stream=True),
+            args.requests, args.concurrency, options)
+        print(f"{'':<34} {client.stats()}")
+
+    # Один пользователь отправляет много вопросов сразу
+    limiter = UserLimiter(concurrency=2, quota=10, window=3600)
+    client = LLMClient(limiter=limiter)
+    with FakeOpenAIServer(first_token_latency=0.3, token_latency=0.005) as server:
+        openai.api_base = server.api_base
+
+        def ask(_):
+            try:
+                return "".join(chunk.choices[0].delta.get("content") or "" for chunk in
+                               client.create(MESSAGES, user="flood", stream=True) if chunk.choices)
+            except QuotaExceeded as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(ask, range(40)))
+    rejected = [r for r in results if isinstance(r, QuotaExceeded)]
+    print(f"\nper-user limit (2 concurrent, 10 per hour), 40 requests from one user: "
+          f"{len(results) - len(rejected)} answered, {len(rejected)} rejected, {server.requests} reached the API")
+
+
+if __name__ == "__main__":
+    main()
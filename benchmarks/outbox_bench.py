@@ -0,0 +1,117 @@
+"""Исходящие сообщения: прямые вызовы Bot API из воркеров против очереди Outbox.
+
+Одновременно несколько пользователей получают длинные ответы (несколько частей
+и стикер), а администраторы — массовый вывод страниц диалогов. Локальный сервер
+ведёт себя как Bot API с лимитами частоты и отвечает 429 при их превышении.
+
+Запуск: python benchmarks/outbox_bench.py [--chats 20] [--admins 60] [--pages 3]
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import fakes  # noqa: F401  (добавляет корень репозитория в sys.path)
+import telebot
+from fake_telegram import FakeTelegramServer
+from loguru import logger
+
+from outbox import BULK, INTERACTIVE, Outbox
+from streaming import split_message
+
+STICKER = "CAACAgIAAxkBAAIeeGZ6eXPrVYYAAWRJIHuhRDscfGvq9wACzDcAAkQsqUpvTd4i2f0HnTUE"
+ANSWER = ("Число судьбы 7 — число мудреца и исследователя, которое ищет смысл за внешней стороной событий. "
+          * 100).strip()
+
+
+def user_messages(chat_id):
+    return [("send_message", (chat_id, part)) for part in split_message(ANSWER)] + [
+        ("send_sticker", (chat_id, STICKER))]
+
+
+def admin_messages(chat_id, pages):
+    # Страницы почти во всё сообщение, поэтому склеить их нельзя
+    return [("send_message", (chat_id, f"Страница диалога №{i}\n" + "2024-01-01 Входящее: вопрос\n" * 100))
+            for i in range(pages)]
+
+
+def run_direct(bot, chats, admins, pages):
+    """Как до очереди: каждый воркер сам вызывает Bot API, ошибка 429 теряет сообщение."""
+    done = {}
+    errors = 0
+    started = time.perf_counter()
+
+    def send_all(chat_id, calls):
+        nonlocal errors
+        for method, args in calls:
+            try:
+                getattr(bot, method)(*args)
+            except telebot.apihelper.ApiTelegramException:
+                errors += 1
+        done[chat_id] = time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        for chat_id in admins:
+            pool.submit(send_all, chat_id, admin_messages(chat_id, pages))
+        for chat_id in chats:
+            pool.submit(send_all, chat_id, user_messages(chat_id))
+    return done, errors
+
+
+def run_outbox(bot, chats, admins, pages):
+    outbox = Outbox(bot)
+    started = time.perf_counter()
+    done = {}
+    futures = []
+
+    def finished(chat_id):
+        return lambda _: done.__setitem__(chat_id, time.perf_counter() - started)
+
+    for chat_id in admins:
+        for method, args in admin_messages(chat_id, pages):
+            futures.append(outbox.submit(chat_id, method, *args, priority=BULK))
+        futures[-1].add_done_callback(finished(chat_id))
+    for chat_id in chats:
+        for method, args in user_messages(chat_id):
+            futures.append(outbox.submit(chat_id, method, *args, priority=INTERACTIVE))
+        futures[-1].add_done_callback(finished(chat_id))
+    wait(futures)
+    errors = sum(1 for future in futures if future.exception() is not None)
+    return done, errors, outbox.stats()
+
+
+def report(name, server, done, errors, chats, admins, expected):
+    users = [done[chat_id] for chat_id in chats]
+    bulk = max(done[chat_id] for chat_id in admins)
+    in_order = all(server.delivered[chat_id] == expected[chat_id] for chat_id in chats)
+    print(f"{name:<8} {statistics.median(users):>10.2f} {max(users):>10.2f} {bulk:>10.2f} "
+          f"{server.rate_limited:>6} {errors:>6} {str(in_order):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--admins", type=int, default=60)
+    parser.add_argument("--pages", type=int, default=3)
+    args = parser.parse_args()
+    logger.remove()
+
+    admins = list(range(1, 1 + args.admins))
+    chats = list(range(1000, 1000 + args.chats))
+    expected = {chat_id: [call[1][1] if call[0] == "send_message" else "sendSticker"
+                          for call in user_messages(chat_id)] for chat_id in chats}
+    bot = telebot.TeleBot("123456:TEST", threaded=False)
+    print(f"{'mode':<8} {'user p50,s':>10} {'user max,s':>10} {'admin max,s':>10} {'429s':>6} {'lost':>6} "
+          f"{'in order':>8}")
+    with FakeTelegramServer() as server:
+        done, errors = run_direct(bot, chats, admins, args.pages)
+        report("direct", server, done, errors, chats, admins, expected)
+    with FakeTelegramServer() as server:
+        done, errors, stats = run_outbox(bot, chats, admins, args.pages)
+        report("outbox", server, done, errors, chats, admins, expected)
+    print(f"outbox stats: sent {stats['sent']}, retries {stats['retries']}, coalesced {stats['coalesced']}, "
+          f"send latency p50 {stats['latency_p50']:.2f}s p99 {stats['latency_p99']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
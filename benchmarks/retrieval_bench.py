@@ -0,0 +1,71 @@
+"""Офлайн-бенчмарк поиска по базе знаний: полнота и задержка на фиксированном наборе вопросов.
+
+Сравниваются векторный поиск FAISS (как раньше), BM25 и гибридный поиск с
+объединением рангов, кэшем эмбеддингов запросов и быстрым путём по ключевым словам.
+Отдельно считается точность первого результата на справках с обычным русским
+текстом, где слова в вопросе стоят в других формах («судьба числа» к отрывку
+«Число судьбы 7»).
+
+Запуск: python benchmarks/retrieval_bench.py
+"""
+import statistics
+import time
+
+from fakes import WORD_FORM_PASSAGES, FakeEmbeddings, synthetic_database, synthetic_questions, word_form_questions
+from langchain.docstore.document import Document
+from langchain.text_splitter import CharacterTextSplitter
+from langchain.vectorstores import FAISS
+from loguru import logger
+
+from retrieval import HybridRetriever, QueryEmbeddingCache
+
+K = 4
+
+
+def evaluate(label, questions, search, embeddings, k=K):
+    requests_before = embeddings.requests
+    hits, latencies = 0, []
+    for question, marker in questions:
+        started = time.perf_counter()
+        docs = search(question)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += any(marker in doc.page_content for doc in docs[:k])
+    print(f"{label:<22} {hits / len(questions):>9.2%} {statistics.mean(latencies):>10.1f} "
+          f"{statistics.quantiles(latencies, n=100)[98]:>10.1f} {embeddings.requests - requests_before:>9d}")
+
+
+def main():
+    logger.remove()
+    database = synthetic_database()
+    splitter = CharacterTextSplitter(separator="\n", chunk_size=1024, chunk_overlap=0)
+    chunks = [Document(page_content=chunk, metadata={}) for chunk in splitter.split_text(database)]
+    # Каждый вопрос задаётся дважды, как это бывает у разных пользователей
+    questions = synthetic_questions(database) * 2
+
+    embeddings = FakeEmbeddings(latency=0)
+    store = FAISS.from_documents(chunks, embeddings)
+    embeddings.latency = 0.05  # задержка API эмбеддингов на запрос
+    retriever = HybridRetriever(store, chunks, QueryEmbeddingCache(embeddings))
+
+    print(f"{len(chunks)} chunks, {len(questions)} questions, recall@{K}")
+    print(f"{'mode':<22} {'recall':>9} {'mean, ms':>10} {'p99, ms':>10} {'embed req':>9}")
+    evaluate("FAISS only (before)", questions, lambda q: store.similarity_search(q, k=K), embeddings)
+    evaluate("BM25 only", questions,
+             lambda q: [retriever.documents[i] for i, _ in retriever.keyword_index.search(q, K)], embeddings)
+    evaluate("hybrid", questions, lambda q: retriever.search(q, k=K), embeddings)
+    print(f"keyword fast path: {retriever.fast_path_hits} queries; "
+          f"query cache: {retriever.query_cache.hits} hits, {retriever.query_cache.misses} misses")
+
+    # Отдельная небольшая база из справок, каждая — свой отрывок
+    passages = [Document(page_content=f"{marker} {text}", metadata={}) for marker, text, _ in WORD_FORM_PASSAGES]
+    embeddings.latency = 0
+    forms = HybridRetriever(FAISS.from_documents(passages, embeddings), passages, QueryEmbeddingCache(embeddings))
+    word_forms = word_form_questions()
+    print(f"\nword forms: {len(word_forms)} questions, recall@1")
+    evaluate("BM25 only", word_forms,
+             lambda q: [forms.documents[i] for i, _ in forms.keyword_index.search(q, 1)], embeddings, k=1)
+    evaluate("hybrid", word_forms, lambda q: forms.search(q, k=1), embeddings, k=1)
+
+
+if __name__ == "__main__":
+    main()
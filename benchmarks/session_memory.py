@@ -0,0 +1,84 @@
+"""Память процесса на 100 тыс. чатов: прежние словари против SessionStore с вытеснением.
+
+Запуск: python benchmarks/session_memory.py [--chats 100000]
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+import fakes  # noqa: F401  (добавляет корень репозитория в sys.path)
+from loguru import logger
+
+from memory import ConversationMemory
+from sessions import SessionStore
+from storage import Storage
+
+QUESTION = "Меня зовут Анна, я родилась 12.03.1990. Какое у меня число судьбы и что оно значит? "
+ANSWER = "Твоё число судьбы — 7. Это число мудреца и исследователя, оно говорит о тяге к знаниям. " * 4
+
+
+def dicts_baseline(chats, turns):
+    chat_histories, chat_summaries, dialog_states = {}, {}, {}
+    for chat_id in range(chats):
+        dialog_states[chat_id] = "active"
+        chat_histories[chat_id] = []
+        chat_summaries[chat_id] = ""
+        for _ in range(turns):
+            chat_histories[chat_id].append(("user", QUESTION))
+            chat_summaries[chat_id] = f"{chat_summaries[chat_id]} User: {QUESTION}"[-5000:]
+            chat_histories[chat_id].append(("bot", ANSWER))
+            chat_summaries[chat_id] += f" Bot: {ANSWER}"
+    return chat_histories, chat_summaries, dialog_states
+
+
+def session_store(chats, turns, storage, max_count):
+    store = SessionStore(storage, max_count=max_count, sweep_interval=0)
+    for chat_id in range(chats):
+        session = store.get(chat_id)
+        session.state = "active"
+        session.memory = ConversationMemory()
+        for _ in range(turns):
+            session.memory.add("user", QUESTION)
+            session.memory.add("bot", ANSWER)
+    return store
+
+
+def measure(label, build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} {current / 2 ** 20:>10.1f} {peak / 2 ** 20:>10.1f} {elapsed:>8.1f}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=100000)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--max-count", type=int, default=10000)
+    args = parser.parse_args()
+    logger.remove()
+
+    print(f"{'mode':<28} {'held, MB':>10} {'peak, MB':>10} {'time, s':>8}")
+    baseline = measure("dicts (before)", lambda: dicts_baseline(args.chats, args.turns))
+    del baseline
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "sessions.db"))
+        store = measure(f"SessionStore max={args.max_count}",
+                        lambda: session_store(args.chats, args.turns, storage, args.max_count))
+        started = time.perf_counter()
+        session = store.get(0)  # давно вытесненный чат поднимается из базы
+        print(f"{len(store)} sessions in memory; rehydrated chat 0 with {len(session.memory.turns)} turns "
+              f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
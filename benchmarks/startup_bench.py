@@ -0,0 +1,107 @@
+"""Старт бота: стоимость импортов и время до готовности базы знаний.
+
+Импорты замеряются через ``python -X importtime`` в отдельном процессе: всё, что
+main.py импортирует при загрузке, против прежнего набора, где сразу грузились
+openai, langchain и FAISS. Затем KnowledgeBase загружается с локального сервера
+документов с задержкой: замеряется, когда бот может отвечать на /start и когда
+база знаний готова, а также загрузка из копий на диске при недоступном сервере.
+
+Запуск: python benchmarks/startup_bench.py [--doc-latency 1.0]
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_docs import DocumentServer
+from fakes import ROOT, FakeEmbeddings, synthetic_database
+from loguru import logger
+
+# Модули, которые main.py импортировал при загрузке до фоновой загрузки базы знаний
+DEFERRED_IMPORTS = ["import openai", "from langchain.embeddings.openai import OpenAIEmbeddings",
+                    "from langchain.text_splitter import CharacterTextSplitter",
+                    "from langchain.docstore.document import Document", "import index_cache", "import retrieval"]
+
+
+def module_imports(path):
+    """Импорты верхнего уровня модуля в виде исходного кода."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+def import_time(statements):
+    """Запускает импорты с ``-X importtime``; возвращает общее время и самые дорогие пакеты, мс."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "\n".join(statements)], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    total = 0
+    packages = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        total += int(self_us)
+        if not name[1:].startswith(" "):
+            packages.append((int(cumulative_us) / 1000, name.strip()))
+    return total / 1000, sorted(packages, reverse=True)
+
+
+def measure_ready(label, knowledge_base):
+    started = time.perf_counter()
+    knowledge_base.start()
+    serving = time.perf_counter() - started
+    ready = knowledge_base.wait(timeout=60)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<34} {serving * 1000:10.1f} {elapsed * 1000 if ready else float('nan'):10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--doc-latency", type=float, default=1.0)
+    args = parser.parse_args()
+    logger.remove()
+
+    startup = module_imports(os.path.join(ROOT, "main.py"))
+    for label, statements in (("eager imports (before)", startup + DEFERRED_IMPORTS), ("startup imports", startup)):
+        total, packages = import_time(statements)
+        top = ", ".join(f"{name} {ms:.0f}" for ms, name in packages[:6])
+        print(f"{label:<24} {total:7.0f} ms   top: {top}")
+    print()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["INDEX_CACHE_DIR"] = os.path.join(cache_dir, "index")
+        import knowledge_base
+        from knowledge_base import KnowledgeBase
+
+        server = DocumentServer({"system": "Ты — нумеролог.", "database": synthetic_database(200)},
+                                args.doc_latency)
+        knowledge_base.DOCUMENT_EXPORT_URL = server.export_url
+        documents = os.path.join(cache_dir, "documents")
+
+        def create():
+            return KnowledgeBase("/document/d/system/edit", "/document/d/database/edit",
+                                 lambda: FakeEmbeddings(latency=0.02), cache_dir=documents)
+
+        create().load()  # Индекс и копии документов уже на диске, как при обычном перезапуске
+        print(f"{'':<34} {'/start, ms':>10} {'ready, ms':>10}")
+        # Прежде бот не отвечал ни на что, пока база знаний не загрузится
+        started = time.perf_counter()
+        create().load()
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{'synchronous load (as before)':<34} {elapsed:10.1f} {elapsed:10.1f}")
+        measure_ready("background load", create())
+        server.failing = True
+        measure_ready("background, Docs down, disk copy", create())
+        with tempfile.TemporaryDirectory() as empty:
+            knowledge = KnowledgeBase("/document/d/system/edit", "/document/d/database/edit", FakeEmbeddings,
+                                      cache_dir=empty)
+            knowledge.start()
+            print(f"{'background, Docs down, no copy':<34} {'serving':>10} "
+                  f"{'ready' if knowledge.wait(timeout=args.doc_latency * 3) else 'waiting':>10}")
+
+
+if __name__ == "__main__":
+    main()
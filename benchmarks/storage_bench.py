@@ -0,0 +1,109 @@
+"""Микробенчмарк users.db: соединение на каждый вызов против пула с WAL и пакетной записью.
+
+Запуск: python benchmarks/storage_bench.py [--messages 5000]
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import fakes  # noqa: F401  (добавляет корень репозитория в sys.path)
+from loguru import logger
+
+from storage import Storage
+
+USERS = [f"user{i}" for i in range(200)]
+
+
+def baseline_schema(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE IF NOT EXISTS allowed_users (username TEXT PRIMARY KEY)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, message TEXT, direction TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    conn.executemany("INSERT INTO allowed_users (username) VALUES (?)", [(u,) for u in USERS[::2]])
+    conn.commit()
+    conn.close()
+
+
+def baseline_log(path, username, message, direction):
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO messages (username, message, direction) VALUES (?, ?, ?)", (username, message, direction))
+    conn.commit()
+    conn.close()
+
+
+def baseline_allowed(path, username):
+    conn = sqlite3.connect(path)
+    user = conn.execute("SELECT username FROM allowed_users WHERE username = ?", (username,)).fetchone()
+    conn.close()
+    return user is not None
+
+
+def baseline_dialogue(path, username):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT message, direction, timestamp FROM messages WHERE username = ? ORDER BY timestamp",
+                        (username,)).fetchall()
+    conn.close()
+    return rows
+
+
+def pooled_allowed(storage, username):
+    with storage.connection() as conn:
+        return conn.execute("SELECT username FROM allowed_users WHERE username = ?", (username,)).fetchone() is not None
+
+
+def pooled_dialogue(storage, username):
+    with storage.connection() as conn:
+        return conn.execute("SELECT message, direction, timestamp FROM messages WHERE username = ? ORDER BY timestamp",
+                            (username,)).fetchall()
+
+
+def latency_us(fn, repeat=500):
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(USERS[i % len(USERS)])
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples)
+
+
+def report(label, inserts_per_sec, allowed_us, dialogue_us):
+    print(f"{label:<10} {inserts_per_sec:>12.0f} {allowed_us:>14.1f} {dialogue_us:>15.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    args = parser.parse_args()
+    logger.remove()
+
+    print(f"{'mode':<10} {'inserts/sec':>12} {'allowed, us':>14} {'dialogue, us':>15}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "baseline.db")
+        baseline_schema(path)
+        started = time.perf_counter()
+        for i in range(args.messages):
+            baseline_log(path, USERS[i % len(USERS)], f"сообщение {i}", "incoming")
+        inserts = args.messages / (time.perf_counter() - started)
+        report("before", inserts, latency_us(lambda u: baseline_allowed(path, u)),
+               latency_us(lambda u: baseline_dialogue(path, u)))
+
+        path = os.path.join(tmp, "pooled.db")
+        baseline_schema(path)
+        storage = Storage(path)
+        storage.init_schema()
+        started = time.perf_counter()
+        for i in range(args.messages):
+            storage.log_message(USERS[i % len(USERS)], f"сообщение {i}", "incoming")
+        storage.flush()
+        inserts = args.messages / (time.perf_counter() - started)
+        report("after", inserts, latency_us(lambda u: pooled_allowed(storage, u)),
+               latency_us(lambda u: pooled_dialogue(storage, u)))
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
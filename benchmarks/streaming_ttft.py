@@ -0,0 +1,78 @@
+"""Время до первого видимого текста: ответ целиком против потоковой выдачи с правками.
+
+Запуск: python benchmarks/streaming_ttft.py [--runs 5]
+"""
+import argparse
+import statistics
+import time
+from types import SimpleNamespace
+
+import fakes  # noqa: F401  (добавляет корень репозитория в sys.path)
+import openai
+from fake_openai import FakeOpenAIServer
+from loguru import logger
+
+from streaming import StreamingReply, split_message
+
+
+class FakeBot:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_text_at = None
+        self.sends = 0
+        self.edits = 0
+
+    def _seen(self):
+        if self.first_text_at is None:
+            self.first_text_at = time.perf_counter() - self.started
+
+    def send_message(self, chat_id, text):
+        self._seen()
+        self.sends += 1
+        return SimpleNamespace(message_id=self.sends)
+
+    def edit_message_text(self, text, chat_id, message_id):
+        self.edits += 1
+
+
+MESSAGES = [{"role": "user", "content": "Что значит число судьбы 7?"}]
+
+
+def blocking(bot):
+    completion = openai.ChatCompletion.create(model="gpt-4o", messages=MESSAGES)
+    for part in split_message(completion.choices[0].message.content):
+        bot.send_message(1, part)
+
+
+def streaming(bot, edit_interval):
+    reply = StreamingReply(bot, 1, edit_interval=edit_interval)
+    for chunk in openai.ChatCompletion.create(model="gpt-4o", messages=MESSAGES, stream=True):
+        reply.feed(chunk.choices[0].delta.get("content"))
+    reply.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--edit-interval", type=float, default=1.0)
+    args = parser.parse_args()
+    logger.remove()
+
+    with FakeOpenAIServer(first_token_latency=0.5, token_latency=0.01) as server:
+        openai.api_base = server.api_base
+        openai.api_key = "test"
+        print(f"{'mode':<10} {'first text, s':>14} {'full reply, s':>14} {'edits':>6}")
+        for mode, run in (("blocking", blocking), ("streaming", lambda b: streaming(b, args.edit_interval))):
+            first, total, edits = [], [], []
+            for _ in range(args.runs):
+                bot = FakeBot()
+                run(bot)
+                first.append(bot.first_text_at)
+                total.append(time.perf_counter() - bot.started)
+                edits.append(bot.edits)
+            print(f"{mode:<10} {statistics.median(first):>14.2f} {statistics.median(total):>14.2f} "
+                  f"{statistics.median(edits):>6.0f}")
+
+
+if __name__ == "__main__":
+    main()
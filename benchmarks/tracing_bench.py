@@ -0,0 +1,163 @@
+"""Трассировка обработки сообщений: накладные расходы и разбивка задержки по этапам.
+
+Сначала замеряется, во сколько микросекунд на сообщение обходятся замеры
+этапов при разной доле трассируемых сообщений. Затем поток вопросов из многих
+чатов проходит те же этапы, что и в main.py, на заглушках: запись в SQLite,
+эмбеддинг вопроса и гибридный поиск, потоковый ответ локального сервера OpenAI
+и правки сообщения в Telegram. Печатаются p50/p99 этапов, токены и стоимость,
+а также фрагмент ответа эндпоинта /metrics.
+
+Запуск: python benchmarks/tracing_bench.py [--messages 200] [--chats 16]
+"""
+import argparse
+import os
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+import openai
+from fake_openai import FakeOpenAIServer
+from fakes import FakeEmbeddings, synthetic_database, synthetic_questions
+from langchain.docstore.document import Document
+from langchain.text_splitter import CharacterTextSplitter
+from langchain.vectorstores import FAISS
+from loguru import logger
+
+from retrieval import HybridRetriever, QueryEmbeddingCache
+from storage import Storage
+from streaming import StreamingReply
+from tracing import MetricsServer, Tracer
+
+STAGES = ["access", "kb_wait", "sqlite_log", "memory", "embed", "answer_cache", "search", "llm", "deliver"]
+
+
+class FakeBot:
+    """Отправка и правка сообщения с задержкой Bot API."""
+
+    def __init__(self, latency=0.03):
+        self.latency = latency
+
+    def send_message(self, chat_id, text):
+        time.sleep(self.latency)
+        return SimpleNamespace(message_id=1)
+
+    def edit_message_text(self, text, chat_id, message_id):
+        time.sleep(self.latency)
+
+
+def overhead(iterations):
+    """Микросекунды на сообщение из девяти этапов без трассировки и с разной долей трасс."""
+    empty = nullcontext()
+
+    def untraced():
+        for stage in STAGES:
+            with empty:
+                pass
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        untraced()
+    baseline = (time.perf_counter() - started) / iterations * 1e6
+    print(f"{'tracing overhead':<22} {'us/message':>11}")
+    print(f"{'no spans':<22} {baseline:11.2f}")
+    for rate in (0.0, 0.1, 1.0):
+        tracer = Tracer(sample_rate=rate)
+
+        @tracer.traced("message")
+        def handle():
+            for stage in STAGES:
+                with tracer.span(stage):
+                    pass
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            handle()
+        print(f"{'sample rate ' + format(rate, 'g'):<22} {(time.perf_counter() - started) / iterations * 1e6:11.2f}")
+
+
+def pipeline(tracer, storage, retriever, bot):
+    """Этапы process_message из main.py на заглушках."""
+
+    @tracer.traced("message")
+    def handle(chat_id, question):
+        with tracer.span("sqlite_log"):
+            storage.log_message(f"user{chat_id}", question, "incoming")
+        with tracer.span("embed"):
+            vector = retriever.embed_query(question)
+        with tracer.span("search"):
+            docs = retriever.search(question, k=4, vector=vector)
+        content = "\n".join(doc.page_content for doc in docs)
+        with tracer.span("llm"):
+            reply = StreamingReply(bot, chat_id, edit_interval=0.2)
+            for chunk in openai.ChatCompletion.create(
+                    model="gpt-4o", messages=[{"role": "system", "content": "Ты — нумеролог."},
+                                              {"role": "user", "content": f"{content}\n\n{question}"}],
+                    stream=True, stream_options={"include_usage": True}):
+                if chunk.choices:
+                    reply.feed(chunk.choices[0].delta.get("content"))
+                tracer.record_usage(chunk.get("usage"), chunk.get("model"))
+            answer = reply.finish()
+            tracer.observe("first_text", reply.first_text_at)
+        with tracer.span("deliver"):
+            storage.log_message(f"user{chat_id}", answer, "outgoing")
+
+    return handle
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=16)
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+    logger.remove()
+
+    overhead(args.iterations)
+    print()
+
+    database = synthetic_database()
+    splitter = CharacterTextSplitter(separator="\n", chunk_size=1024, chunk_overlap=0)
+    chunks = [Document(page_content=chunk, metadata={}) for chunk in splitter.split_text(database)]
+    embeddings = FakeEmbeddings(latency=0)
+    store = FAISS.from_documents(chunks, embeddings)
+    embeddings.latency = 0.05
+    retriever = HybridRetriever(store, chunks, QueryEmbeddingCache(embeddings))
+    questions = [question for question, _ in synthetic_questions(database, count=args.messages)]
+
+    tracer = Tracer(sample_rate=1.0)
+    metrics = MetricsServer(tracer, port=0).start()
+    tracer.register("bot_query_cache_hits", lambda: retriever.query_cache.hits, "Query embedding cache hits",
+                    "counter")
+    with tempfile.TemporaryDirectory() as tmp, FakeOpenAIServer(first_token_latency=0.3, token_latency=0.005) as server:
+        openai.api_base = server.api_base
+        openai.api_key = "test"
+        storage = Storage(os.path.join(tmp, "users.db"))
+        storage.init_schema()
+        handle = pipeline(tracer, storage, retriever, FakeBot())
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.chats) as pool:
+            list(pool.map(lambda item: handle(item[0] % args.chats, item[1]), enumerate(questions)))
+        elapsed = time.perf_counter() - started
+        storage.close()
+
+    print(f"{args.messages} messages from {args.chats} chats in {elapsed:.1f}s")
+    print(f"{'stage':<22} {'p50, ms':>8} {'p99, ms':>8} {'count':>6}")
+    for stage, (p50, p99, count) in tracer.summary().items():
+        print(f"{stage:<22} {p50 * 1000:8.0f} {p99 * 1000:8.0f} {count:6}")
+    print(f"tokens: {tracer.prompt_tokens} prompt + {tracer.completion_tokens} completion, "
+          f"${tracer.cost:.4f} (${tracer.cost / args.messages:.5f}/message)")
+
+    with urllib.request.urlopen(f"http://127.0.0.1:{metrics.port}/metrics") as response:
+        lines = response.read().decode("utf-8").splitlines()
+    metrics.shutdown()
+    print(f"\n/metrics: {len(lines)} lines, e.g.")
+    for line in lines:
+        if line.startswith(('bot_stage_seconds_count{handler="message",stage="llm"}', "bot_openai", "bot_query")):
+            print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Пропускная способность webhook: воспроизведение записанного потока обновлений.
+
+Поток — файл JSONL с обновлениями Telegram (``--updates``); без него создаётся
+синтетический, где часть обновлений доставлена повторно, как при ретраях
+Telegram. Обновления отправляются на WebhookServer параллельными соединениями,
+обработчик ставит задачу в ChatDispatcher. Проверяется, что каждое сообщение
+обработано ровно один раз и по порядку внутри чата.
+
+Запуск: python benchmarks/webhook_bench.py [--updates stream.jsonl] [--count 5000] [--clients 8]
+"""
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import fakes  # noqa: F401  (добавляет корень репозитория в sys.path)
+import requests
+import telebot
+from loguru import logger
+
+from dispatcher import ChatDispatcher
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = "benchmark-secret"
+
+
+def synthetic_stream(count, chats, duplicate_rate, seed=1):
+    rng = random.Random(seed)
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_id = rng.randrange(chats) + 1
+        updates.append({"update_id": update_id, "message": {
+            "message_id": update_id, "date": 0, "text": f"Вопрос {update_id}",
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User", "username": f"user{chat_id}"}}})
+        if rng.random() < duplicate_rate:
+            updates.append(updates[-1])
+    return updates
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", help="записанный поток обновлений, по одному JSON в строке")
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--duplicates", type=float, default=0.05)
+    parser.add_argument("--clients", type=int, default=8)
+    args = parser.parse_args()
+    logger.remove()
+
+    if args.updates:
+        with open(args.updates, encoding="utf-8") as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = synthetic_stream(args.count, args.chats, args.duplicates)
+
+    bot = telebot.TeleBot("123456:TEST", threaded=False)
+    dispatcher = ChatDispatcher(max_pending=len(updates), max_pending_per_chat=len(updates))
+    handled = defaultdict(list)
+    lock = threading.Lock()
+
+    def process(message):
+        time.sleep(0.002)
+        with lock:
+            handled[message.chat.id].append(message.message_id)
+
+    @bot.message_handler(func=lambda message: True, content_types=["text"])
+    def handle_message(message):
+        dispatcher.submit(message.chat.id, process, message)
+
+    server = WebhookServer(bot, url="http://127.0.0.1/telegram", secret=SECRET, host="127.0.0.1", port=0)
+    threading.Thread(target=server.run, kwargs={"register": False}, daemon=True).start()
+    url = f"http://127.0.0.1:{server.port}/telegram"
+
+    # Клиенты делят поток по чатам, как Telegram не шлёт следующее обновление чата до ответа на предыдущее
+    streams = defaultdict(list)
+    for update in updates:
+        chat_id = update["message"]["chat"]["id"]
+        streams[chat_id % args.clients].append(update)
+    latencies = []
+
+    def replay(stream):
+        session = requests.Session()
+        for update in stream:
+            started = time.perf_counter()
+            response = session.post(url, data=json.dumps(update), headers={SECRET_HEADER: SECRET})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        list(pool.map(replay, streams.values()))
+    accepted = time.perf_counter() - started
+    dispatcher.shutdown(wait=True)
+    total = time.perf_counter() - started
+
+    rejected = requests.post(url, data="{}", headers={SECRET_HEADER: "wrong"}).status_code
+    expected = defaultdict(list)
+    for update in {update["update_id"]: update for update in updates}.values():
+        expected[update["message"]["chat"]["id"]].append(update["message"]["message_id"])
+    latencies.sort()
+    print(f"updates sent:        {len(updates)} ({server.dedup.duplicates} duplicates skipped)")
+    print(f"accepted:            {len(updates) / accepted:.0f} updates/s over {args.clients} connections")
+    print(f"processed:           {sum(map(len, handled.values())) / total:.0f} messages/s")
+    print(f"response latency:    p50 {statistics.median(latencies) * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+    print(f"exactly once, ordered: {dict(handled) == dict(expected)}")
+    print(f"wrong secret:        HTTP {rejected}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import os
+import threading
+from functools import lru_cache
+
+from loguru import logger
+
+from memory import count_tokens
+from retrieval import tokenize
+
+# Бюджет токенов на отрывки базы знаний в запросе к модели
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Сколько отрывков запрашивать у поиска перед упаковкой в бюджет
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "6"))
+# Отрывки с оценкой ниже этой доли от лучшей отбрасываются
+CONTEXT_MIN_SCORE = float(os.getenv("CONTEXT_MIN_SCORE", "0.35"))
+# Доля общих слов, при которой отрывок считается почти повтором уже выбранного
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+
+INSTRUCTION = "Документ с информацией для ответа клиента:"
+
+
+@lru_cache(maxsize=4096)
+def chunk_tokens(text: str) -> int:
+    """Токены отрывка; отрывки повторяются от запроса к запросу, поэтому счёт кэшируется."""
+    return count_tokens(text)
+
+
+def overlap(a: set, b: set) -> float:
+    """Коэффициент Жаккара для множеств слов двух отрывков."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def legacy_prompt(docs, dialogue: str) -> str:
+    """Прежний текст запроса: все найденные отрывки с заголовками, без бюджета."""
+    content = '\n '.join([f'\nОтрывок документа №{i + 1}\n=====================' + doc.page_content + '\n'
+                          for i, doc in enumerate(docs)])
+    return f"{INSTRUCTION} {content}\n\nВопрос клиента: {dialogue}"
+
+
+class PromptContext:
+    """Сообщения для ChatCompletion и учёт того, что не попало в запрос."""
+
+    __slots__ = ("messages", "tokens", "saved", "chunks", "duplicates", "low_score", "over_budget")
+
+    def __init__(self, messages, tokens, saved, chunks, duplicates, low_score, over_budget):
+        self.messages = messages
+        self.tokens = tokens
+        self.saved = saved
+        self.chunks = chunks
+        self.duplicates = duplicates
+        self.low_score = low_score
+        self.over_budget = over_budget
+
+    def describe(self) -> str:
+        return (f"{self.tokens} context tokens, {self.saved} saved; {self.chunks} chunks, dropped "
+                f"{self.duplicates} duplicate, {self.low_score} low-score, {self.over_budget} over budget")
+
+
+class ContextBuilder:
+    """Сборка запроса к модели из системного промпта, отрывков базы знаний и истории диалога.
+
+    Отрывки берутся по убыванию оценки поиска: слабые (ниже ``min_score`` от
+    лучшей) и почти повторяющие уже выбранные отбрасываются, остальные
+    добавляются, пока помещаются в ``budget`` токенов. Неизменные части —
+    системный промпт и инструкция — идут в начале запроса, чтобы у OpenAI
+    срабатывал кэш префикса промпта; изменчивые (отрывки, диалог) — в конце.
+    """
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, min_score=CONTEXT_MIN_SCORE,
+                 duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD):
+        self.budget = budget
+        self.min_score = min_score
+        self.duplicate_threshold = duplicate_threshold
+        self.requests = 0
+        self.tokens = 0
+        self.saved = 0
+        self._lock = threading.Lock()
+
+    def select(self, scored_docs):
+        """Отрывки для запроса и счётчики отброшенных: (отрывки, повторы, слабые, сверх бюджета)."""
+        selected, selected_terms = [], []
+        duplicates = low_score = over_budget = 0
+        used = 0
+        for doc, score in scored_docs:
+            if selected and score < self.min_score:
+                low_score += 1
+                continue
+            terms = set(tokenize(doc.page_content))
+            if any(overlap(terms, other) >= self.duplicate_threshold for other in selected_terms):
+                duplicates += 1
+                continue
+            tokens = chunk_tokens(doc.page_content)
+            # Лучший отрывок берётся всегда, даже если один не помещается в бюджет
+            if selected and used + tokens > self.budget:
+                over_budget += 1
+                continue
+            selected.append(doc)
+            selected_terms.append(terms)
+            used += tokens
+        return selected, duplicates, low_score, over_budget
+
+    def build(self, system: str, scored_docs, dialogue: str, legacy_k=4) -> PromptContext:
+        """Сообщения для модели; ``dialogue`` — история с вопросом клиента в конце.
+
+        ``legacy_k`` — сколько отрывков попадало в запрос прежде, для подсчёта сэкономленных токенов.
+        """
+        docs, duplicates, low_score, over_budget = self.select(scored_docs)
+        excerpts = "\n\n".join(f"[{i + 1}] {doc.page_content}" for i, doc in enumerate(docs))
+        user = f"{INSTRUCTION}\n{excerpts}\n\nВопрос клиента: {dialogue}"
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ]
+        tokens = count_tokens(user)
+        saved = max(0, count_tokens(legacy_prompt([doc for doc, _ in scored_docs[:legacy_k]], dialogue)) - tokens)
+        with self._lock:
+            self.requests += 1
+            self.tokens += tokens
+            self.saved += saved
+            report = self.requests % 100 == 0
+        if report:
+            logger.info(f"Context builder: {self.requests} prompts, {self.tokens} context tokens, "
+                        f"{self.saved} saved")
+        return PromptContext(messages, tokens, saved, len(docs), duplicates, low_score, over_budget)
@@ -0,0 +1,182 @@
+import gzip
+import json
+import os
+import re
+import tempfile
+import textwrap
+
+from loguru import logger
+
+MAX_MESSAGE_LENGTH = 4096  # Максимальная длина сообщения в Telegram
+DIALOGUE_PAGE_SIZE = int(os.getenv("DIALOGUE_PAGE_SIZE", "20"))
+# В постраничном просмотре длинные сообщения сокращаются, целиком они есть в выгрузке
+DIALOGUE_PREVIEW_LENGTH = 800
+# Моноширинный шрифт с кириллицей: строки переносятся заранее, без медленной разметки multi_cell
+PDF_FONT_PATH = os.getenv("PDF_FONT_PATH", "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf")
+# fpdf2 держит документ в памяти целиком, поэтому PDF ограничен по числу сообщений
+PDF_MAX_MESSAGES = int(os.getenv("PDF_MAX_MESSAGES", "10000"))
+
+# Bot API принимает файлы до 50 МБ; больший файл сжимается и при необходимости делится на части
+EXPORT_MAX_MB = float(os.getenv("EXPORT_MAX_MB", "45"))
+
+EXPORT_FORMATS = ("txt", "jsonl", "pdf")
+
+
+def safe_filename(name: str) -> str:
+    """Имя пользователя, пригодное для имени файла: без разделителей пути и служебных символов."""
+    return re.sub(r'[^\w.-]', '_', name).strip('.')[:64] or "user"
+
+
+def format_row(message, direction, timestamp, limit=None):
+    if limit and len(message) > limit:
+        message = message[:limit] + "…"
+    return f"{timestamp} {'Входящее' if direction == 'incoming' else 'Исходящее'}: {message}"
+
+
+class DialoguePage:
+    """Страница диалога, умещающаяся в одно сообщение Telegram."""
+
+    def __init__(self, text, first_id, last_id, has_prev, has_next):
+        self.text = text
+        self.first_id = first_id
+        self.last_id = last_id
+        self.has_prev = has_prev
+        self.has_next = has_next
+
+
+def fetch_page(storage, username, after_id=None, before_id=None, page_size=DIALOGUE_PAGE_SIZE):
+    """Читает страницу по курсору: следующую после ``after_id`` или предыдущую перед ``before_id``."""
+    with storage.connection() as conn:
+        if before_id is not None:
+            rows = conn.execute("SELECT id, message, direction, timestamp FROM messages "
+                                "WHERE username = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                                (username, before_id, page_size)).fetchall()
+        else:
+            rows = conn.execute("SELECT id, message, direction, timestamp FROM messages "
+                                "WHERE username = ? AND id > ? ORDER BY id LIMIT ?",
+                                (username, after_id or 0, page_size)).fetchall()
+        if not rows:
+            return None
+
+        # Набираем строки, пока страница помещается в одно сообщение; назад — с конца
+        lines, ids, length = [], [], 0
+        for row_id, message, direction, timestamp in rows:
+            line = format_row(message, direction, timestamp, limit=DIALOGUE_PREVIEW_LENGTH)
+            if lines and length + len(line) + 1 > MAX_MESSAGE_LENGTH:
+                break
+            lines.append(line)
+            ids.append(row_id)
+            length += len(line) + 1
+        if before_id is not None:
+            lines.reverse()
+            ids.reverse()
+
+        has_prev = conn.execute("SELECT 1 FROM messages WHERE username = ? AND id < ? LIMIT 1",
+                                (username, ids[0])).fetchone() is not None
+        has_next = conn.execute("SELECT 1 FROM messages WHERE username = ? AND id > ? LIMIT 1",
+                                (username, ids[-1])).fetchone() is not None
+    return DialoguePage("\n".join(lines)[:MAX_MESSAGE_LENGTH], ids[0], ids[-1], has_prev, has_next)
+
+
+def _write_text(rows, f):
+    for _, message, direction, timestamp in rows:
+        f.write(format_row(message, direction, timestamp) + "\n")
+
+
+def _write_jsonl(rows, f):
+    for row_id, message, direction, timestamp in rows:
+        f.write(json.dumps({"id": row_id, "timestamp": timestamp, "direction": direction, "message": message},
+                           ensure_ascii=False) + "\n")
+
+
+def _write_pdf(rows, path, username):
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_font("Mono", fname=PDF_FONT_PATH)
+    pdf.set_font("Mono", size=9)
+    pdf.add_page()
+    width = int(pdf.epw / pdf.get_string_width("0"))
+    pdf.cell(0, 6, f"Диалог пользователя {username}", new_x="LMARGIN", new_y="NEXT")
+    for count, (_, message, direction, timestamp) in enumerate(rows):
+        if count == PDF_MAX_MESSAGES:
+            pdf.cell(0, 6, f"… показаны первые {PDF_MAX_MESSAGES} сообщений, полный диалог доступен в TXT",
+                     new_x="LMARGIN", new_y="NEXT")
+            break
+        for paragraph in format_row(message, direction, timestamp).splitlines():
+            for line in textwrap.wrap(paragraph, width) or [""]:
+                pdf.cell(0, 4.5, line, new_x="LMARGIN", new_y="NEXT")
+        pdf.ln(1.5)
+    pdf.output(path)
+
+
+def export_dialogue(storage, username, fmt):
+    """Выгружает весь диалог во временный файл и возвращает путь к нему.
+
+    Строки читаются из базы страницами и сразу пишутся в файл. PDF без шрифта с
+    кириллицей собрать нельзя, поэтому без него выгрузка делается в txt.
+    """
+    if fmt == "pdf" and not os.path.exists(PDF_FONT_PATH):
+        logger.warning(f"PDF font {PDF_FONT_PATH} not found, exporting dialogue as txt")
+        fmt = "txt"
+    fd, path = tempfile.mkstemp(prefix=f"dialogue_{safe_filename(username)}_", suffix=f".{fmt}")
+    rows = storage.iter_messages(username)
+    try:
+        if fmt == "pdf":
+            os.close(fd)
+            _write_pdf(rows, path, username)
+        else:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                (_write_jsonl if fmt == "jsonl" else _write_text)(rows, f)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def prepare_upload(path, name, max_bytes=None):
+    """Файлы для отправки в Telegram: пары (путь, имя файла для получателя).
+
+    Файл не больше ``max_bytes`` отправляется как есть. Больший сжимается gzip, а
+    текстовый, если и сжатым не помещается, делится по строкам на части, каждая
+    из которых — отдельный .gz-файл, читаемый сам по себе. Созданные файлы
+    удаляет вызывающий.
+    """
+    max_bytes = max_bytes or int(EXPORT_MAX_MB * 1024 * 1024)
+    if os.path.getsize(path) <= max_bytes:
+        return [(path, name)]
+    if name.endswith(".pdf"):
+        gz_path = f"{path}.gz"
+        with open(path, "rb") as source, gzip.open(gz_path, "wb") as target:
+            while chunk := source.read(1024 * 1024):
+                target.write(chunk)
+        return [(gz_path, f"{name}.gz")]
+
+    parts = []
+    raw = target = None
+    try:
+        with open(path, "rb") as source:
+            for line in source:
+                # Сжатый вывод отстаёт от записанного на размер буфера zlib, поэтому лимит с запасом
+                if target is None or raw.tell() + len(line) > max_bytes * 0.9:
+                    if target is not None:
+                        target.close()
+                        raw.close()
+                    part_path = f"{path}.{len(parts) + 1}.gz"
+                    parts.append(part_path)
+                    raw = open(part_path, "wb")
+                    target = gzip.GzipFile(fileobj=raw, mode="wb")
+                target.write(line)
+    except Exception:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+        raise
+    finally:
+        if target is not None:
+            target.close()
+            raw.close()
+    if len(parts) == 1:
+        return [(parts[0], f"{name}.gz")]
+    stem, ext = os.path.splitext(name)
+    return [(part, f"{stem}.part{i}of{len(parts)}{ext}.gz") for i, part in enumerate(parts, 1)]
@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from loguru import logger
+
+# Настройки параллелизма (переопределяются переменными окружения)
+CHAT_WORKERS = int(os.getenv("CHAT_WORKERS", "16"))
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))
+MAX_PENDING = int(os.getenv("MAX_PENDING", "500"))
+MAX_PENDING_PER_CHAT = int(os.getenv("MAX_PENDING_PER_CHAT", "10"))
+OPENAI_SLOT_TIMEOUT = float(os.getenv("OPENAI_SLOT_TIMEOUT", "30"))
+
+
+class Overloaded(Exception):
+    """Нет свободного слота для запроса к OpenAI за отведённое время."""
+
+
+class ChatDispatcher:
+    """Пул воркеров: сообщения одного чата обрабатываются по порядку, разных чатов — параллельно.
+
+    Очередь каждого чата и общее число ожидающих задач ограничены: когда OpenAI
+    отвечает медленно, воркеры ждут слот в ``llm_slot``, очереди заполняются и
+    ``submit`` начинает отказывать, вместо того чтобы копить задачи без предела.
+    """
+
+    def __init__(self, max_workers=CHAT_WORKERS, llm_concurrency=OPENAI_CONCURRENCY,
+                 max_pending=MAX_PENDING, max_pending_per_chat=MAX_PENDING_PER_CHAT):
+        self.max_pending = max_pending
+        self.max_pending_per_chat = max_pending_per_chat
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat")
+        self._llm_slots = threading.BoundedSemaphore(llm_concurrency)
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._pending = 0
+
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._timer_cond = threading.Condition()
+        threading.Thread(target=self._run_timers, name="chat-timers", daemon=True).start()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self, chat_id, fn, *args, force=False, **kwargs) -> bool:
+        """Ставит задачу в очередь чата. Возвращает False, если очередь переполнена."""
+        with self._lock:
+            queue = self._queues.get(chat_id)
+            if not force:
+                if self._pending >= self.max_pending:
+                    logger.warning(f"Dispatcher overloaded ({self._pending} pending), rejecting chat_id: {chat_id}")
+                    return False
+                if queue is not None and len(queue) >= self.max_pending_per_chat:
+                    logger.warning(f"Too many pending messages for chat_id: {chat_id}")
+                    return False
+            self._pending += 1
+            start = queue is None
+            if start:
+                queue = self._queues[chat_id] = deque()
+            queue.append((fn, args, kwargs))
+        if start:
+            self._executor.submit(self._run_next, chat_id)
+        return True
+
+    def schedule(self, delay, chat_id, fn, *args, **kwargs):
+        """Выполняет задачу в очереди чата через ``delay`` секунд, не занимая воркер на время ожидания."""
+        with self._timer_cond:
+            heapq.heappush(self._timers, (time.monotonic() + delay, next(self._timer_seq), chat_id, fn, args, kwargs))
+            self._timer_cond.notify()
+
+    @contextmanager
+    def llm_slot(self, timeout=OPENAI_SLOT_TIMEOUT):
+        """Ограничивает число одновременных запросов к OpenAI."""
+        if not self._llm_slots.acquire(timeout=timeout):
+            raise Overloaded("No free OpenAI slot")
+        try:
+            yield
+        finally:
+            self._llm_slots.release()
+
+    def _run_next(self, chat_id):
+        with self._lock:
+            fn, args, kwargs = self._queues[chat_id].popleft()
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            logger.exception(f"Error processing task for chat_id {chat_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+                more = bool(self._queues[chat_id])
+                if not more:
+                    del self._queues[chat_id]
+            # Следующая задача чата уходит в конец общей очереди, чтобы не занимать воркер подряд
+            if more:
+                self._executor.submit(self._run_next, chat_id)
+
+    def _run_timers(self):
+        while True:
+            with self._timer_cond:
+                while not self._timers or self._timers[0][0] > time.monotonic():
+                    timeout = self._timers[0][0] - time.monotonic() if self._timers else None
+                    self._timer_cond.wait(timeout)
+                _, _, chat_id, fn, args, kwargs = heapq.heappop(self._timers)
+            self.submit(chat_id, fn, *args, force=True, **kwargs)
+
+    def shutdown(self, wait=True):
+        """Останавливает пул; при ``wait`` сначала дожидается выполнения всех задач в очередях."""
+        while wait and self._pending:
+            time.sleep(0.01)
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,219 @@
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+# Источник эмбеддингов: openai или local (без сети, для офлайн-проверок)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+# Сколько ждать других запросов, прежде чем отправить пачку эмбеддингов вопросов, секунд
+EMBED_BATCH_WINDOW = float(os.getenv("EMBED_BATCH_WINDOW", "0.02"))
+# Таймауты соединения и чтения одного запроса к API эмбеддингов, секунд
+EMBED_CONNECT_TIMEOUT = float(os.getenv("EMBED_CONNECT_TIMEOUT", "5"))
+EMBED_READ_TIMEOUT = float(os.getenv("EMBED_READ_TIMEOUT", "20"))
+# Сколько вопрос ждёт своего эмбеддинга вместе с повторами, секунд
+EMBED_QUERY_DEADLINE = float(os.getenv("EMBED_QUERY_DEADLINE", "30"))
+EMBED_RETRY_DELAY = 0.5
+
+
+class EmbeddingTimeout(TimeoutError):
+    """Эмбеддинг вопроса не получен за отведённое время; вопрос можно повторить."""
+
+
+class OpenAIBackend:
+    """Один вызов ``embed_documents`` — один запрос к OpenAI Embeddings API."""
+
+    def __init__(self, api_key, model=EMBEDDING_MODEL, connect_timeout=EMBED_CONNECT_TIMEOUT,
+                 read_timeout=EMBED_READ_TIMEOUT):
+        import openai
+
+        self.api_key = api_key
+        self.model = model
+        self.request_timeout = (connect_timeout, read_timeout)
+        self.retryable = (openai.error.RateLimitError, openai.error.APIError, openai.error.APIConnectionError,
+                          openai.error.ServiceUnavailableError, openai.error.Timeout, openai.error.TryAgain)
+
+    def embed_documents(self, texts):
+        import openai
+
+        response = openai.Embedding.create(input=texts, model=self.model, api_key=self.api_key,
+                                           request_timeout=self.request_timeout)
+        return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
+
+
+class LocalBackend:
+    """Эмбеддинги без сети: сумма псевдослучайных векторов слов текста.
+
+    Качество поиска хуже, чем у модели OpenAI, зато бот и бенчмарки работают
+    без API-ключа; векторы кэшируются отдельно под своим именем модели.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.model = f"local-hash-{dim}"
+        self.retryable = ()
+        self._words = {}
+
+    def _word_vector(self, word):
+        vector = self._words.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+            vector = self._words[word] = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return vector
+
+    def embed_documents(self, texts):
+        vectors = []
+        for text in texts:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for word in re.findall(r'\w+', text.lower()):
+                vector += self._word_vector(word)
+            norm = np.linalg.norm(vector)
+            vectors.append((vector / norm if norm else vector).tolist())
+        return vectors
+
+
+def create_backend(api_key=None, name=EMBEDDING_BACKEND):
+    if name == "local":
+        return LocalBackend()
+    return OpenAIBackend(api_key)
+
+
+class EmbeddingService(Embeddings):
+    """Эмбеддинги с пакетной отправкой, дедупликацией, ограничением параллелизма и повторами.
+
+    Эмбеддинги вопросов из разных чатов собираются в течение ``batch_window``
+    секунд и уходят одним запросом; одинаковый текст, уже ожидающий ответа, не
+    запрашивается повторно. Документы базы знаний без повторов делятся на пачки
+    по ``batch_size`` и отправляются не более чем ``max_workers`` запросами сразу.
+    Временные ошибки API повторяются с экспоненциальной задержкой; вопрос ждёт
+    эмбеддинг не дольше ``query_deadline`` секунд, затем получает ``EmbeddingTimeout``.
+    """
+
+    def __init__(self, backend, batch_size=EMBED_BATCH_SIZE, max_workers=EMBED_CONCURRENCY,
+                 max_retries=EMBED_MAX_RETRIES, batch_window=EMBED_BATCH_WINDOW,
+                 query_deadline=EMBED_QUERY_DEADLINE):
+        self.backend = backend
+        self.model = backend.model
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.batch_window = batch_window
+        self.query_deadline = query_deadline
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embed")
+        # У вопросов свой пул, чтобы они не ждали в очереди за пересборкой базы знаний
+        self._query_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embed-query")
+        self._query_slots = threading.BoundedSemaphore(max_workers)
+        self._cond = threading.Condition()
+        self._pending = {}  # текст -> Future, ещё не отправленные вопросы
+        self._in_flight = {}  # текст -> Future, отправленные, но без ответа
+        self._batch_started = None
+
+        self.requests = 0
+        self.retries = 0
+        self.embedded = 0
+        self.deduplicated = 0
+        self.timeouts = 0
+        threading.Thread(target=self._run_batcher, name="embed-batcher", daemon=True).start()
+
+    def embed_documents(self, texts):
+        started = time.perf_counter()
+        unique = list(dict.fromkeys(texts))
+        with self._cond:
+            self.deduplicated += len(texts) - len(unique)
+        batches = [unique[i:i + self.batch_size] for i in range(0, len(unique), self.batch_size)]
+        vectors = {}
+        for batch, result in zip(batches, self._executor.map(self._call, batches)):
+            vectors.update(zip(batch, result))
+        if unique:
+            elapsed = time.perf_counter() - started
+            logger.info(f"Embedded {len(unique)} texts in {elapsed:.2f}s ({len(unique) / elapsed:.0f}/s); "
+                        f"{self.stats()}")
+        return [vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        with self._cond:
+            future = self._pending.get(text) or self._in_flight.get(text)
+            if future is not None:
+                self.deduplicated += 1
+            else:
+                future = self._pending[text] = Future()
+                if self._batch_started is None:
+                    self._batch_started = time.monotonic()
+                self._cond.notify()
+        try:
+            return future.result(timeout=self.query_deadline)
+        except FutureTimeout:
+            with self._cond:
+                self.timeouts += 1
+            raise EmbeddingTimeout(f"No query embedding in {self.query_deadline:.0f}s") from None
+
+    def stats(self):
+        return (f"requests={self.requests} retries={self.retries} embedded={self.embedded} "
+                f"deduplicated={self.deduplicated} timeouts={self.timeouts}")
+
+    def _call(self, texts, deadline=None):
+        """Один запрос к API с повторами; задержка растёт вдвое с каждой попыткой.
+
+        С ``deadline`` (по ``time.monotonic``) повтор, который уже не успеет, не делается.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                vectors = self.backend.embed_documents(texts)
+                error = None
+            except self.backend.retryable as e:
+                error = e
+            with self._cond:
+                self.requests += 1
+                if error is None:
+                    self.embedded += len(texts)
+            if error is None:
+                return vectors
+            delay = EMBED_RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5)
+            if attempt == self.max_retries or (deadline is not None and time.monotonic() + delay >= deadline):
+                raise error
+            logger.warning(f"Embedding request failed, retrying in {delay:.1f}s: {error}")
+            with self._cond:
+                self.retries += 1
+            time.sleep(delay)
+
+    def _run_batcher(self):
+        while True:
+            # Пока все запросы заняты, вопросы копятся и уходят следующей, более крупной пачкой
+            self._query_slots.acquire()
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = self._batch_started + self.batch_window
+                while len(self._pending) < self.batch_size and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+                batch = dict(list(self._pending.items())[:self.batch_size])
+                for text in batch:
+                    del self._pending[text]
+                self._in_flight.update(batch)
+                self._batch_started = time.monotonic() if self._pending else None
+            self._query_executor.submit(self._send_batch, batch)
+
+    def _send_batch(self, batch):
+        try:
+            vectors = self._call(list(batch), deadline=time.monotonic() + self.query_deadline)
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+        else:
+            for future, vector in zip(batch.values(), vectors):
+                future.set_result(vector)
+        finally:
+            with self._cond:
+                for text in batch:
+                    self._in_flight.pop(text, None)
+            self._query_slots.release()
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import re
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores import FAISS
+from loguru import logger
+
+# Каталог с кэшем эмбеддингов и сохранёнными FAISS-индексами
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", "index_cache")
+
+
+def embedding_model_name(embeddings) -> str:
+    """Возвращает имя модели эмбеддингов, участвующее в ключе кэша."""
+    return getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+def chunk_key(text: str, model: str) -> str:
+    """Контентный ключ отрывка: хэш текста и модели эмбеддингов."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _atomic_write(path, write):
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def _write_matrix(path, matrix):
+    with open(path, "wb") as f:
+        np.save(f, matrix)
+
+
+class IndexCache:
+    """Хранилище векторов отрывков и FAISS-индексов, адресуемое по содержимому.
+
+    Векторы лежат в одной матрице ``<model>.npy`` с картой ключей ``<model>.json``:
+    неизменённые отрывки берут вектор оттуда, эмбеддинги запрашиваются только для
+    новых или изменённых. Готовый индекс сохраняется под хэшем набора ключей и при
+    следующем запуске открывается через mmap без обращения к API.
+    """
+
+    def __init__(self, cache_dir=INDEX_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.embedded = 0  # Сколько отрывков отправлено в API при последнем вызове embed_chunks
+        os.makedirs(os.path.join(cache_dir, "vectors"), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, "indexes"), exist_ok=True)
+
+    def _vectors_paths(self, model):
+        slug = re.sub(r'[^a-zA-Z0-9_.-]', '_', model)
+        base = os.path.join(self.cache_dir, "vectors", slug)
+        return f"{base}.npy", f"{base}.json"
+
+    def _index_paths(self, manifest):
+        base = os.path.join(self.cache_dir, "indexes", manifest)
+        return f"{base}.faiss", f"{base}.json"
+
+    def load_vectors(self, model):
+        """Возвращает словарь ключ -> вектор из сохранённой матрицы (через mmap)."""
+        matrix_path, keys_path = self._vectors_paths(model)
+        if not (os.path.exists(matrix_path) and os.path.exists(keys_path)):
+            return {}
+        try:
+            with open(keys_path, encoding="utf-8") as f:
+                keys = json.load(f)
+            matrix = np.load(matrix_path, mmap_mode="r")
+            if len(keys) != matrix.shape[0]:
+                logger.warning(f"Vector cache for {model} is inconsistent, ignoring it")
+                return {}
+            return {key: matrix[row] for row, key in enumerate(keys)}
+        except Exception as e:
+            logger.error(f"Error reading vector cache for {model}: {e}")
+            return {}
+
+    def save_vectors(self, model, vectors):
+        """Сохраняет векторы текущего набора отрывков, вытесняя устаревшие."""
+        matrix_path, keys_path = self._vectors_paths(model)
+        keys = list(vectors)
+        matrix = np.asarray([vectors[key] for key in keys], dtype=np.float32)
+        _atomic_write(matrix_path, lambda path: _write_matrix(path, matrix))
+        _atomic_write(keys_path, lambda path: _write_json(path, keys))
+
+    def embed_chunks(self, chunks, embeddings):
+        """Возвращает {ключ: вектор}, запрашивая эмбеддинги только для новых отрывков."""
+        model = embedding_model_name(embeddings)
+        cached = self.load_vectors(model)
+        vectors = {}
+        missing = []
+        for chunk in chunks:
+            key = chunk_key(chunk.page_content, model)
+            if key in cached:
+                vectors[key] = cached[key]
+            elif key not in vectors:
+                vectors[key] = None
+                missing.append((key, chunk.page_content))
+
+        if missing:
+            new_vectors = embeddings.embed_documents([text for _, text in missing])
+            for (key, _), vector in zip(missing, new_vectors):
+                vectors[key] = vector
+        self.embedded = len(missing)
+        logger.info(f"Embeddings: {len(vectors) - len(missing)} reused, {len(missing)} embedded")
+
+        if missing or set(cached) != set(vectors):
+            self.save_vectors(model, vectors)
+        return vectors
+
+    @staticmethod
+    def _unique(chunks, model):
+        documents = {}
+        for chunk in chunks:
+            key = chunk_key(chunk.page_content, model)
+            if key not in documents:
+                documents[key] = chunk
+        if len(documents) != len(chunks):
+            logger.info(f"Skipped {len(chunks) - len(documents)} duplicate chunks")
+        return documents
+
+    @staticmethod
+    def _manifest(model, keys):
+        return hashlib.sha256("\n".join([model] + keys).encode("utf-8")).hexdigest()
+
+    def load_or_build(self, chunks, embeddings) -> FAISS:
+        """Загружает сохранённый индекс для набора отрывков или строит его заново."""
+        model = embedding_model_name(embeddings)
+        documents = self._unique(chunks, model)
+        keys = list(documents)
+        manifest = self._manifest(model, keys)
+        index_path, ids_path = self._index_paths(manifest)
+
+        if os.path.exists(index_path) and os.path.exists(ids_path):
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                with open(ids_path, encoding="utf-8") as f:
+                    ids = json.load(f)
+                if index.ntotal == len(ids) and set(ids) == set(keys):
+                    logger.info(f"Loaded cached FAISS index {manifest[:12]} ({index.ntotal} vectors)")
+                    return self._wrap(index, ids, documents, embeddings)
+                logger.warning(f"Cached FAISS index {manifest[:12]} does not match chunks, rebuilding")
+            except Exception as e:
+                logger.error(f"Error loading cached FAISS index: {e}")
+
+        vectors = self.embed_chunks(list(documents.values()), embeddings)
+        store = FAISS.from_embeddings(
+            text_embeddings=[(documents[key].page_content, vectors[key]) for key in keys],
+            embedding=embeddings,
+            metadatas=[documents[key].metadata for key in keys],
+            ids=keys,
+        )
+        self._save_index(manifest, store)
+        logger.info(f"Built FAISS index {manifest[:12]} ({len(keys)} vectors)")
+        return store
+
+    def update(self, store, chunks, embeddings) -> FAISS:
+        """Возвращает копию индекса ``store``, приведённую к новому набору отрывков.
+
+        Исчезнувшие отрывки удаляются из копии по id, новые добавляются, и
+        эмбеддинги запрашиваются только для них. Исходный индекс не меняется и
+        может обслуживать запросы, пока строится копия.
+        """
+        model = embedding_model_name(embeddings)
+        documents = self._unique(chunks, model)
+        keys = list(documents)
+        current = list(store.index_to_docstore_id.values())
+        removed = [key for key in current if key not in documents]
+        known = set(current)
+        added = [key for key in keys if key not in known]
+
+        vectors = self.embed_chunks(list(documents.values()), embeddings)
+        updated = FAISS(
+            embedding_function=embeddings,
+            index=faiss.clone_index(store.index),
+            docstore=InMemoryDocstore({key: store.docstore.search(key) for key in current}),
+            index_to_docstore_id=dict(store.index_to_docstore_id),
+        )
+        if removed:
+            updated.delete(removed)
+        if added:
+            updated.add_embeddings(
+                text_embeddings=[(documents[key].page_content, vectors[key]) for key in added],
+                metadatas=[documents[key].metadata for key in added],
+                ids=added,
+            )
+        self._save_index(self._manifest(model, keys), updated)
+        logger.info(f"Updated FAISS index: {len(added)} added, {len(removed)} removed, "
+                    f"{updated.index.ntotal} vectors")
+        return updated
+
+    def _save_index(self, manifest, store):
+        index_path, ids_path = self._index_paths(manifest)
+        ids = [store.index_to_docstore_id[i] for i in range(store.index.ntotal)]
+        try:
+            _atomic_write(index_path, lambda path: faiss.write_index(store.index, path))
+            _atomic_write(ids_path, lambda path: _write_json(path, ids))
+            self._prune_indexes(keep=manifest)
+        except Exception as e:
+            logger.error(f"Error saving FAISS index: {e}")
+
+    def _prune_indexes(self, keep):
+        directory = os.path.join(self.cache_dir, "indexes")
+        for name in os.listdir(directory):
+            if not name.startswith(keep):
+                os.remove(os.path.join(directory, name))
+
+    @staticmethod
+    def _wrap(index, ids, documents, embeddings) -> FAISS:
+        docstore = InMemoryDocstore({
+            key: Document(page_content=documents[key].page_content, metadata=documents[key].metadata)
+            for key in ids
+        })
+        return FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=dict(enumerate(ids)),
+        )
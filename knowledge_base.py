@@ -0,0 +1,195 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from loguru import logger
+
+# Копии последних успешно загруженных документов на случай недоступности Google Docs
+DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR", os.path.join("index_cache", "documents"))
+DOCUMENT_FETCH_TIMEOUT = float(os.getenv("DOCUMENT_FETCH_TIMEOUT", "30"))
+# Сколько воркер ждёт загрузки базы знаний, прежде чем попросить пользователя повторить вопрос
+KB_READY_TIMEOUT = float(os.getenv("KB_READY_TIMEOUT", "20"))
+# Пауза между попытками, если документы не загрузились и копий на диске нет
+KB_RETRY_INTERVAL = float(os.getenv("KB_RETRY_INTERVAL", "60"))
+# Как часто проверять документы на изменения, секунд (0 — не проверять)
+KB_REFRESH_INTERVAL = float(os.getenv("KB_REFRESH_INTERVAL", "300"))
+
+DOCUMENT_EXPORT_URL = "https://docs.google.com/document/d/{}/export?format=txt"
+
+
+def load_document_text(url: str, validators=None):
+    """Загружает текст документа по URL Google Docs.
+
+    ``validators`` — ETag и Last-Modified прошлого ответа: запрос становится
+    условным, и для неизменённого документа возвращается None. Словарь
+    обновляется заголовками нового ответа.
+    """
+    match_ = re.search('/document/d/([a-zA-Z0-9-_]+)', url)
+    if match_ is None:
+        raise ValueError('Invalid Google Docs URL')
+    doc_id = match_.group(1)
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    response = requests.get(DOCUMENT_EXPORT_URL.format(doc_id), headers=headers, timeout=DOCUMENT_FETCH_TIMEOUT)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    if validators is not None:
+        validators["etag"] = response.headers.get("ETag")
+        validators["last_modified"] = response.headers.get("Last-Modified")
+    return response.text
+
+
+def fetch_document(name: str, url: str, cache_dir=DOCUMENT_CACHE_DIR, validators=None):
+    """Загружает документ и сохраняет копию; при ошибке возвращает последнюю сохранённую.
+
+    С ``validators`` для неизменённого документа возвращает None.
+    """
+    path = os.path.join(cache_dir, f"{name}.txt")
+    try:
+        text = load_document_text(url, validators)
+        if text is None:
+            return None
+    except Exception as e:
+        if not os.path.exists(path):
+            raise
+        logger.warning(f"Error loading document {name}, using cached copy: {e}")
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return text
+
+
+class KnowledgeBase:
+    """Системный промпт и поиск по базе знаний, загружаемые в фоне.
+
+    Бот начинает принимать сообщения сразу, а документы, langchain и FAISS
+    загружаются в отдельном потоке; ``ready`` отмечает момент, когда ``system`` и
+    ``retriever`` можно использовать. Если документы недоступны и копий на диске
+    нет, загрузка повторяется каждые ``KB_RETRY_INTERVAL`` секунд.
+
+    После загрузки тот же поток раз в ``refresh_interval`` секунд проверяет
+    документы условными запросами. Изменённая база знаний не пересобирается:
+    в копию индекса добавляются только новые отрывки, и готовый поиск подменяет
+    прежний одним присваиванием, так что запросы обслуживаются и во время
+    обновления. ``on_reload`` вызывается после каждой подмены.
+    """
+
+    def __init__(self, system_url, database_url, make_embeddings, cache_dir=DOCUMENT_CACHE_DIR,
+                 refresh_interval=KB_REFRESH_INTERVAL, on_reload=None):
+        self.system_url = system_url
+        self.database_url = database_url
+        self.make_embeddings = make_embeddings
+        self.cache_dir = cache_dir
+        self.refresh_interval = refresh_interval
+        self.on_reload = on_reload
+        self.system = None
+        self.retriever = None
+        self.ready = threading.Event()
+        self._texts = {}
+        self._validators = {"system": {}, "database": {}}
+        self._embeddings = None
+
+    def start(self):
+        threading.Thread(target=self._run, name="knowledge-base", daemon=True).start()
+        return self
+
+    def wait(self, timeout=KB_READY_TIMEOUT) -> bool:
+        return self.ready.wait(timeout)
+
+    def load(self):
+        # Тяжёлые импорты откладываются до фоновой загрузки
+        from index_cache import IndexCache
+        from retrieval import HybridRetriever, QueryEmbeddingCache
+
+        self._validators = {"system": {}, "database": {}}
+        (system, database), validators = self._fetch()
+        embeddings = self.make_embeddings()
+        source_chunks = self._split(database)
+        db = IndexCache().load_or_build(source_chunks, embeddings)  # Повторно используем сохранённые векторы
+        # Поиск по ключевым словам и векторам с кэшем эмбеддингов запросов
+        self.retriever = HybridRetriever(db, source_chunks, QueryEmbeddingCache(embeddings))
+        self.system = system
+        self._texts = {"system": system, "database": database}
+        self._embeddings = embeddings
+        self._validators = validators
+        self.ready.set()
+
+    def refresh(self) -> bool:
+        """Подхватывает изменения документов; возвращает True, если что-то обновилось."""
+        from index_cache import IndexCache
+        from retrieval import HybridRetriever
+
+        started = time.perf_counter()
+        (system, database), validators = self._fetch()
+        system_changed = system is not None and system != self._texts["system"]
+        database_changed = database is not None and database != self._texts["database"]
+        if not (system_changed or database_changed):
+            logger.debug("Knowledge base documents not modified")
+            self._validators = validators
+            return False
+
+        embedded = 0
+        if database_changed:
+            retriever = self.retriever
+            source_chunks = self._split(database)
+            cache = IndexCache()
+            db = cache.update(retriever.vector_store, source_chunks, self._embeddings)
+            embedded = cache.embedded
+            self.retriever = HybridRetriever(db, source_chunks, retriever.query_cache, retriever.fetch_k)
+            self._texts["database"] = database
+        if system_changed:
+            self.system = system
+            self._texts["system"] = system
+        # Новые ETag запоминаются только после подмены: если обновление упало,
+        # следующая проверка получит документ целиком, а не 304
+        self._validators = validators
+        logger.info(f"Knowledge base reloaded in {time.perf_counter() - started:.2f}s: "
+                    f"system {'changed' if system_changed else 'unchanged'}, {embedded} chunks re-embedded")
+        if self.on_reload is not None:
+            self.on_reload()
+        return True
+
+    def _fetch(self):
+        """Тексты документов и их новые валидаторы; ``self._validators`` не меняется."""
+        # Оба документа загружаются параллельно; после первой загрузки запросы условные
+        validators = {name: dict(values) for name, values in self._validators.items()}
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            texts = tuple(pool.map(lambda doc: fetch_document(doc[0], doc[1], self.cache_dir, validators[doc[0]]),
+                                   (("system", self.system_url), ("database", self.database_url))))
+        return texts, validators
+
+    @staticmethod
+    def _split(database):
+        from langchain.docstore.document import Document
+        from langchain.text_splitter import CharacterTextSplitter
+
+        splitter = CharacterTextSplitter(separator="\n", chunk_size=1024, chunk_overlap=0)
+        return [Document(page_content=chunk, metadata={}) for chunk in splitter.split_text(database)]
+
+    def _run(self):
+        while True:
+            try:
+                self.load()
+                logger.info("Knowledge base loaded")
+                break
+            except Exception as e:
+                logger.error(f"Error loading knowledge base, retrying in {KB_RETRY_INTERVAL:.0f}s: {e}")
+                time.sleep(KB_RETRY_INTERVAL)
+        while self.refresh_interval > 0:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error reloading knowledge base: {e}")
@@ -0,0 +1,370 @@
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from loguru import logger
+
+# Основная модель и более быстрая запасная (пусто — без запасной)
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "gpt-4o-mini")
+# Таймауты HTTP: соединение и ожидание очередной порции ответа, секунд
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+# Сколько всего ждать начала ответа с учётом повторов и запасной модели, секунд
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "90"))
+# Если основная модель не начала отвечать за это время, параллельно запрашивается запасная (0 — не ждать её)
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Автомат отключения: после стольких ошибок подряд модель не запрашивается LLM_BREAKER_RESET секунд
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+# Одновременных запросов и запросов за окно LLM_USER_QUOTA_WINDOW секунд от одного пользователя (0 — без лимита)
+LLM_USER_CONCURRENCY = int(os.getenv("LLM_USER_CONCURRENCY", "2"))
+LLM_USER_QUOTA = int(os.getenv("LLM_USER_QUOTA", "60"))
+LLM_USER_QUOTA_WINDOW = float(os.getenv("LLM_USER_QUOTA_WINDOW", "3600"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+LLM_RETRY_DELAY = 0.5
+
+_DONE = object()
+
+
+class Unavailable(Exception):
+    """OpenAI не ответил: модели отключены автоматом, ошибки не прошли после повторов или вышел срок."""
+
+
+class QuotaExceeded(Exception):
+    """Пользователь исчерпал лимит запросов; ``retry_after`` — через сколько секунд можно снова."""
+
+    def __init__(self, message, retry_after=0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retryable_errors():
+    import openai
+
+    return (openai.error.RateLimitError, openai.error.APIError, openai.error.APIConnectionError,
+            openai.error.ServiceUnavailableError, openai.error.Timeout, openai.error.TryAgain,
+            requests.exceptions.RequestException)
+
+
+def create_session(pool_size=LLM_POOL_SIZE):
+    """Сессия requests с пулом keep-alive соединений, общая для всех потоков."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def install_session(pool_size=LLM_POOL_SIZE):
+    """Ставит общую сессию для всех запросов openai, включая эмбеддинги; вызывается один раз при запуске.
+
+    ``openai.requestssession`` — глобальная настройка, поэтому клиенты её не меняют;
+    уже установленная сессия не заменяется.
+    """
+    import openai
+
+    if not isinstance(openai.requestssession, requests.Session):
+        openai.requestssession = create_session(pool_size)
+    return openai.requestssession
+
+
+class CircuitBreaker:
+    """Автомат отключения модели: после ``failures`` ошибок подряд запросы не отправляются
+    ``reset_timeout`` секунд, затем пропускается один пробный запрос."""
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.errors = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.errors = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.errors += 1
+            if self._probing or (self.opened_at is None and self.errors >= self.failures):
+                self.opened_at = time.monotonic()
+                self._probing = False
+                return True
+            return False
+
+
+class UserLimiter:
+    """Ограничение одновременных запросов и числа запросов за окно для каждого пользователя."""
+
+    def __init__(self, concurrency=LLM_USER_CONCURRENCY, quota=LLM_USER_QUOTA, window=LLM_USER_QUOTA_WINDOW):
+        self.concurrency = concurrency
+        self.quota = quota
+        self.window = window
+        self.rejected = 0
+        self._active = {}
+        self._history = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, user):
+        if user is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            history = self._history.setdefault(user, deque())
+            while history and now - history[0] >= self.window:
+                history.popleft()
+            if self.concurrency and self._active.get(user, 0) >= self.concurrency:
+                self.rejected += 1
+                raise QuotaExceeded(f"Too many concurrent requests from {user}")
+            if self.quota and len(history) >= self.quota:
+                self.rejected += 1
+                raise QuotaExceeded(f"Request quota exceeded for {user}", self.window - (now - history[0]))
+            history.append(now)
+            self._active[user] = self._active.get(user, 0) + 1
+
+    def release(self, user):
+        if user is None:
+            return
+        with self._lock:
+            self._active[user] -= 1
+            if not self._active[user]:
+                del self._active[user]
+
+
+class _Attempt:
+    """Запрос к одной модели в отдельном потоке с повторами до первой порции ответа.
+
+    Первая порция (или весь ответ без потоковой выдачи) уходит в общую очередь
+    ``events``; дальнейшие фрагменты потока — в ``chunks``. Проигравший попытку
+    отменяют флагом ``cancelled``.
+    """
+
+    def __init__(self, client, model, messages, stream, params, deadline, events):
+        self.client = client
+        self.model = model
+        self.messages = messages
+        self.stream = stream
+        self.params = params
+        self.deadline = deadline
+        self.events = events
+        self.chunks = queue.Queue()
+        self.cancelled = False
+        threading.Thread(target=self._run, name=f"llm-{model}", daemon=True).start()
+
+    def _run(self):
+        try:
+            first, rest = self._first_response()
+        except Exception as e:
+            self.events.put((self, None, e))
+            return
+        self.events.put((self, first, None))
+        if rest is None:
+            return
+        try:
+            for chunk in rest:
+                if self.cancelled:
+                    break
+                self.chunks.put(chunk)
+            self.chunks.put(_DONE)
+        except Exception as e:
+            self.chunks.put(e)
+
+    def _first_response(self):
+        import openai
+
+        client = self.client
+        breaker = client.breakers[self.model]
+        retryable = retryable_errors()
+        for attempt in range(client.max_retries + 1):
+            with client._lock:
+                client.requests[self.model] = client.requests.get(self.model, 0) + 1
+            try:
+                response = openai.ChatCompletion.create(
+                    model=self.model, messages=self.messages, stream=self.stream,
+                    request_timeout=(client.connect_timeout, client.read_timeout), **self.params)
+                if not self.stream:
+                    breaker.record_success()
+                    return response, None
+                rest = iter(response)
+                # Ошибка или таймаут до первого фрагмента ещё можно повторить
+                first = next(rest, None)
+                if first is None:
+                    raise openai.error.APIError("Empty response stream")
+                breaker.record_success()
+                return first, rest
+            except retryable as e:
+                if breaker.record_failure():
+                    logger.error(f"Circuit breaker opened for {self.model} after {breaker.errors} errors: {e}")
+                delay = LLM_RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5)
+                if attempt == client.max_retries or self.cancelled or time.monotonic() + delay >= self.deadline:
+                    raise
+                logger.warning(f"OpenAI request to {self.model} failed, retrying in {delay:.1f}s: {e}")
+                with client._lock:
+                    client.retries += 1
+                time.sleep(delay)
+            except openai.error.OpenAIError:
+                # Запрос отклонён по существу, но модель отвечает
+                breaker.record_success()
+                raise
+
+
+class LLMClient:
+    """Запросы к OpenAI Chat Completions с таймаутами, повторами, автоматом отключения и запасной моделью.
+
+    Пул keep-alive соединений общий для всех запросов openai и ставится при
+    запуске через ``install_session``. Ошибки до первой
+    порции ответа повторяются с экспоненциальной задержкой, каждая ошибка
+    учитывается автоматом отключения модели. Если основная модель отключена,
+    не ответила после повторов или не начала отвечать за ``hedge_after``
+    секунд, запрос уходит запасной модели; используется ответ, пришедший
+    первым. Пользователю ``user`` разрешено ограниченное число запросов.
+    """
+
+    def __init__(self, model=LLM_MODEL, fallback_model=LLM_FALLBACK_MODEL, connect_timeout=LLM_CONNECT_TIMEOUT,
+                 read_timeout=LLM_READ_TIMEOUT, deadline=LLM_DEADLINE, hedge_after=LLM_HEDGE_AFTER,
+                 max_retries=LLM_MAX_RETRIES, limiter=None):
+        self.models = [m for m in (model, fallback_model) if m]
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.max_retries = max_retries
+        self.limiter = limiter or UserLimiter()
+        self.breakers = {m: CircuitBreaker() for m in self.models}
+
+        self.requests = {}  # модель -> число HTTP-запросов
+        self.retries = 0
+        self.fallbacks = 0
+        self.hedges = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def create(self, messages, user=None, stream=False, **params):
+        """Как ``openai.ChatCompletion.create``; модель выбирает клиент.
+
+        Возвращает ответ или, с ``stream``, итератор фрагментов. Бросает
+        ``QuotaExceeded``, если ``user`` превысил лимит, и ``Unavailable``, если
+        ни одна модель не ответила.
+        """
+        self.limiter.acquire(user)
+        try:
+            attempt, first = self._race(messages, stream, params)
+        except BaseException:
+            self.limiter.release(user)
+            raise
+        if not stream:
+            self.limiter.release(user)
+            return first
+        return self._relay(attempt, first, user)
+
+    def stats(self) -> dict:
+        return {"requests": dict(self.requests), "retries": self.retries, "fallbacks": self.fallbacks,
+                "hedges": self.hedges, "failures": self.failures, "rejected": self.limiter.rejected,
+                "breakers": {m: b.state for m, b in self.breakers.items()}}
+
+    def _race(self, messages, stream, params):
+        import openai
+
+        events = queue.Queue()
+        deadline = time.monotonic() + self.deadline
+        candidates = list(self.models)
+        attempts = []
+        running = 0
+
+        def launch():
+            while candidates:
+                model = candidates.pop(0)
+                if self.breakers[model].allow():
+                    if attempts or model != self.models[0]:
+                        with self._lock:
+                            self.fallbacks += 1
+                        logger.warning(f"Falling back to {model}")
+                    attempts.append(_Attempt(self, model, messages, stream, params, deadline, events))
+                    return True
+            return False
+
+        def give_up(error):
+            for attempt in attempts:
+                attempt.cancelled = True
+            with self._lock:
+                self.failures += 1
+            raise Unavailable(f"OpenAI unavailable: {error}") from (error if isinstance(error, Exception) else None)
+
+        if not launch():
+            give_up("all models are switched off by the circuit breaker")
+        running += 1
+        hedge_at = time.monotonic() + self.hedge_after if self.hedge_after else None
+        last_error = None
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                give_up(f"no response in {self.deadline:.0f}s")
+            wait = deadline - now
+            if hedge_at is not None and candidates:
+                wait = min(wait, max(0.0, hedge_at - now))
+            try:
+                attempt, first, error = events.get(timeout=wait)
+            except queue.Empty:
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    if candidates:
+                        logger.warning(f"No response from {attempts[-1].model} in {self.hedge_after:.0f}s, "
+                                       f"hedging")
+                        if launch():
+                            running += 1
+                            with self._lock:
+                                self.hedges += 1
+                continue
+            if error is None:
+                # Ответ пришёл: остальные попытки больше не нужны
+                for other in attempts:
+                    if other is not attempt:
+                        other.cancelled = True
+                return attempt, first
+            running -= 1
+            last_error = error
+            if isinstance(error, openai.error.InvalidRequestError):
+                # Запрос отклонён по существу: другая модель его тоже не примет
+                give_up(error)
+            if running == 0:
+                if not launch():
+                    give_up(last_error)
+                running += 1
+
+    def _relay(self, attempt, first, user):
+        try:
+            yield first
+            while True:
+                chunk = attempt.chunks.get()
+                if chunk is _DONE:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            attempt.cancelled = True
+            self.limiter.release(user)
@@ -1,139 +1,95 @@
 import telebot
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.vectorstores import FAISS
-from langchain.docstore.document import Document
+import math
 import os
 import re
-import requests
-import openai
-import sqlite3
 import time
 from dotenv import load_dotenv
 from telebot import types
 from loguru import logger
 
-# Загрузка переменных окружения
+# Загрузка переменных окружения до импорта модулей, которые читают настройки при импорте
 load_dotenv()
 
+from access_cache import AccessCache
+from answer_cache import AnswerCache, is_standalone, mentions_client
+from context_builder import CONTEXT_CANDIDATES, ContextBuilder
+from dialogue_export import EXPORT_FORMATS, export_dialogue, fetch_page, prepare_upload, safe_filename
+from dispatcher import ChatDispatcher, Overloaded
+from knowledge_base import KnowledgeBase
+from llm_client import LLMClient, QuotaExceeded, Unavailable, install_session
+from memory import ConversationMemory
+from outbox import BULK, INTERACTIVE, Outbox
+from sessions import SessionStore
+from storage import Storage
+from streaming import StreamingReply, split_message
+from tracing import METRICS_PORT, MetricsServer, Tracer
+from webhook import BOT_MODE, WebhookServer
+
 # Настройка логирования
 logger.add("bot.log", rotation="1 MB")  # Логирование в файл с ротацией
 
+# Потоковая выдача ответа GPT с правкой сообщения по мере генерации
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") == "1"
+
+# Замеры этапов обработки сообщений и метрики для Prometheus
+tracer = Tracer()
+
 # Проверка загрузки переменных окружения
 admin_usernames = os.getenv("ADMIN_USERNAMES", "")
 logger.info(f"Loaded admin usernames: {admin_usernames}")
 
 
+# Пул соединений с users.db и отложенная пакетная запись сообщений
+storage = Storage()
+
+
 # Инициализация базы данных
 def init_db():
     try:
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS allowed_users (username TEXT PRIMARY KEY)''')
-        c.execute('''CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT,
-            message TEXT,
-            direction TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )''')
-        conn.commit()
-        conn.close()
+        storage.init_schema()
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
 
 
 # Функции для работы с базой данных
 def log_message(username, message, direction):
-    try:
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        c.execute("INSERT INTO messages (username, message, direction) VALUES (?, ?, ?)",
-                  (username, message, direction))
-        conn.commit()
-        conn.close()
-        logger.debug(f"Logged message from {username} (direction: {direction}): {message}")
-    except Exception as e:
-        logger.error(f"Error logging message: {e}")
-
-
-def fetch_dialogue(username):
-    try:
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        c.execute("SELECT message, direction, timestamp FROM messages WHERE username = ? ORDER BY timestamp",
-                  (username,))
-        messages = c.fetchall()
-        conn.close()
-        dialogue = []
-        for message, direction, timestamp in messages:
-            dialogue.append(f"{timestamp} {'Входящее' if direction == 'incoming' else 'Исходящее'}: {message}")
-        logger.debug(f"Fetched dialogue for {username}: {dialogue}")
-        return "\n".join(dialogue)
-    except Exception as e:
-        logger.error(f"Error fetching dialogue: {e}")
-        return "Ошибка при загрузке диалога."
+    with tracer.span("sqlite_log"):
+        storage.log_message(username, message, direction)
+    logger.debug(f"Queued message from {username} (direction: {direction}, {len(message)} chars)")
 
 
 def add_user_to_db(username):
     try:
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        c.execute("INSERT OR IGNORE INTO allowed_users (username) VALUES (?)", (username,))
-        conn.commit()
-        conn.close()
+        access.add_user(username)
     except Exception as e:
         logger.error(f"Error adding user to database: {e}")
 
 
 def remove_user_from_db(username):
     try:
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        c.execute("DELETE FROM allowed_users WHERE username = ?", (username,))
-        conn.commit()
-        conn.close()
+        access.remove_user(username)
     except Exception as e:
         logger.error(f"Error removing user from database: {e}")
 
 
 def delete_messages_user(username):
     try:
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        c.execute("DELETE FROM messages WHERE username = ?", (username,))
-        conn.commit()
-        conn.close()
+        storage.flush()
+        with storage.connection() as conn:
+            conn.execute("DELETE FROM messages WHERE username = ?", (username,))
         logger.info(f"Все сообщения пользователя {username} удалены.")
     except Exception as e:
         logger.error(f"Error deleting messages for user: {e}")
 
 
 def is_user_allowed(username):
-    admin_usernames = os.getenv("ADMIN_USERNAMES", "").split(',')
-    logger.debug(f"Admin usernames: {admin_usernames}")
-    if username in admin_usernames:
-        return True
-    else:
-        try:
-            conn = sqlite3.connect('users.db')
-            c = conn.cursor()
-            c.execute("SELECT username FROM allowed_users WHERE username = ?", (username,))
-            user = c.fetchone()
-            conn.close()
-            return user is not None
-        except Exception as e:
-            logger.error(f"Error checking if user is allowed: {e}")
-            return False
+    return access.is_allowed(username)
 
 
 def get_all_users():
     try:
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        c.execute("SELECT username FROM allowed_users")
-        users = c.fetchall()
-        conn.close()
+        with storage.connection() as conn:
+            users = conn.execute("SELECT username FROM allowed_users").fetchall()
         return [user[0] for user in users]
     except Exception as e:
         logger.error(f"Error getting all users: {e}")
@@ -143,55 +99,106 @@ def get_all_users():
 # Инициализация базы данных
 init_db()
 
-
-def load_document_text(url: str) -> str:
-    """Загружает текст документа по URL Google Docs."""
-    match_ = re.search('/document/d/([a-zA-Z0-9-_]+)', url)
-    if match_ is None:
-        raise ValueError('Invalid Google Docs URL')
-    doc_id = match_.group(1)
-    response = requests.get(f'https://docs.google.com/document/d/{doc_id}/export?format=txt')
-    response.raise_for_status()
-    return response.text
+# Кэш администраторов и разрешённых пользователей
+access = AccessCache(storage, admin_usernames)
 
 
 # Проверка и загрузка API ключей
 api_key = os.getenv("YOUR_API_KEY")
 if api_key is None:
     raise Exception("API key for OpenAI is not set.")
-openai.api_key = api_key
 
-# Загрузка и обработка документов
-try:
-    system = load_document_text(
-        'https://docs.google.com/document/d/1MADrY2IiQHW10mARD3HgFlXdtAIpV79NMounMv6CiwI/edit?usp=sharing')
-    database = load_document_text(
-        'https://docs.google.com/document/d/1H6UzKL7XkKPdJARGAuwF5ST8pplMHBv9kyrAc0xNXdM/edit?usp=sharing')
-except Exception as e:
-    logger.error(f"Error loading documents: {e}")
-    raise
 
-splitter = CharacterTextSplitter(separator="\n", chunk_size=1024, chunk_overlap=0)
-source_chunks = [Document(page_content=chunk, metadata={}) for chunk in splitter.split_text(database)]
+def create_embeddings():
+    # openai и langchain импортируются в фоновом потоке загрузки базы знаний
+    import openai
+    from embedding_service import EmbeddingService, create_backend
+
+    openai.api_key = api_key
+    # Один пул keep-alive соединений на весь процесс: эмбеддинги, ответы и сжатие истории
+    install_session()
+    return EmbeddingService(create_backend(api_key))
+
 
-embeddings = OpenAIEmbeddings(openai_api_key=api_key)
-db = FAISS.from_documents(source_chunks, embeddings)
+# Ответы, сохранённые до обновления базы знаний, сбрасываются при её перезагрузке
+answer_cache = AnswerCache()
+# Отбор и упаковка отрывков базы знаний в запрос к модели
+context_builder = ContextBuilder()
+# Системный промпт и база знаний загружаются в фоне, пока бот уже отвечает на /start
+knowledge = KnowledgeBase(
+    'https://docs.google.com/document/d/1MADrY2IiQHW10mARD3HgFlXdtAIpV79NMounMv6CiwI/edit?usp=sharing',
+    'https://docs.google.com/document/d/1H6UzKL7XkKPdJARGAuwF5ST8pplMHBv9kyrAc0xNXdM/edit?usp=sharing',
+    create_embeddings, on_reload=answer_cache.clear).start()
 
 
 class TelegramBot:
-    def __init__(self, gpt_instance, search_index):
-        self.gpt = gpt_instance
-        self.index = search_index
+    def __init__(self, knowledge_base):
+        self.knowledge_base = knowledge_base
         token = os.getenv("YOUR_BOT_TOKEN")
         if token is None:
             raise Exception("Telegram Bot Token не определен в переменных окружения")
-        self.bot = telebot.TeleBot(token)
-
-
-bot = TelegramBot(gpt_instance=embeddings, search_index=db).bot
-chat_histories = {}
-chat_summaries = {}
-dialog_states = {}
+        # Обработчики только ставят задачи в очередь чата, поэтому порядок сохраняет один поток опроса
+        self.bot = telebot.TeleBot(token, threaded=False)
+
+
+bot = TelegramBot(knowledge_base=knowledge).bot
+# Все исходящие сообщения идут через очередь с лимитами Telegram; ответы пользователям — в первую очередь
+outbox = Outbox(bot)
+replies = outbox.proxy(INTERACTIVE)
+admin_replies = outbox.proxy(BULK)
+dispatcher = ChatDispatcher()
+# Запросы к GPT с таймаутами, повторами, автоматом отключения, запасной моделью и лимитом на пользователя
+llm = LLMClient()
+# Сессии чатов: шаг сценария и история диалога, с вытеснением в users.db
+sessions = SessionStore(storage)
+
+
+# Метрики компонентов бота рядом с замерами этапов
+def register_metrics():
+    """Счётчики очередей и кэшей в /metrics; компоненты базы знаний появляются после её загрузки."""
+    tracer.register("bot_dispatcher_pending", lambda: dispatcher.pending, "Tasks waiting in chat queues")
+    tracer.register("bot_sessions", lambda: len(sessions), "Chat sessions in memory")
+    for key, kind in (("depth", "gauge"), ("sent", "counter"), ("coalesced", "counter"), ("retries", "counter"),
+                      ("failed", "counter"), ("latency_p50", "gauge"), ("latency_p99", "gauge")):
+        tracer.register(f"bot_outbox_{key}", lambda key=key: outbox.stats()[key], f"Outbox {key}", kind)
+    for key in ("hits", "misses", "saved_seconds"):
+        tracer.register(f"bot_answer_cache_{key}", lambda key=key: getattr(answer_cache, key),
+                        f"Answer cache {key}", "counter")
+
+    def retriever_attr(*path):
+        value = knowledge.retriever
+        for name in path:
+            value = getattr(value, name, None) if value is not None else None
+        return value
+
+    tracer.register("bot_query_cache_hits", lambda: retriever_attr("query_cache", "hits"),
+                    "Query embedding cache hits", "counter")
+    tracer.register("bot_query_cache_misses", lambda: retriever_attr("query_cache", "misses"),
+                    "Query embedding cache misses", "counter")
+    tracer.register("bot_keyword_fast_path_hits", lambda: retriever_attr("fast_path_hits"),
+                    "Searches answered by keywords only", "counter")
+    for key in ("requests", "retries", "embedded", "deduplicated"):
+        tracer.register(f"bot_embedding_{key}", lambda key=key: retriever_attr("query_cache", "embeddings", key),
+                        f"Embedding service {key}", "counter")
+    tracer.register("bot_prompt_context_tokens", lambda: context_builder.tokens,
+                    "Knowledge base tokens sent in prompts", "counter")
+    tracer.register("bot_prompt_tokens_saved", lambda: context_builder.saved,
+                    "Prompt tokens saved by context packing", "counter")
+    for key in ("retries", "fallbacks", "hedges", "failures"):
+        tracer.register(f"bot_llm_{key}", lambda key=key: getattr(llm, key), f"OpenAI client {key}", "counter")
+    tracer.register("bot_llm_rejected", lambda: llm.limiter.rejected, "Requests over per-user limits", "counter")
+    for model in llm.models:
+        name = re.sub(r'\W', '_', model)
+        tracer.register(f"bot_llm_requests_{name}", lambda model=model: llm.requests.get(model, 0),
+                        f"HTTP requests to {model}", "counter")
+        tracer.register(f"bot_llm_breaker_open_{name}", lambda model=model: llm.breakers[model].state != "closed",
+                        f"Circuit breaker for {model} is open", "gauge")
+    tracer.register("bot_knowledge_base_ready", lambda: knowledge.ready.is_set(), "Knowledge base loaded")
+
+
+register_metrics()
+if METRICS_PORT:
+    MetricsServer(tracer).start()
 
 
 # Функция для создания инлайн клавиатуры
@@ -212,14 +219,13 @@ def create_inline_keyboard():
 # Обработчик команды /admin
 @bot.message_handler(commands=['admin'])
 def admin_panel(message):
-    admin_usernames = os.getenv("ADMIN_USERNAMES", "").split(',')
     username = message.from_user.username
     logger.debug(f"Username: {username}")
-    if username in admin_usernames:
+    if access.is_admin(username):
         keyboard = create_inline_keyboard()
-        bot.send_message(message.chat.id, "Панель администратора:", reply_markup=keyboard)
+        admin_replies.send_message(message.chat.id, "Панель администратора:", reply_markup=keyboard)
     else:
-        bot.reply_to(message, "У вас нет прав для выполнения этой команды.")
+        admin_replies.reply_to(message, "У вас нет прав для выполнения этой команды.")
 
 
 # Обработчик инлайн кнопок
@@ -229,90 +235,163 @@ def callback_query(call):
     logger.debug(f"Callback from username: {username}")
 
     if call.data == "add_user":
-        msg = bot.send_message(call.message.chat.id, "Введите имя пользователя для добавления:")
-        bot.register_next_step_handler(msg, process_add_user)
+        admin_replies.send_message(call.message.chat.id, "Введите имя пользователя для добавления:")
+        bot.register_next_step_handler_by_chat_id(call.message.chat.id, process_add_user)
     elif call.data == "remove_user":
-        msg = bot.send_message(call.message.chat.id, "Введите имя пользователя для удаления:")
-        bot.register_next_step_handler(msg, process_remove_user)
+        admin_replies.send_message(call.message.chat.id, "Введите имя пользователя для удаления:")
+        bot.register_next_step_handler_by_chat_id(call.message.chat.id, process_remove_user)
     elif call.data == "view_dialogue":
-        msg = bot.send_message(call.message.chat.id, "Введите имя пользователя для просмотра диалога:")
-        bot.register_next_step_handler(msg, process_view_dialogue)
+        admin_replies.send_message(call.message.chat.id, "Введите имя пользователя для просмотра диалога:")
+        bot.register_next_step_handler_by_chat_id(call.message.chat.id, process_view_dialogue)
     elif call.data == "delete_messages":
-        msg = bot.send_message(call.message.chat.id, "Введите имя пользователя для удаления всех сообщений:")
-        bot.register_next_step_handler(msg, process_delete_messages)
+        admin_replies.send_message(call.message.chat.id, "Введите имя пользователя для удаления всех сообщений:")
+        bot.register_next_step_handler_by_chat_id(call.message.chat.id, process_delete_messages)
     elif call.data == "list_users":
         process_list_users(call.message, username)
+    elif call.data.startswith("dlg_"):
+        process_dialogue_callback(call, username)
+
+
+# Telegram принимает callback_data не длиннее 64 байт
+MAX_CALLBACK_DATA = 64
+
+
+def dialogue_callbacks_fit(view_user) -> bool:
+    """Помещается ли имя в callback_data кнопок просмотра, включая самый длинный id сообщения."""
+    longest = max([f"dlg_next:{2 ** 63}:{view_user}"] + [f"dlg_export:{fmt}:{view_user}" for fmt in EXPORT_FORMATS],
+                  key=lambda data: len(data.encode("utf-8")))
+    return len(longest.encode("utf-8")) <= MAX_CALLBACK_DATA
+
+
+# Клавиатура постраничного просмотра диалога
+def create_dialogue_keyboard(view_user, page):
+    keyboard = types.InlineKeyboardMarkup()
+    navigation = []
+    if page.has_prev:
+        navigation.append(types.InlineKeyboardButton("◀ Назад", callback_data=f"dlg_prev:{page.first_id}:{view_user}"))
+    if page.has_next:
+        navigation.append(types.InlineKeyboardButton("Вперёд ▶", callback_data=f"dlg_next:{page.last_id}:{view_user}"))
+    if navigation:
+        keyboard.add(*navigation)
+    keyboard.add(*[types.InlineKeyboardButton(f"Скачать {fmt.upper()}", callback_data=f"dlg_export:{fmt}:{view_user}")
+                   for fmt in EXPORT_FORMATS])
+    return keyboard
 
 
 def process_add_user(message):
-    admin_usernames = os.getenv("ADMIN_USERNAMES", "").split(',')
     username = message.from_user.username
     logger.debug(f"process_add_user: {username}")
-    if username in admin_usernames:
+    if access.is_admin(username):
         new_user = message.text
         add_user_to_db(new_user)
-        bot.reply_to(message, f"Пользователь {new_user} добавлен в список разрешенных.")
+        admin_replies.reply_to(message, f"Пользователь {new_user} добавлен в список разрешенных.")
     else:
-        bot.reply_to(message, "У вас нет прав для выполнения этой команды.")
+        admin_replies.reply_to(message, "У вас нет прав для выполнения этой команды.")
 
 
 def process_remove_user(message):
-    admin_usernames = os.getenv("ADMIN_USERNAMES", "").split(',')
     username = message.from_user.username
     logger.debug(f"process_remove_user: {username}")
-    if username in admin_usernames:
+    if access.is_admin(username):
         remove_user = message.text
         remove_user_from_db(remove_user)
-        bot.reply_to(message, f"Пользователь {remove_user} удален из списка разрешенных.")
+        admin_replies.reply_to(message, f"Пользователь {remove_user} удален из списка разрешенных.")
     else:
-        bot.reply_to(message, "У вас нет прав для выполнения этой команды.")
+        admin_replies.reply_to(message, "У вас нет прав для выполнения этой команды.")
 
 
 def process_view_dialogue(message):
-    admin_usernames = os.getenv("ADMIN_USERNAMES", "").split(',')
     username = message.from_user.username
     logger.debug(f"process_view_dialogue: {username}")
-    if username in admin_usernames:
+    if access.is_admin(username):
         view_user = message.text
-        dialogue = fetch_dialogue(view_user)
-        logger.debug(f"Dialogue for user {view_user}: {dialogue}")
-
-        # Отправка диалога частями, если он слишком длинный
-        MAX_MESSAGE_LENGTH = 4096
-        if dialogue:
-            if len(dialogue) > MAX_MESSAGE_LENGTH:
-                parts = [dialogue[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(dialogue), MAX_MESSAGE_LENGTH)]
-                for part in parts:
-                    bot.send_message(message.chat.id, part)
-            else:
-                bot.send_message(message.chat.id, dialogue)
+        if not dialogue_callbacks_fit(view_user):
+            admin_replies.send_message(message.chat.id, "Слишком длинное имя пользователя.")
+            return
+        try:
+            storage.flush()
+            page = fetch_page(storage, view_user)
+        except Exception as e:
+            logger.error(f"Error fetching dialogue: {e}")
+            admin_replies.send_message(message.chat.id, "Ошибка при загрузке диалога.")
+            return
+
+        # Диалог показывается по страницам с кнопками навигации и выгрузки
+        if page:
+            admin_replies.send_message(message.chat.id, page.text,
+                                       reply_markup=create_dialogue_keyboard(view_user, page))
         else:
-            bot.send_message(message.chat.id, "Нет диалога")
+            admin_replies.send_message(message.chat.id, "Нет диалога")
     else:
-        bot.reply_to(message, "У вас нет прав для выполнения этой команды.")
+        admin_replies.reply_to(message, "У вас нет прав для выполнения этой команды.")
+
+
+def process_dialogue_callback(call, username):
+    if not access.is_admin(username):
+        bot.answer_callback_query(call.id, "У вас нет прав для выполнения этой команды.")
+        return
+    chat_id = call.message.chat.id
+    action, arg, view_user = call.data.split(":", 2)
+    logger.debug(f"process_dialogue_callback: {username} {action} {view_user}")
+
+    if action == "dlg_export":
+        bot.answer_callback_query(call.id, "Готовлю файл…")
+        dispatcher.submit(chat_id, send_dialogue_export, chat_id, view_user, arg, force=True)
+        return
+
+    try:
+        if action == "dlg_next":
+            page = fetch_page(storage, view_user, after_id=int(arg))
+        else:
+            page = fetch_page(storage, view_user, before_id=int(arg))
+    except Exception as e:
+        logger.error(f"Error fetching dialogue page: {e}")
+        page = None
+    bot.answer_callback_query(call.id)
+    if page:
+        admin_replies.edit_message_text(page.text, chat_id=chat_id, message_id=call.message.message_id,
+                                        reply_markup=create_dialogue_keyboard(view_user, page))
+
+
+def send_dialogue_export(chat_id, view_user, fmt):
+    try:
+        storage.flush()
+        path = export_dialogue(storage, view_user, fmt)
+        files = []
+        try:
+            # Больше лимита Bot API на размер файла: сжатие и, если нужно, части
+            files = prepare_upload(path, f"dialogue_{safe_filename(view_user)}{os.path.splitext(path)[1]}")
+            for part_path, name in files:
+                with open(part_path, "rb") as document:
+                    # Файл должен оставаться открытым до конца отправки
+                    admin_replies.send_document(chat_id, document, visible_file_name=name).result()
+        finally:
+            for part_path in {path, *(part_path for part_path, _ in files)}:
+                os.remove(part_path)
+    except Exception as e:
+        logger.error(f"Error exporting dialogue for {view_user}: {e}")
+        admin_replies.send_message(chat_id, "Ошибка при выгрузке диалога.")
 
 
 def process_delete_messages(message):
-    admin_usernames = os.getenv("ADMIN_USERNAMES", "").split(',')
     username = message.from_user.username
     logger.debug(f"process_delete_messages: {username}")
-    if username in admin_usernames:
+    if access.is_admin(username):
         delete_user = message.text
         delete_messages_user(delete_user)
-        bot.reply_to(message, f"Все сообщения пользователя {delete_user} удалены.")
+        admin_replies.reply_to(message, f"Все сообщения пользователя {delete_user} удалены.")
     else:
-        bot.reply_to(message, "У вас нет прав для выполнения этой команды.")
+        admin_replies.reply_to(message, "У вас нет прав для выполнения этой команды.")
 
 
 def process_list_users(message, username):
-    admin_usernames = os.getenv("ADMIN_USERNAMES", "").split(',')
     logger.debug(f"process_list_users: {username}")
-    if username in admin_usernames:
+    if access.is_admin(username):
         users = get_all_users()
         users_list = "\n".join(users)
-        bot.send_message(message.chat.id, f"Список всех пользователей:\n{users_list}")
+        admin_replies.send_message(message.chat.id, f"Список всех пользователей:\n{users_list}")
     else:
-        bot.reply_to(message, "У вас нет прав для выполнения этой команды.")
+        admin_replies.reply_to(message, "У вас нет прав для выполнения этой команды.")
 
 
 # Функция для создания клавиатуры с одной кнопкой
@@ -325,136 +404,220 @@ def create_single_button_keyboard(button_text):
 
 # Функция для отправки длинных сообщений с проверкой ссылок
 def send_long_text(chat_id: int, text: str, bot):
-    MAX_MESSAGE_LENGTH = 4096  # Максимальная длина сообщения в Telegram
-    contains_link = bool(re.search(r'http[s]?://', text))
+    # Отправка сообщения, деление на части по границам слов если необходимо
+    for part in split_message(text):
+        bot.send_message(chat_id=chat_id, text=part)
+    finish_if_link(chat_id, text, bot)
 
-    # Отправка сообщения, деление на части если необходимо
-    if len(text) <= MAX_MESSAGE_LENGTH:
-        bot.send_message(chat_id=chat_id, text=text)
-    else:
-        parts = [text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(text), MAX_MESSAGE_LENGTH)]
-        for part in parts:
-            bot.send_message(chat_id=chat_id, text=part)
+
+# Завершение диалога, если в ответе есть ссылка
+def finish_if_link(chat_id: int, text: str, bot):
+    contains_link = bool(re.search(r'http[s]?://', text))
 
     # Проверка наличия ссылки
     if contains_link:
-        time.sleep(3)  # Задержка в 3 секунд
+        # Устанавливаем состояние завершения диалога
+        sessions.get(chat_id).state = "finished"
+        # Стикер и финальное сообщение отправляются через 3 секунды, не занимая воркер
+        dispatcher.schedule(3, chat_id, send_magic_message, chat_id, bot)
 
-        # Отправляем стикер
-        sticker_file_id = 'CAACAgIAAxkBAAIeeGZ6eXPrVYYAAWRJIHuhRDscfGvq9wACzDcAAkQsqUpvTd4i2f0HnTUE'  # file_id стикера
-        bot.send_sticker(chat_id, sticker_file_id)
 
-        # Отправляем текстовое сообщение отдельно
-        magic_message = "Нумерология - это магия! Поздравляю!Теперь ты знаешь больше о себе!"
-        bot.send_message(chat_id, magic_message)
+def send_magic_message(chat_id: int, bot):
+    # Отправляем стикер
+    sticker_file_id = 'CAACAgIAAxkBAAIeeGZ6eXPrVYYAAWRJIHuhRDscfGvq9wACzDcAAkQsqUpvTd4i2f0HnTUE'  # file_id стикера
+    bot.send_sticker(chat_id, sticker_file_id)
+
+    # Отправляем текстовое сообщение отдельно
+    magic_message = "Нумерология - это магия! Поздравляю!Теперь ты знаешь больше о себе!"
+    bot.send_message(chat_id, magic_message)
+
+
+# Постановка сообщения в очередь чата с отказом при перегрузке
+def dispatch(message, handler):
+    if not dispatcher.submit(message.chat.id, handler, message):
+        replies.reply_to(message, "Сейчас слишком много запросов. Пожалуйста, повторите через минуту.")
 
-        # Устанавливаем состояние завершения диалога
-        dialog_states[chat_id] = "finished"
+
+# Запись ответа в историю и отправка пользователю
+def deliver_answer(chat_id: int, username, answer: str, streamed=False):
+    logger.info(f"Sending answer to {chat_id} ({username}): {len(answer)} chars")
+    with tracer.span("deliver"):
+        sessions.get(chat_id).memory.add("bot", answer)
+        log_message(username, answer, 'outgoing')
+        if streamed:
+            finish_if_link(chat_id, answer, replies)  # Текст уже показан по мере генерации
+        else:
+            send_long_text(chat_id, answer, replies)  # Используем send_long_text для отправки сообщения
 
 
 # Обработчик команды /start
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
+    dispatch(message, process_start)
+
+
+@tracer.traced("start")
+def process_start(message):
     chat_id = message.chat.id
     username = message.from_user.username
     logger.debug(f"Received /start command from {username} in chat_id: {chat_id}")
 
-    bot.send_sticker(chat_id, 'CAACAgIAAxkBAAIedWZ6eTB3dgFVRP0ammpMpEqFR138AAKxOgACR_2hSkN5bfKbzeJFNQQ')
+    replies.send_sticker(chat_id, 'CAACAgIAAxkBAAIedWZ6eTB3dgFVRP0ammpMpEqFR138AAKxOgACR_2hSkN5bfKbzeJFNQQ')
     welcome_message = """
 Привет, я — Нейро Нумеролог!
 Создан, чтобы помочь тебе понять себя лучше. 
 Для этого просто задавай мне вопросы по нумерологии.
 Договорились?"""
-    bot.send_message(chat_id, welcome_message, reply_markup=create_single_button_keyboard("Хорошо"))
+    replies.send_message(chat_id, welcome_message, reply_markup=create_single_button_keyboard("Хорошо"))
 
-    dialog_states[chat_id] = "awaiting_confirmation"
+    sessions.get(chat_id).state = "awaiting_confirmation"
     logger.debug(f"State set to awaiting_confirmation for chat_id: {chat_id}")
 
 
 # Обработчик текстовых сообщений
 @bot.message_handler(func=lambda message: True, content_types=['text'])
 def handle_message(message):
+    dispatch(message, process_message)
+
+
+@tracer.traced("message")
+def process_message(message):
     chat_id = message.chat.id
     user_message = message.text
     username = message.from_user.username
-    logger.debug(f"Received message: {user_message} from {username} in chat_id: {chat_id}")
+    logger.debug(f"Received message ({len(user_message)} chars) from {username} in chat_id: {chat_id}")
+    session = sessions.get(chat_id)
 
-    if dialog_states.get(chat_id) == "finished":
-        bot.send_message(chat_id,
-                         "👇Пожалуйста! Если хочешь задать ещё вопрос, то нажми кнопку Cтарт в меню.")
+    if session.state == "finished":
+        replies.send_message(chat_id,
+                             "👇Пожалуйста! Если хочешь задать ещё вопрос, то нажми кнопку Cтарт в меню.")
         return
 
-    if dialog_states.get(chat_id) == "awaiting_confirmation":
+    if session.state == "awaiting_confirmation":
         if user_message.lower() == "хорошо":
-            bot.send_message(chat_id, "Отлично! Начнём?",
-                             reply_markup=create_single_button_keyboard("Погнали"))
-            bot.send_sticker(chat_id, 'CAACAgIAAxkBAAIfFWaDwyfZI-2yLIza5jHlPCqUBFpeAALsRwACdA2gS_Z0OaZBctWSNQQ')
-            dialog_states[chat_id] = "awaiting_ready"
+            replies.send_message(chat_id, "Отлично! Начнём?",
+                                 reply_markup=create_single_button_keyboard("Погнали"))
+            replies.send_sticker(chat_id, 'CAACAgIAAxkBAAIfFWaDwyfZI-2yLIza5jHlPCqUBFpeAALsRwACdA2gS_Z0OaZBctWSNQQ')
+            session.state = "awaiting_ready"
             logger.debug(f"State set to awaiting_ready for chat_id: {chat_id}")
         else:
-            bot.send_message(chat_id, "Чтобы продолжить, просто нажми на кнопку👇",
+            replies.send_message(chat_id, "Чтобы продолжить, просто нажми на кнопку👇",
                              reply_markup=create_single_button_keyboard("Хорошо"))
         return
 
-    elif dialog_states.get(chat_id) == "awaiting_ready":
+    elif session.state == "awaiting_ready":
         if user_message.lower() == "погнали":
-            dialog_states[chat_id] = "active"
-            logger.debug(f"State set to active for chat_id: {chat_id}")
-            bot.send_message(chat_id, "Как тебя зовут?", reply_markup=types.ReplyKeyboardRemove())
+            session.state = "awaiting_name"
+            logger.debug(f"State set to awaiting_name for chat_id: {chat_id}")
+            replies.send_message(chat_id, "Как тебя зовут?", reply_markup=types.ReplyKeyboardRemove())
         else:
-            bot.send_message(chat_id, "Чтобы продолжить, просто нажми на кнопку👇",
+            replies.send_message(chat_id, "Чтобы продолжить, просто нажми на кнопку👇",
                              reply_markup=create_single_button_keyboard("Погнали"))
         return
 
-    if dialog_states.get(chat_id) == "active":
+    # Ответ на вопрос об имени обрабатывается GPT как обычная реплика
+    if session.state in ("awaiting_name", "active"):
         # Здесь ваша логика взаимодействия с GPT
-        if not is_user_allowed(username):
-            bot.reply_to(message, "Вы не имеете доступа к этому боту.")
+        with tracer.span("access"):
+            allowed = is_user_allowed(username)
+        if not allowed:
+            replies.reply_to(message, "Вы не имеете доступа к этому боту.")
             logger.debug(f"Access denied for user {username}")
             return
 
-        if chat_id not in chat_histories:
-            chat_histories[chat_id] = []
-            chat_summaries[chat_id] = ""
+        # Пока база знаний загружается в фоне, вопрос ждёт её ограниченное время
+        with tracer.span("kb_wait"):
+            ready = knowledge.wait()
+        if not ready:
+            replies.send_message(chat_id, "База знаний ещё загружается. Пожалуйста, повторите вопрос через минуту.")
+            return
+
+        if session.memory is None:
+            session.memory = ConversationMemory()
 
-        chat_histories[chat_id].append(("user", user_message))
         log_message(username, user_message, 'incoming')
 
-        # Обновление суммаризированной истории
-        current_summary = f"{chat_summaries[chat_id]} User: {user_message}"
-        if len(current_summary) > 5000:  # Увеличиваем ограничение длины суммаризации до 5000 символов
-            current_summary = current_summary[-5000:]
-        chat_summaries[chat_id] = current_summary
-
-        # Поиск релевантных отрезков из базы знаний
-        docs = db.similarity_search(user_message, k=4)
-        message_content = '\n '.join(
-            [f'\nОтрывок документа №{i + 1}\n=====================' + doc.page_content + '\n' for i, doc in
-             enumerate(docs)])
-
-        # Формирование запроса к OpenAI
-        messages = [
-            {"role": "system", "content": system},
-            {"role": "user",
-             "content": f"Документ с информацией для ответа клиента: {message_content}\n\nВопрос клиента: {current_summary}"}
-        ]
+        # Из кэша отвечаются только самостоятельные вопросы; ответ с именем не кэшируется никогда
+        memory = session.memory
+        cacheable = session.state != "awaiting_name" and is_standalone(user_message)
+        session.state = "active"
+        client_texts = [memory.summary] + [text for role, text, _ in memory.turns if role == "user"]
+
+        # Обновление истории: старые реплики сворачиваются в краткое содержание по бюджету токенов
+        with tracer.span("memory"):
+            memory.add("user", user_message)
+            current_summary = memory.render()
+        logger.info(f"Conversation memory for {chat_id}: {memory.tokens} prompt tokens, "
+                    f"{memory.full_tokens - memory.tokens} saved vs full history")
+
         try:
-            completion = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=messages,
-                temperature=0.5,
-                frequency_penalty=1.0
-            )
-            answer = completion.choices[0].message.content
-            logger.info(f"Sending answer to {chat_id} ({username}): {answer}")
-            chat_histories[chat_id].append(("bot", answer))
-            chat_summaries[chat_id] += f" Bot: {answer}"
-            log_message(username, answer, 'outgoing')
-            send_long_text(chat_id, answer, bot)  # Используем send_long_text для отправки сообщения
+            started = time.perf_counter()
+            retriever = knowledge.retriever
+            query_vector = None
+            if cacheable:
+                with tracer.span("embed"):
+                    query_vector = retriever.embed_query(user_message)
+                with tracer.span("answer_cache"):
+                    cached_answer = answer_cache.lookup(user_message, query_vector)
+                if cached_answer is not None:
+                    deliver_answer(chat_id, username, cached_answer)
+                    return
+
+            # Поиск релевантных отрезков из базы знаний; эмбеддинг, посчитанный для кэша ответов,
+            # берётся из кэша эмбеддингов запросов, если ключевые слова неоднозначны
+            with tracer.span("search"):
+                scored_docs = retriever.search_scored(user_message, k=CONTEXT_CANDIDATES)
+
+            # Формирование запроса к OpenAI: лучшие отрывки без повторов в пределах бюджета токенов
+            with tracer.span("context"):
+                context = context_builder.build(knowledge.system, scored_docs, current_summary)
+            logger.info(f"Prompt context for {chat_id}: {context.describe()}")
+            messages = context.messages
+            queued = time.perf_counter()
+            with dispatcher.llm_slot(), tracer.span("llm"):
+                tracer.observe("llm_queue", time.perf_counter() - queued)
+                # При потоковой выдаче usage приходит последним фрагментом, без choices
+                stream_options = {"stream_options": {"include_usage": True}} if STREAM_REPLIES else {}
+                completion = llm.create(
+                    messages,
+                    user=username,
+                    temperature=0.5,
+                    frequency_penalty=1.0,
+                    stream=STREAM_REPLIES,
+                    **stream_options
+                )
+                if STREAM_REPLIES:
+                    reply = StreamingReply(outbox.proxy(INTERACTIVE, wait=True), chat_id)
+                    for chunk in completion:
+                        if chunk.choices:
+                            reply.feed(chunk.choices[0].delta.get("content"))
+                        tracer.record_usage(chunk.get("usage"), chunk.get("model"))
+                    answer = reply.finish()
+                    tracer.observe("first_text", reply.first_text_at)
+                else:
+                    answer = completion.choices[0].message.content
+                    tracer.record_usage(completion.get("usage"), completion.get("model"))
+            # Ответ, обращающийся к клиенту по имени, другим клиентам не отдаётся
+            if cacheable and not mentions_client(answer, client_texts):
+                answer_cache.store(user_message, query_vector, answer, time.perf_counter() - started)
+            deliver_answer(chat_id, username, answer, streamed=STREAM_REPLIES)
+        except QuotaExceeded as e:
+            logger.warning(f"Rejected request: {e}")
+            wait = f"через {math.ceil(e.retry_after / 60)} мин." if e.retry_after else "чуть позже"
+            replies.reply_to(message, f"Слишком много вопросов подряд. Пожалуйста, повторите {wait}")
+        except (Unavailable, Overloaded, TimeoutError) as e:
+            # TimeoutError — в том числе EmbeddingTimeout, если эмбеддинг вопроса не получен вовремя
+            logger.error(f"Error generating response: {e}")
+            replies.reply_to(message, "Сервис ответов сейчас перегружен. Пожалуйста, повторите вопрос через минуту.")
         except Exception as e:
             logger.error(f"Error generating response: {e}")
-            bot.reply_to(message, "Произошла ошибка при обработке вашего запроса. Попробуйте позже.")
+            replies.reply_to(message, "Произошла ошибка при обработке вашего запроса. Попробуйте позже.")
 
 
-# Запуск бота
-bot.polling(none_stop=True)
+# Запуск бота: через webhook за обратным прокси или long polling; в обоих режимах работает один процесс,
+# потому что сессии, очереди чатов и кэши хранятся в его памяти
+if BOT_MODE == "webhook":
+    WebhookServer(bot).run()
+else:
+    bot.remove_webhook()
+    bot.polling(none_stop=True)
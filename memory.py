@@ -0,0 +1,167 @@
+import os
+import re
+import threading
+from collections import deque
+
+import tiktoken
+from loguru import logger
+
+# Бюджет токенов истории диалога в запросе и доля, отведённая под сжатое содержание
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))
+MEMORY_SUMMARY_BUDGET = int(os.getenv("MEMORY_SUMMARY_BUDGET", "300"))
+# Модель для сжатия старых реплик; без неё содержание собирается из первых предложений реплик
+MEMORY_SUMMARY_MODEL = os.getenv("MEMORY_SUMMARY_MODEL", "")
+# Сколько ждать сжатия моделью, секунд; после этого используется извлекающий вариант
+MEMORY_SUMMARY_TIMEOUT = float(os.getenv("MEMORY_SUMMARY_TIMEOUT", "20"))
+
+ROLE_LABELS = {"user": "User", "bot": "Bot"}
+
+_encoding = None
+_summary_clients = {}
+_summary_clients_lock = threading.Lock()
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов текста в кодировке gpt-4o."""
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model("gpt-4o")
+        except Exception as e:
+            # Файл кодировки скачивается при первом использовании; без сети считаем приблизительно
+            logger.error(f"Error loading tiktoken encoding, using approximate token counts: {e}")
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 3 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def first_sentence(text: str) -> str:
+    match = re.match(r'(.+?[.!?…])(\s|$)', text.strip(), re.S)
+    return (match.group(1) if match else text.strip()).replace("\n", " ")
+
+
+def trim_to_tokens(lines, budget):
+    """Отбрасывает самые старые строки, пока текст не уложится в бюджет; строки не режутся."""
+    lines = list(lines)
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > budget:
+        lines.pop(0)
+    return lines
+
+
+def extractive_summary(summary: str, turns, budget: int) -> str:
+    """Дописывает к содержанию первые предложения вытесненных реплик.
+
+    Первая строка (ответ на вопрос бота об имени) не вытесняется.
+    """
+    lines = summary.splitlines() if summary else []
+    lines += [f"{ROLE_LABELS[role]}: {first_sentence(text)}" for role, text, _ in turns]
+    head, rest = lines[:1], lines[1:]
+    return "\n".join(head + trim_to_tokens(rest, budget - count_tokens(head[0])))
+
+
+def summary_client(model: str):
+    """Общий для всех чатов LLMClient сжатия: таймауты, повторы и автомат отключения модели."""
+    with _summary_clients_lock:
+        client = _summary_clients.get(model)
+        if client is None:
+            from llm_client import LLMClient
+
+            client = LLMClient(model=model, fallback_model="", read_timeout=MEMORY_SUMMARY_TIMEOUT,
+                               deadline=MEMORY_SUMMARY_TIMEOUT, hedge_after=0, max_retries=1)
+            _summary_clients[model] = client
+    return client
+
+
+def gpt_summary(model: str):
+    """Сжатие вытесненных реплик моделью OpenAI с запасным извлекающим вариантом."""
+    def summarize(summary, turns, budget):
+        dialogue = "\n".join(f"{ROLE_LABELS[role]}: {text}" for role, text, _ in turns)
+        try:
+            completion = summary_client(model).create(
+                messages=[
+                    {"role": "system",
+                     "content": "Сожми диалог с нумерологом в краткое содержание на русском языке. "
+                                "Сохрани имя клиента, даты, числа и выводы. "
+                                f"Не больше {budget} токенов."},
+                    {"role": "user", "content": f"Текущее содержание:\n{summary}\n\nНовые реплики:\n{dialogue}"},
+                ],
+                temperature=0,
+                max_tokens=budget,
+            )
+            return completion.choices[0].message.content.strip()
+        except Exception as e:
+            logger.error(f"Error summarizing conversation with {model}: {e}")
+            return extractive_summary(summary, turns, budget)
+    return summarize
+
+
+class ConversationMemory:
+    """История диалога в пределах бюджета токенов.
+
+    Последние реплики хранятся дословно. Когда история превышает ``budget``,
+    самые старые реплики сворачиваются в краткое содержание; сворачиваются только
+    вытесненные реплики, содержание целиком не пересобирается.
+    """
+
+    __slots__ = ("budget", "summary_budget", "summarizer", "summary", "summary_tokens",
+                 "turns", "turn_tokens", "full_tokens")
+
+    def __init__(self, budget=MEMORY_TOKEN_BUDGET, summary_budget=MEMORY_SUMMARY_BUDGET, summarizer=None):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.summarizer = summarizer or (gpt_summary(MEMORY_SUMMARY_MODEL) if MEMORY_SUMMARY_MODEL
+                                         else extractive_summary)
+        self.summary = ""
+        self.summary_tokens = 0
+        self.turns = deque()
+        self.turn_tokens = 0
+        self.full_tokens = 0  # сколько токенов заняла бы вся история без сжатия
+
+    def is_empty(self) -> bool:
+        return not self.turns and not self.summary
+
+    @property
+    def tokens(self) -> int:
+        return self.summary_tokens + self.turn_tokens
+
+    def add(self, role: str, text: str):
+        tokens = count_tokens(f"{ROLE_LABELS[role]}: {text}")
+        self.turns.append((role, text, tokens))
+        self.turn_tokens += tokens
+        self.full_tokens += tokens
+        self._compact()
+
+    def _compact(self):
+        evicted = []
+        # Последняя реплика остаётся дословной, даже если одна превышает бюджет
+        while len(self.turns) > 1 and self.tokens > self.budget:
+            turn = self.turns.popleft()
+            self.turn_tokens -= turn[2]
+            evicted.append(turn)
+            if self.summary_tokens == 0:
+                self.summary_tokens = self.summary_budget  # резервируем место под содержание
+        if evicted:
+            self.summary = self.summarizer(self.summary, evicted, self.summary_budget)
+            self.summary_tokens = count_tokens(self.summary)
+
+    def dump(self) -> dict:
+        """Состояние для сохранения в базу."""
+        return {"summary": self.summary, "turns": [list(turn) for turn in self.turns], "full_tokens": self.full_tokens}
+
+    @classmethod
+    def load(cls, data: dict):
+        memory = cls()
+        memory.summary = data["summary"]
+        memory.summary_tokens = count_tokens(memory.summary) if memory.summary else 0
+        memory.turns = deque(tuple(turn) for turn in data["turns"])
+        memory.turn_tokens = sum(turn[2] for turn in memory.turns)
+        memory.full_tokens = data["full_tokens"]
+        return memory
+
+    def render(self) -> str:
+        """Текст истории для запроса к модели."""
+        lines = [f"{ROLE_LABELS[role]}: {text}" for role, text, _ in self.turns]
+        if self.summary:
+            lines.insert(0, f"Краткое содержание предыдущего разговора:\n{self.summary}\n")
+        return "\n".join(lines)
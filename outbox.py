@@ -0,0 +1,257 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from loguru import logger
+from telebot.apihelper import ApiTelegramException
+
+from streaming import MAX_MESSAGE_LENGTH, split_message
+
+# Лимиты Telegram: около 30 сообщений в секунду всего и около одного в секунду в чат
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_SENDERS = int(os.getenv("OUTBOX_SENDERS", "8"))
+OUTBOX_MAX_RETRIES = 5
+
+# Приоритеты: ответы пользователям уходят раньше массового вывода админ-панели
+INTERACTIVE = 0
+BULK = 1
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now) -> float:
+        """Сколько секунд ждать до появления токена."""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now, seconds):
+        """Пауза после ответа 429 с retry_after."""
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+
+    def idle(self, now) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+class _Job:
+    __slots__ = ("method", "args", "kwargs", "priority", "futures", "created", "attempts")
+
+    def __init__(self, method, args, kwargs, priority):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.futures = [Future()]
+        self.created = time.monotonic()
+        self.attempts = 0
+
+    def mergeable(self, other) -> bool:
+        """Два простых текстовых сообщения подряд можно отправить одним."""
+        return (self.method == other.method == "send_message" and not self.kwargs and not other.kwargs
+                and self.priority == other.priority
+                and len(self.args[1]) + len(other.args[1]) + 2 <= MAX_MESSAGE_LENGTH)
+
+
+class Outbox:
+    """Очередь исходящих запросов к Bot API с ограничением частоты.
+
+    Запросы одного чата уходят строго по порядку, не чаще ``chat_rate`` в секунду
+    (с запасом ``chat_burst``), все вместе — не чаще ``global_rate``. При ответе 429
+    чат ставится на паузу на ``retry_after`` секунд и запрос повторяется. Из готовых
+    к отправке чатов первыми обслуживаются те, у кого в начале очереди ответ
+    пользователю, а не вывод админ-панели. Короткие текстовые сообщения, ждущие
+    отправки в один чат, склеиваются в одно.
+    """
+
+    def __init__(self, bot, global_rate=OUTBOX_GLOBAL_RATE, chat_rate=OUTBOX_CHAT_RATE,
+                 chat_burst=OUTBOX_CHAT_BURST, senders=OUTBOX_SENDERS):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets = {}
+        self._queues = {}
+        self._in_flight = set()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=senders, thread_name_prefix="outbox")
+
+        self.depth = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000)
+        threading.Thread(target=self._run_scheduler, name="outbox", daemon=True).start()
+
+    def submit(self, chat_id, method, *args, priority=INTERACTIVE, **kwargs) -> Future:
+        """Ставит вызов ``bot.<method>`` в очередь чата; результат придёт во Future."""
+        job = _Job(method, args, kwargs, priority)
+        with self._cond:
+            queue = self._queues.setdefault(chat_id, deque())
+            # Склеиваем только с ещё не отправленным хвостом очереди; голова очереди чата,
+            # уже переданная отправителю, не меняется, даже если её попытка ещё не началась
+            sending = len(queue) == 1 and chat_id in self._in_flight
+            if queue and not sending and queue[-1].attempts == 0 and queue[-1].mergeable(job):
+                tail = queue[-1]
+                tail.args = (chat_id, f"{tail.args[1]}\n\n{job.args[1]}")
+                tail.futures.extend(job.futures)
+                self.coalesced += 1
+                return job.futures[0]
+            queue.append(job)
+            self.depth += 1
+            self._cond.notify()
+        return job.futures[0]
+
+    def send_message(self, chat_id, text, priority=INTERACTIVE, **kwargs):
+        """Отправляет текст любой длины, деля его на части по границам слов."""
+        futures = [self.submit(chat_id, "send_message", chat_id, part, priority=priority, **kwargs)
+                   for part in split_message(text)]
+        return futures[-1] if futures else None
+
+    def proxy(self, priority=INTERACTIVE, wait=False):
+        """Объект с методами бота, которые идут через очередь.
+
+        С ``wait`` вызов дожидается ответа Bot API и возвращает его результат.
+        """
+        return _OutboxProxy(self, priority, wait)
+
+    def stats(self) -> dict:
+        """Глубина очереди, счётчики и задержка от постановки в очередь до ответа Bot API."""
+        latencies = sorted(self.latencies) or [0.0]
+        return {"depth": self.depth, "sent": self.sent, "coalesced": self.coalesced, "retries": self.retries,
+                "failed": self.failed, "latency_p50": latencies[len(latencies) // 2],
+                "latency_p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]}
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _run_scheduler(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                ready = [(queue[0].priority, queue[0].created, chat_id) for chat_id, queue in self._queues.items()
+                         if queue and chat_id not in self._in_flight]
+                wait = None
+                chosen = None
+                for _, _, chat_id in sorted(ready):
+                    delay = self._bucket(chat_id).delay(now)
+                    if delay <= 0:
+                        chosen = chat_id
+                        break
+                    wait = delay if wait is None else min(wait, delay)
+                if chosen is None:
+                    self._cond.wait(wait)
+                    continue
+                delay = self._global.delay(now)
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                self._global.consume(now)
+                self._bucket(chosen).consume(now)
+                self._in_flight.add(chosen)
+                job = self._queues[chosen][0]
+                job.attempts += 1
+            self._executor.submit(self._send, chosen, job)
+
+    def _send(self, chat_id, job):
+        try:
+            result = getattr(self.bot, job.method)(*job.args, **job.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and job.attempts <= OUTBOX_MAX_RETRIES:
+                retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+                logger.warning(f"Telegram rate limit for chat {chat_id}, retrying in {retry_after}s")
+                with self._cond:
+                    self.retries += 1
+                    self._bucket(chat_id).pause(time.monotonic(), retry_after)
+                    self._in_flight.discard(chat_id)
+                    self._cond.notify()
+                return
+            self._finish(chat_id, job, error=e)
+        except Exception as e:
+            self._finish(chat_id, job, error=e)
+        else:
+            self._finish(chat_id, job, result=result)
+
+    def _finish(self, chat_id, job, result=None, error=None):
+        with self._cond:
+            queue = self._queues[chat_id]
+            queue.popleft()
+            if not queue:
+                del self._queues[chat_id]
+                if self._buckets[chat_id].idle(time.monotonic()):
+                    del self._buckets[chat_id]
+            self._in_flight.discard(chat_id)
+            self.depth -= 1
+            if error is None:
+                self.sent += 1
+                self.latencies.append(time.monotonic() - job.created)
+            else:
+                self.failed += 1
+            self._cond.notify()
+            report = error is None and self.sent % 100 == 0
+        if report:
+            logger.info(f"Outbox: {self.stats()}")
+        if error is not None:
+            logger.error(f"Error calling {job.method} for chat {chat_id}: {error}")
+        for future in job.futures:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+class _OutboxProxy:
+    """Методы бота, перенаправленные в очередь: ``send_message``, ``send_sticker``, ``reply_to`` и т. д."""
+
+    def __init__(self, outbox, priority, wait):
+        self._outbox = outbox
+        self._priority = priority
+        self._wait = wait
+
+    def _result(self, future):
+        return future.result() if self._wait and future is not None else future
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self._wait or kwargs:
+            # Разметка клавиатуры и ожидание результата — только для одиночного сообщения
+            future = self._outbox.submit(chat_id, "send_message", chat_id, text, priority=self._priority, **kwargs)
+        else:
+            future = self._outbox.send_message(chat_id, text, priority=self._priority)
+        return self._result(future)
+
+    def reply_to(self, message, text, **kwargs):
+        return self._result(self._outbox.submit(message.chat.id, "send_message", message.chat.id, text,
+                                                priority=self._priority,
+                                                reply_to_message_id=message.message_id, **kwargs))
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            # chat_id — первый аргумент, кроме методов вроде edit_message_text, где он передаётся по имени
+            chat_id = kwargs["chat_id"] if "chat_id" in kwargs else args[0]
+            return self._result(self._outbox.submit(chat_id, method, *args, priority=self._priority, **kwargs))
+        return call
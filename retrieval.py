@@ -0,0 +1,229 @@
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from functools import lru_cache
+
+from loguru import logger
+
+# Размер LRU-кэша эмбеддингов запросов
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+# Быстрый путь без эмбеддинга: лучший BM25-результат должен быть во столько раз сильнее второго
+KEYWORD_FAST_PATH_RATIO = float(os.getenv("KEYWORD_FAST_PATH_RATIO", "1.5"))
+KEYWORD_FAST_PATH_MIN_SCORE = float(os.getenv("KEYWORD_FAST_PATH_MIN_SCORE", "3.0"))
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r'[a-zа-я0-9]+')
+STEM_CACHE_SIZE = 65536
+
+# Окончания русского стеммера Портера (Snowball); внутри группы — от длинных к коротким
+VOWELS = set("аеиоуыэюя")
+PERFECTIVE_GERUND = (("ившись", "ывшись", "ивши", "ывши", "ив", "ыв"), ("вшись", "вши", "в"))
+ADJECTIVE = ("ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой", "ем", "им",
+             "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")
+PARTICIPLE = (("ивш", "ывш", "ующ"), ("ем", "нн", "вш", "ющ", "щ"))
+REFLEXIVE = ("ся", "сь")
+VERB = (("ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено", "ует", "уют", "ены", "ить",
+         "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ят", "ит", "ыт", "ую", "ю"),
+        ("ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть", "й", "л", "н"))
+NOUN = ("иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи", "ии", "ей", "ой", "ий", "ям",
+        "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия", "ья", "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я")
+DERIVATIONAL = ("ость", "ост")
+SUPERLATIVE = ("ейше", "ейш")
+
+
+def _strip(word, start, endings, after_a=False):
+    """Снимает первое подходящее окончание, не заходя левее ``start``; None, если ни одно не подошло.
+
+    С ``after_a`` окончание должно стоять после «а» или «я», которые остаются в основе.
+    """
+    for ending in endings:
+        cut = len(word) - len(ending)
+        if cut >= start and word.endswith(ending) and (not after_a or (cut > start and word[cut - 1] in "ая")):
+            return word[:cut]
+    return None
+
+
+def _strip_grouped(word, start, groups):
+    """Окончания из пары групп: первая снимается где угодно, вторая — только после «а» или «я»."""
+    return _strip(word, start, groups[0]) or _strip(word, start, groups[1], after_a=True)
+
+
+def _regions(word):
+    """Начала областей RV и R2 стеммера Портера."""
+    rv = r1 = r2 = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i - 1] in VOWELS and word[i] not in VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i - 1] in VOWELS and word[i] not in VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word: str) -> str:
+    """Основа русского слова по стеммеру Портера: «судьба», «судьбы» и «судьбой» дают «судьб»."""
+    rv, r2 = _regions(word)
+    stemmed = _strip_grouped(word, rv, PERFECTIVE_GERUND)
+    if stemmed is None:
+        word = _strip(word, rv, REFLEXIVE) or word
+        stemmed = _strip(word, rv, ADJECTIVE)
+        if stemmed is not None:
+            stemmed = _strip_grouped(stemmed, rv, PARTICIPLE) or stemmed
+        else:
+            stemmed = _strip_grouped(word, rv, VERB) or _strip(word, rv, NOUN)
+    word = stemmed if stemmed is not None else word
+    if word.endswith("и") and len(word) > rv:
+        word = word[:-1]
+    word = _strip(word, r2, DERIVATIONAL) or word
+    if word.endswith("нн") and len(word) - 1 > rv:
+        return word[:-1]
+    superlative = _strip(word, rv, SUPERLATIVE)
+    if superlative is not None:
+        word = superlative
+        return word[:-1] if word.endswith("нн") and len(word) - 1 > rv else word
+    return word[:-1] if word.endswith("ь") and len(word) > rv else word
+
+
+def tokenize(text: str):
+    """Слова в нижнем регистре, приведённые к основе; числа и латиница сохраняются целиком."""
+    tokens = []
+    for word in TOKEN_PATTERN.findall(text.lower().replace('ё', 'е')):
+        tokens.append(word if word.isascii() else stem(word))
+    return tokens
+
+
+class BM25Index:
+    """Инвертированный индекс отрывков с ранжированием Okapi BM25."""
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((doc_id, tf))
+        count = len(self.lengths)
+        self.avg_length = sum(self.lengths) / count if count else 0.0
+        self.idf = {term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for term, docs in self.postings.items()}
+
+    def search(self, query: str, k: int):
+        """Возвращает до ``k`` пар (номер отрывка, оценка) по убыванию оценки."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class QueryEmbeddingCache:
+    """LRU-кэш эмбеддингов запросов: повторный вопрос не ходит в API эмбеддингов."""
+
+    def __init__(self, embeddings, max_size=QUERY_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_query(self, text: str):
+        key = " ".join(text.lower().split())
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is not None:
+                self._vectors.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._vectors[key] = vector
+            if len(self._vectors) > self.max_size:
+                self._vectors.popitem(last=False)
+        return vector
+
+
+class HybridRetriever:
+    """Поиск отрывков базы знаний: BM25 и FAISS, объединённые через reciprocal rank fusion.
+
+    Если ключевые слова однозначно указывают на отрывок, векторный поиск
+    пропускается вместе с запросом эмбеддинга.
+    """
+
+    def __init__(self, vector_store, chunks, query_cache, fetch_k=10):
+        self.vector_store = vector_store
+        self.query_cache = query_cache
+        self.fetch_k = fetch_k
+        self.documents = list({chunk.page_content: chunk for chunk in chunks}.values())
+        self.keyword_index = BM25Index([doc.page_content for doc in self.documents])
+        self.fast_path_hits = 0
+
+    def embed_query(self, text: str):
+        return self.query_cache.embed_query(text)
+
+    def is_decisive(self, keyword_hits) -> bool:
+        if not keyword_hits or keyword_hits[0][1] < KEYWORD_FAST_PATH_MIN_SCORE:
+            return False
+        return len(keyword_hits) == 1 or keyword_hits[0][1] >= KEYWORD_FAST_PATH_RATIO * keyword_hits[1][1]
+
+    def search(self, query: str, k: int = 4, vector=None):
+        """Возвращает ``k`` самых релевантных отрывков; ``vector`` — готовый эмбеддинг запроса."""
+        return [doc for doc, _ in self.search_scored(query, k, vector)]
+
+    def search_scored(self, query: str, k: int = 4, vector=None):
+        """Как ``search``, но пары (отрывок, оценка релевантности); у лучшего отрывка оценка равна 1.
+
+        Порядок задаёт RRF, а оценка — среднее нормированных BM25 (доля от
+        лучшего) и близости векторов (доля от разброса расстояний среди
+        кандидатов FAISS). В отличие от оценки RRF, она отличает слабые
+        совпадения от сильных, поэтому по ней можно отсекать отрывки.
+        """
+        keyword_hits = self.keyword_index.search(query, self.fetch_k)
+        if vector is None and self.is_decisive(keyword_hits):
+            self.fast_path_hits += 1
+            logger.debug(f"Keyword fast path for query: {query}")
+            top = keyword_hits[0][1]
+            return [(self.documents[doc_id], score / top) for doc_id, score in keyword_hits[:k]]
+
+        if vector is None:
+            vector = self.embed_query(query)
+        vector_hits = self.vector_store.similarity_search_with_score_by_vector(vector, k=self.fetch_k)
+
+        fused = defaultdict(float)
+        relevance = defaultdict(float)
+        documents = {}
+        keyword_top = keyword_hits[0][1] if keyword_hits else 0.0
+        for rank, (doc_id, score) in enumerate(keyword_hits):
+            doc = self.documents[doc_id]
+            fused[doc.page_content] += 1 / (RRF_K + rank + 1)
+            relevance[doc.page_content] += score / keyword_top / 2
+            documents[doc.page_content] = doc
+        distances = [float(distance) for _, distance in vector_hits]
+        nearest, farthest = (min(distances), max(distances)) if distances else (0.0, 0.0)
+        for rank, (doc, distance) in enumerate(vector_hits):
+            fused[doc.page_content] += 1 / (RRF_K + rank + 1)
+            closeness = (farthest - float(distance)) / (farthest - nearest) if farthest > nearest else 1.0
+            relevance[doc.page_content] += closeness / 2
+            documents.setdefault(doc.page_content, doc)
+        ranked = sorted(fused, key=fused.get, reverse=True)[:k]
+        if not ranked:
+            return []
+        best = max(relevance.values())
+        return [(documents[content], relevance[content] / best) for content in ranked]
@@ -0,0 +1,166 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from loguru import logger
+
+from memory import ConversationMemory
+
+# Ограничения хранилища сессий в памяти
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+SESSION_MAX_MB = float(os.getenv("SESSION_MAX_MB", "64"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "30"))
+
+# Приблизительный размер пустой сессии в памяти, байт
+SESSION_BASE_SIZE = 400
+
+
+class Session:
+    """Состояние одного чата: шаг сценария и история диалога."""
+
+    __slots__ = ("chat_id", "state", "memory", "last_seen", "dirty")
+
+    def __init__(self, chat_id, state=None, memory=None):
+        self.chat_id = chat_id
+        self.state = state
+        self.memory = memory
+        self.last_seen = time.monotonic()
+        self.dirty = False
+
+    def size(self) -> int:
+        """Приблизительный объём сессии в памяти, байт."""
+        if self.memory is None:
+            return SESSION_BASE_SIZE
+        text = len(self.memory.summary) + sum(len(turn[1]) for turn in self.memory.turns)
+        return SESSION_BASE_SIZE + 2 * text
+
+
+class SessionStore:
+    """Сессии чатов с вытеснением по LRU, простою и объёму памяти.
+
+    Вытесненные сессии сохраняются в таблицу ``sessions`` и лениво поднимаются
+    оттуда при следующем сообщении; изменённые сессии периодически сбрасываются
+    в базу, поэтому переживают и перезапуск бота.
+    """
+
+    def __init__(self, storage, max_count=SESSION_MAX_COUNT, max_mb=SESSION_MAX_MB,
+                 idle_ttl=SESSION_IDLE_TTL, sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.storage = storage
+        self.max_count = max_count
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        with storage.connection() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS sessions (
+                chat_id INTEGER PRIMARY KEY,
+                state TEXT,
+                memory TEXT,
+                updated DATETIME DEFAULT CURRENT_TIMESTAMP
+            )''')
+        if sweep_interval > 0:
+            threading.Thread(target=self._run_sweeper, args=(sweep_interval,), name="session-sweeper",
+                             daemon=True).start()
+        atexit.register(self.persist)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, chat_id) -> Session:
+        """Возвращает сессию чата, поднимая её из базы или создавая новую."""
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is not None:
+                self._sessions.move_to_end(chat_id)
+        if session is None:
+            session = self._load(chat_id) or Session(chat_id)
+            with self._lock:
+                # Пока сессия читалась из базы, её мог создать другой поток
+                session = self._sessions.setdefault(chat_id, session)
+                evicted = self._evict_over_count()
+            self._save(evicted, force=True)
+        session.last_seen = time.monotonic()
+        session.dirty = True
+        return session
+
+    def persist(self):
+        """Сохраняет в базу все изменённые сессии."""
+        with self._lock:
+            dirty = [session for session in self._sessions.values() if session.dirty]
+        self._save(dirty)
+
+    def sweep(self):
+        """Вытесняет простаивающие сессии и сессии сверх лимита памяти."""
+        deadline = time.monotonic() - self.idle_ttl
+        with self._lock:
+            evicted = []
+            for chat_id, session in list(self._sessions.items()):
+                if session.last_seen >= deadline:
+                    break
+                evicted.append(self._sessions.pop(chat_id))
+            total = sum(session.size() for session in self._sessions.values())
+            while self._sessions and total > self.max_bytes:
+                _, session = self._sessions.popitem(last=False)
+                total -= session.size()
+                evicted.append(session)
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} sessions, {len(self._sessions)} in memory")
+        self._save(evicted, force=True)
+
+    def _evict_over_count(self):
+        # Вытесняем с запасом до 95% лимита, чтобы писать в базу пачками, а не по одной сессии
+        evicted = []
+        if len(self._sessions) > self.max_count:
+            while len(self._sessions) > self.max_count * 0.95:
+                evicted.append(self._sessions.popitem(last=False)[1])
+        return evicted
+
+    def _load(self, chat_id):
+        try:
+            with self.storage.connection() as conn:
+                row = conn.execute("SELECT state, memory FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+        except Exception as e:
+            logger.error(f"Error loading session {chat_id}: {e}")
+            return None
+        if row is None:
+            return None
+        state, memory = row
+        return Session(chat_id, state, ConversationMemory.load(json.loads(memory)) if memory else None)
+
+    def _save(self, sessions, force=False):
+        """Записывает сессии в базу; вытесняемые (``force``) — даже без отметки об изменении."""
+        rows = []
+        for session in sessions:
+            if not (session.dirty or force):
+                continue
+            session.dirty = False
+            try:
+                memory = json.dumps(session.memory.dump(), ensure_ascii=False) if session.memory else None
+            except RuntimeError:
+                # История меняется воркером прямо сейчас — сохраним при следующем сбросе
+                session.dirty = True
+                continue
+            rows.append((session.chat_id, session.state, memory))
+        if not rows:
+            return
+        try:
+            with self.storage.connection() as conn:
+                conn.executemany('''INSERT INTO sessions (chat_id, state, memory) VALUES (?, ?, ?)
+                                    ON CONFLICT(chat_id) DO UPDATE SET
+                                    state = excluded.state, memory = excluded.memory,
+                                    updated = CURRENT_TIMESTAMP''', rows)
+        except Exception as e:
+            logger.error(f"Error saving {len(rows)} sessions: {e}")
+
+    def _run_sweeper(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+                self.persist()
+            except Exception as e:
+                logger.error(f"Error sweeping sessions: {e}")
@@ -0,0 +1,154 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from loguru import logger
+
+DB_PATH = os.getenv("DB_PATH", "users.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "100"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))
+
+_STOP = object()
+
+
+class Storage:
+    """Доступ к users.db через пул долгоживущих соединений в режиме WAL.
+
+    Сообщения записываются не сразу: ``log_message`` кладёт строку в очередь, а
+    фоновый поток вставляет накопленное одной транзакцией, когда набралось
+    ``batch_size`` строк или прошло ``flush_interval`` секунд.
+    """
+
+    def __init__(self, path=DB_PATH, pool_size=DB_POOL_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pool = queue.LifoQueue()
+        self._created = 0
+        self._pool_size = pool_size
+        self._pool_lock = threading.Lock()
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run_writer, name="db-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт соединение из пула; транзакция фиксируется при выходе без ошибок."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                create = self._created < self._pool_size
+                if create:
+                    self._created += 1
+            conn = self._connect() if create else self._pool.get()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.put(conn)
+
+    def init_schema(self):
+        with self.connection() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS allowed_users (username TEXT PRIMARY KEY)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT,
+                message TEXT,
+                direction TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )''')
+            conn.execute('''CREATE INDEX IF NOT EXISTS idx_messages_username_timestamp
+                            ON messages (username, timestamp)''')
+            conn.execute('''CREATE INDEX IF NOT EXISTS idx_messages_username_id
+                            ON messages (username, id)''')
+
+    def log_message(self, username, message, direction):
+        """Ставит сообщение в очередь на запись; время фиксируется в момент вызова."""
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._queue.put((username, message, direction, timestamp))
+
+    def iter_messages(self, username, page_size=500, after_id=0):
+        """Отдаёт сообщения пользователя по порядку страницами по ``page_size`` строк.
+
+        Каждая страница читается отдельным запросом по ``id``, поэтому в памяти
+        одновременно находится не больше одной страницы, а соединение не
+        удерживается между страницами.
+        """
+        while True:
+            with self.connection() as conn:
+                rows = conn.execute("SELECT id, message, direction, timestamp FROM messages "
+                                    "WHERE username = ? AND id > ? ORDER BY id LIMIT ?",
+                                    (username, after_id, page_size)).fetchall()
+            yield from rows
+            if len(rows) < page_size:
+                return
+            after_id = rows[-1][0]
+
+    def flush(self):
+        """Дожидается записи всех сообщений, поставленных в очередь до вызова."""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _write_batch(self, batch):
+        if not batch:
+            return
+        try:
+            with self.connection() as conn:
+                conn.executemany(
+                    "INSERT INTO messages (username, message, direction, timestamp) VALUES (?, ?, ?, ?)", batch)
+            logger.debug(f"Flushed {len(batch)} messages to database")
+        except Exception as e:
+            logger.error(f"Error logging {len(batch)} messages: {e}")
+
+    def _run_writer(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, tuple):
+                batch.append(item)
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+            self._write_batch(batch)
+            batch = []
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
@@ -0,0 +1,104 @@
+import os
+import re
+import time
+
+from loguru import logger
+
+MAX_MESSAGE_LENGTH = 4096  # Максимальная длина сообщения в Telegram
+# Минимальный интервал между правками сообщения во время потоковой генерации, секунды
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+URL_PATTERN = re.compile(r'https?://\S+')
+
+
+def split_point(text: str, limit: int = MAX_MESSAGE_LENGTH) -> int:
+    """Позиция, по которой можно отрезать не больше ``limit`` символов, не разрывая слово или ссылку."""
+    if len(text) <= limit:
+        return len(text)
+    boundary = limit
+    for match in URL_PATTERN.finditer(text, 0, limit + 1):
+        if match.start() < limit < match.end():
+            boundary = match.start()
+    window = text[:boundary]
+    cut = window.rfind('\n')
+    if cut < boundary // 2:
+        cut = max(cut, window.rfind(' '))
+    if cut > 0:
+        return cut
+    # Слово или ссылка длиннее сообщения — режем жёстко
+    return boundary if boundary > 0 else limit
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH):
+    """Делит текст на части не длиннее ``limit`` по границам слов."""
+    parts = []
+    while text:
+        cut = split_point(text, limit)
+        part, text = text[:cut].rstrip(), text[cut:].lstrip()
+        if part:
+            parts.append(part)
+    return parts
+
+
+class StreamingReply:
+    """Показывает ответ по мере генерации, редактируя отправленное сообщение.
+
+    Первый непустой фрагмент сразу уходит новым сообщением, дальше текст
+    дописывается через ``edit_message_text`` не чаще раза в ``edit_interval`` секунд.
+    Когда текст перерастает лимит Telegram, текущее сообщение дописывается до
+    границы слова, а остаток продолжается в новом.
+    """
+
+    def __init__(self, bot, chat_id, edit_interval=STREAM_EDIT_INTERVAL, limit=MAX_MESSAGE_LENGTH):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+        self.limit = limit
+        self.first_text_at = None
+        self._started = time.perf_counter()
+        self._text = ""
+        self._messages = 1
+        self._current = ""
+        self._message_id = None
+        self._shown = ""
+        self._last_edit = 0.0
+
+    def feed(self, delta: str):
+        if not delta:
+            return
+        self._text += delta
+        self._current += delta
+        while len(self._current) > self.limit:
+            cut = split_point(self._current, self.limit)
+            head, self._current = self._current[:cut].rstrip(), self._current[cut:].lstrip()
+            self._show(head)
+            self._messages += 1
+            self._message_id, self._shown = None, ""
+        if self._message_id is None or time.monotonic() - self._last_edit >= self.edit_interval:
+            self._show(self._current)
+
+    def finish(self) -> str:
+        """Показывает остаток текста и возвращает ответ целиком."""
+        self._show(self._current)
+        logger.debug(f"Streamed reply to {self.chat_id}: {self._messages} messages, "
+                     f"first text after {self.first_text_at or 0:.2f}s")
+        return self._text
+
+    def _show(self, text):
+        # Telegram обрезает пробельные символы по краям, и правка без изменений вернула бы ошибку
+        text = text.strip()
+        if not text or text == self._shown:
+            return
+        if self._message_id is None:
+            message = self.bot.send_message(self.chat_id, text)
+            self._message_id = message.message_id
+            if self.first_text_at is None:
+                self.first_text_at = time.perf_counter() - self._started
+        else:
+            try:
+                self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self._message_id)
+            except Exception as e:
+                logger.warning(f"Error editing streamed message in {self.chat_id}: {e}")
+                return
+        self._shown = text
+        self._last_edit = time.monotonic()
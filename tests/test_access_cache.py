@@ -0,0 +1,95 @@
+"""Кэш доступа совпадает с таблицей allowed_users после любых изменений."""
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from access_cache import AccessCache
+from storage import Storage
+
+USERS = [f"user{i}" for i in range(20)]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = Storage(path=str(tmp_path / "users.db"))
+    storage.init_schema()
+    yield storage
+    storage.close()
+
+
+def database_users(storage):
+    with storage.connection() as conn:
+        return {row[0] for row in conn.execute("SELECT username FROM allowed_users")}
+
+
+def assert_consistent(cache, storage):
+    allowed = database_users(storage)
+    for username in USERS:
+        assert cache.is_allowed(username) == (username in allowed), username
+
+
+def external(storage, sql, *params):
+    """Правка базы в обход бота, отдельным соединением."""
+    conn = sqlite3.connect(storage.path)
+    with conn:
+        conn.execute(sql, params)
+    conn.close()
+
+
+def test_add_and_remove(storage):
+    cache = AccessCache(storage, "", ttl=0)
+    cache.add_user("user1")
+    cache.add_user("user2")
+    assert database_users(storage) == {"user1", "user2"}
+    assert_consistent(cache, storage)
+    cache.remove_user("user1")
+    assert database_users(storage) == {"user2"}
+    assert_consistent(cache, storage)
+
+
+def test_reload_picks_up_external_edits(storage):
+    cache = AccessCache(storage, "", ttl=0)
+    cache.add_user("user1")
+    external(storage, "INSERT INTO allowed_users (username) VALUES (?)", "user3")
+    external(storage, "DELETE FROM allowed_users WHERE username = ?", "user1")
+    assert cache.is_allowed("user1") and not cache.is_allowed("user3")
+    cache.reload()
+    assert cache.is_allowed("user3") and not cache.is_allowed("user1")
+    assert_consistent(cache, storage)
+
+
+def test_ttl_refresh_picks_up_external_edits(storage):
+    cache = AccessCache(storage, "", ttl=0.05)
+    external(storage, "INSERT INTO allowed_users (username) VALUES (?)", "user4")
+    deadline = time.monotonic() + 5
+    while not cache.is_allowed("user4") and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert_consistent(cache, storage)
+    assert cache.is_allowed("user4")
+
+
+def test_concurrent_add_remove(storage):
+    cache = AccessCache(storage, "", ttl=0)
+
+    def churn(seed):
+        for i in range(200):
+            username = USERS[(seed * 7 + i) % len(USERS)]
+            if (seed + i) % 3:
+                cache.add_user(username)
+            else:
+                cache.remove_user(username)
+
+    threads = [threading.Thread(target=churn, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert_consistent(cache, storage)
+
+
+def test_admins_are_always_allowed(storage):
+    cache = AccessCache(storage, "admin, boss", ttl=0)
+    assert cache.is_admin("boss") and cache.is_allowed("admin")
+    assert not cache.is_admin("user1")
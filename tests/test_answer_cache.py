@@ -0,0 +1,45 @@
+"""Какие вопросы можно отвечать из общего кэша."""
+import pytest
+
+from answer_cache import is_personal, is_standalone, mentions_client
+
+
+@pytest.mark.parametrize("question", [
+    "Что означает число жизненного пути 7?",
+    "Как рассчитать число судьбы?",
+    "Чем отличаются числа 11 и 22?",
+])
+def test_general_questions_are_cacheable(question):
+    assert is_standalone(question)
+
+
+@pytest.mark.parametrize("question", [
+    "Почему?",
+    "Расскажи подробнее",
+    "Объясни",
+    "Ответь короче",
+    "Что дальше?",
+    "Анна",
+    "Маша",
+])
+def test_follow_ups_are_not_cacheable(question):
+    assert not is_standalone(question)
+
+
+@pytest.mark.parametrize("question", [
+    "Какое у меня число судьбы?",
+    "Я родилась 7 марта 1990 года, что это значит?",
+    "Посчитай для 07.03.1990",
+    "А если число 8?",
+    "Расскажи подробнее про то, что ты сказал выше",
+    "Моя дочь родилась в 2015, какое у неё число?",
+])
+def test_personal_questions_bypass_cache(question):
+    assert is_personal(question)
+    assert not is_standalone(question)
+
+
+def test_answer_with_client_name_is_detected():
+    client_texts = ["", "Анна"]
+    assert mentions_client("Анна, число 7 — число мудреца.", client_texts)
+    assert not mentions_client("Число 7 — число мудреца.", client_texts)
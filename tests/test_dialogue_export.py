@@ -0,0 +1,53 @@
+"""Выгрузка диалога: имена файлов и ограничение Bot API на размер файла."""
+import gzip
+import os
+
+from dialogue_export import export_dialogue, prepare_upload, safe_filename
+from storage import Storage
+
+MESSAGE = "Что означает моё число судьбы и как оно влияет на карьеру? "
+
+
+def test_safe_filename_strips_path_separators():
+    assert "/" not in safe_filename("../../etc/passwd")
+    assert not safe_filename("../x").startswith(".")
+    assert safe_filename("ivan_petrov") == "ivan_petrov"
+
+
+def test_username_with_slash_is_exported(tmp_path):
+    storage = Storage(path=str(tmp_path / "users.db"))
+    storage.init_schema()
+    storage.log_message("a/../b", MESSAGE, "incoming")
+    storage.flush()
+    path = export_dialogue(storage, "a/../b", "txt")
+    try:
+        assert os.path.dirname(path) == os.path.dirname(os.path.abspath(path))
+        assert "/" not in os.path.basename(path)
+        with open(path, encoding="utf-8") as f:
+            assert MESSAGE.strip() in f.read()
+    finally:
+        os.remove(path)
+        storage.close()
+
+
+def test_small_file_is_sent_as_is(tmp_path):
+    path = tmp_path / "dialogue.txt"
+    path.write_text("строка\n" * 10, encoding="utf-8")
+    assert prepare_upload(str(path), "dialogue_x.txt") == [(str(path), "dialogue_x.txt")]
+
+
+def test_large_file_is_compressed_and_split(tmp_path):
+    path = tmp_path / "dialogue.txt"
+    # Неповторяющиеся строки сжимаются плохо, поэтому одного .gz не хватает
+    lines = [f"{i} {os.urandom(24).hex()}\n" for i in range(20000)]
+    path.write_text("".join(lines), encoding="utf-8")
+    max_bytes = 256 * 1024
+    files = prepare_upload(str(path), "dialogue_x.txt", max_bytes=max_bytes)
+    assert len(files) > 1
+    assert [name for _, name in files][0] == f"dialogue_x.part1of{len(files)}.txt.gz"
+    restored = []
+    for part_path, _ in files:
+        assert os.path.getsize(part_path) <= max_bytes
+        with gzip.open(part_path, "rt", encoding="utf-8") as f:
+            restored.extend(f)
+    assert restored == lines
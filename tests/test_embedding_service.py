@@ -0,0 +1,74 @@
+"""Ограничение времени ожидания эмбеддингов."""
+import threading
+import time
+
+import openai
+import pytest
+from loguru import logger
+
+from embedding_service import EmbeddingService, EmbeddingTimeout, OpenAIBackend
+
+
+class HangingBackend:
+    model = "hanging"
+    retryable = (ConnectionError,)
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def embed_documents(self, texts):
+        self.release.wait()
+        return [[1.0, 0.0] for _ in texts]
+
+
+class FailingBackend:
+    model = "failing"
+    retryable = (ConnectionError,)
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        raise ConnectionError("API is down")
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logger.disable("embedding_service")
+    yield
+    logger.enable("embedding_service")
+
+
+def test_hung_query_times_out():
+    backend = HangingBackend()
+    service = EmbeddingService(backend, query_deadline=0.3)
+    started = time.monotonic()
+    with pytest.raises(EmbeddingTimeout):
+        service.embed_query("Что значит число 7?")
+    assert time.monotonic() - started < 1.0
+    assert service.timeouts == 1
+    backend.release.set()
+
+
+def test_retries_stop_at_query_deadline():
+    backend = FailingBackend()
+    service = EmbeddingService(backend, max_retries=5, query_deadline=0.6)
+    started = time.monotonic()
+    with pytest.raises((ConnectionError, EmbeddingTimeout)):
+        service.embed_query("Что значит число 7?")
+    assert time.monotonic() - started < 1.0
+    assert backend.calls < 6
+
+
+def test_openai_request_has_timeout(monkeypatch):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return {"data": [{"index": 0, "embedding": [0.5]}]}
+
+    monkeypatch.setattr(openai.Embedding, "create", create)
+    backend = OpenAIBackend("test", connect_timeout=2, read_timeout=7)
+    assert backend.embed_documents(["число"]) == [[0.5]]
+    assert calls[0]["request_timeout"] == (2, 7)
@@ -0,0 +1,58 @@
+"""Горячее обновление базы знаний после неудачной попытки."""
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+
+import index_cache
+import knowledge_base
+from knowledge_base import KnowledgeBase
+
+
+class FakeDocs:
+    """Экспорт Google Docs с ETag и ответом 304 на условный запрос."""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def get(self, url, headers, timeout):
+        text = self.documents[url.split("/")[-2]]
+        etag = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if headers.get("If-None-Match") == etag:
+            return SimpleNamespace(status_code=304)
+        return SimpleNamespace(status_code=200, headers={"ETag": etag}, text=text, raise_for_status=lambda: None)
+
+
+@pytest.fixture
+def docs(monkeypatch):
+    docs = FakeDocs({"system": "Ты — нумеролог.", "database": "Число 7 — число мудреца."})
+    monkeypatch.setattr(knowledge_base, "DOCUMENT_EXPORT_URL", "https://docs.test/{}/export")
+    monkeypatch.setattr(knowledge_base.requests, "get", docs.get)
+    return docs
+
+
+def test_failed_refresh_is_retried(docs, monkeypatch, tmp_path):
+    kb = KnowledgeBase("/document/d/system/edit", "/document/d/database/edit", lambda: None,
+                       cache_dir=str(tmp_path), refresh_interval=0)
+    (system, database), kb._validators = kb._fetch()
+    kb._texts = {"system": system, "database": database}
+    kb.retriever = SimpleNamespace(vector_store=None, query_cache=None, fetch_k=10)
+
+    docs.documents["database"] = "Число 7 — число мудреца и исследователя."
+    calls = []
+
+    def update(self, vector_store, chunks, embeddings):
+        calls.append(chunks)
+        if len(calls) == 1:
+            raise RuntimeError("embedding API is down")
+        self.embedded = len(chunks)
+        return "index"
+
+    monkeypatch.setattr(index_cache.IndexCache, "update", update)
+    with pytest.raises(RuntimeError):
+        kb.refresh()
+    assert kb._texts["database"] == database
+
+    assert kb.refresh()
+    assert kb._texts["database"] == docs.documents["database"]
+    assert not kb.refresh()
@@ -0,0 +1,114 @@
+"""LLMClient против локальной замены OpenAI: автомат отключения, запасная модель, хеджирование и лимиты."""
+import time
+from contextlib import ExitStack
+
+import openai
+import pytest
+from fake_openai import FakeOpenAIServer
+from loguru import logger
+
+import llm_client
+from llm_client import CircuitBreaker, LLMClient, QuotaExceeded, Unavailable, UserLimiter, install_session
+from memory import summary_client
+
+MESSAGES = [{"role": "user", "content": "Что означает число судьбы 7?"}]
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch):
+    logger.disable("llm_client")
+    monkeypatch.setattr(llm_client, "LLM_RETRY_DELAY", 0.01)
+    monkeypatch.setattr(openai, "api_key", "test")
+    monkeypatch.setattr(openai, "requestssession", None)
+    yield
+    logger.enable("llm_client")
+
+
+@pytest.fixture
+def server_factory(monkeypatch):
+    with ExitStack() as stack:
+        def start(**options):
+            server = stack.enter_context(FakeOpenAIServer(first_token_latency=0.01, token_latency=0,
+                                                          answer="Семь.", **options))
+            monkeypatch.setattr(openai, "api_base", server.api_base)
+            return server
+        yield start
+
+
+def test_breaker_opens_probes_and_closes():
+    breaker = CircuitBreaker(failures=2, reset_timeout=0.1)
+    assert breaker.state == "closed"
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.15)
+    assert breaker.state == "half-open"
+    # В полуоткрытом состоянии пропускается только один пробный запрос
+    assert breaker.allow() and not breaker.allow()
+    assert breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.15)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_falls_back_and_stops_calling_a_down_model(server_factory):
+    server = server_factory(down_models={"gpt-4o"})
+    client = LLMClient(model="gpt-4o", fallback_model="gpt-4o-mini", max_retries=0, hedge_after=0, deadline=10)
+    for _ in range(8):
+        assert client.create(MESSAGES)["model"] == "gpt-4o-mini"
+    assert client.breakers["gpt-4o"].state == "open"
+    # После отключения основной модели запросы к ней больше не уходят
+    assert server.model_requests["gpt-4o"] == llm_client.LLM_BREAKER_FAILURES
+    assert client.stats()["fallbacks"] == 8
+
+
+def test_unavailable_without_fallback(server_factory):
+    server_factory(down_models={"gpt-4o"})
+    client = LLMClient(model="gpt-4o", fallback_model="", max_retries=1, hedge_after=0, deadline=10)
+    with pytest.raises(Unavailable):
+        client.create(MESSAGES)
+    assert client.stats()["failures"] == 1
+
+
+def test_slow_model_is_hedged(server_factory):
+    server_factory(model_latency={"gpt-4o": 5.0})
+    client = LLMClient(model="gpt-4o", fallback_model="gpt-4o-mini", hedge_after=0.2, deadline=10)
+    started = time.monotonic()
+    chunks = list(client.create(MESSAGES, stream=True))
+    assert time.monotonic() - started < 2
+    assert {chunk["model"] for chunk in chunks} == {"gpt-4o-mini"}
+    assert client.stats()["hedges"] == 1
+
+
+def test_user_limiter_concurrency_and_quota():
+    limiter = UserLimiter(concurrency=1, quota=2, window=60)
+    limiter.acquire("anna")
+    with pytest.raises(QuotaExceeded):
+        limiter.acquire("anna")
+    limiter.acquire("boris")
+    limiter.release("anna")
+    limiter.acquire("anna")
+    limiter.release("anna")
+    with pytest.raises(QuotaExceeded) as error:
+        limiter.acquire("anna")
+    assert 0 < error.value.retry_after <= 60
+    assert limiter.rejected == 2
+
+
+def test_limiter_is_released_after_stream(server_factory):
+    server_factory()
+    client = LLMClient(limiter=UserLimiter(concurrency=1, quota=0), hedge_after=0, deadline=10)
+    for _ in range(3):
+        assert "".join(chunk.choices[0].delta.get("content") or "" for chunk in
+                       client.create(MESSAGES, user="anna", stream=True) if chunk.choices) == "Семь. "
+
+
+def test_clients_do_not_replace_installed_session(server_factory):
+    server_factory()
+    session = install_session()
+    assert install_session() is session
+    LLMClient(hedge_after=0, deadline=10).create(MESSAGES)
+    summary_client("gpt-4o-mini").create(MESSAGES)
+    assert openai.requestssession is session
@@ -0,0 +1,107 @@
+"""Очередь исходящих сообщений против локальной замены Bot API."""
+import threading
+import time
+
+import pytest
+import telebot
+from fake_telegram import FakeTelegramServer
+from loguru import logger
+
+from outbox import BULK, INTERACTIVE, Outbox
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logger.disable("outbox")
+    yield
+    logger.enable("outbox")
+
+
+@pytest.fixture
+def bot():
+    return telebot.TeleBot("123456:TEST", threaded=False)
+
+
+def test_messages_of_a_chat_keep_order(bot):
+    with FakeTelegramServer(chat_rate=50, chat_burst=50, latency=0.01) as server:
+        outbox = Outbox(bot, chat_rate=50, chat_burst=50)
+        # disable_notification не даёт склеить сообщения, поэтому каждое уходит отдельно
+        futures = [outbox.submit(1, "send_message", 1, f"part {i}", disable_notification=True) for i in range(20)]
+        for future in futures:
+            future.result(timeout=10)
+    assert server.delivered[1] == [f"part {i}" for i in range(20)]
+
+
+def test_rate_limited_message_is_retried(bot):
+    # Outbox отправляет чаще, чем разрешает сервер, и получает 429 с retry_after
+    with FakeTelegramServer(chat_rate=1, chat_burst=1, latency=0.01) as server:
+        outbox = Outbox(bot, chat_rate=20, chat_burst=20)
+        futures = [outbox.submit(1, "send_message", 1, f"part {i}", disable_notification=True) for i in range(3)]
+        for future in futures:
+            future.result(timeout=20)
+    assert server.rate_limited > 0
+    assert outbox.retries > 0 and outbox.failed == 0
+    assert server.delivered[1] == ["part 0", "part 1", "part 2"]
+
+
+def test_interactive_messages_go_before_bulk(bot):
+    order = []
+    lock = threading.Lock()
+
+    def record(chat_id):
+        def done(future):
+            with lock:
+                order.append(chat_id)
+        return done
+
+    with FakeTelegramServer(latency=0.01):
+        # Общий лимит 2 в секунду: сразу уходят не больше двух сообщений, остальные ждут в очереди
+        outbox = Outbox(bot, global_rate=2)
+        futures = []
+        for chat_id in (1, 2, 3, 4):
+            futures.append(outbox.submit(chat_id, "send_message", chat_id, "page", priority=BULK))
+        futures.append(outbox.submit(5, "send_message", 5, "answer", priority=INTERACTIVE))
+        for chat_id, future in zip((1, 2, 3, 4, 5), futures):
+            future.add_done_callback(record(chat_id))
+        for future in futures:
+            future.result(timeout=10)
+    assert order.index(5) <= 2
+
+
+def test_short_messages_are_coalesced(bot):
+    with FakeTelegramServer(latency=0.3) as server:
+        outbox = Outbox(bot)
+        first = outbox.submit(1, "send_message", 1, "a")
+        time.sleep(0.1)  # первое сообщение уже отправляется и не должно измениться
+        futures = [first] + [outbox.submit(1, "send_message", 1, text) for text in ("b", "c")]
+        results = [future.result(timeout=10) for future in futures]
+    assert server.delivered[1] == ["a", "b\n\nc"]
+    assert outbox.coalesced == 1
+    assert results[1].message_id == results[2].message_id
+
+
+class SlowStartExecutor:
+    """Отправитель начинает работу с задержкой после того, как планировщик выбрал сообщение."""
+
+    def __init__(self, executor, delay):
+        self.executor = executor
+        self.delay = delay
+
+    def submit(self, fn, *args):
+        def run():
+            time.sleep(self.delay)
+            return fn(*args)
+        return self.executor.submit(run)
+
+
+def test_message_is_not_merged_into_picked_head(bot):
+    with FakeTelegramServer(latency=0.01) as server:
+        outbox = Outbox(bot)
+        outbox._executor = SlowStartExecutor(outbox._executor, 0.2)
+        first = outbox.submit(1, "send_message", 1, "a")
+        time.sleep(0.1)  # планировщик уже передал «a» отправителю, но запрос ещё не ушёл
+        second = outbox.submit(1, "send_message", 1, "b")
+        first.result(timeout=10)
+        second.result(timeout=10)
+    assert server.delivered[1] == ["a", "b"]
+    assert outbox.coalesced == 0
@@ -0,0 +1,27 @@
+"""BM25: разные формы одного слова должны совпадать."""
+import pytest
+
+from retrieval import BM25Index, stem, tokenize
+
+
+@pytest.mark.parametrize("forms", [
+    ("число", "числа", "числом"),
+    ("судьба", "судьбы", "судьбой", "судьбе"),
+    ("карма", "карму", "кармой"),
+    ("путь", "пути"),
+    ("рождение", "рождения"),
+    ("показывает", "показывают"),
+])
+def test_word_forms_share_stem(forms):
+    assert len({stem(word) for word in forms}) == 1
+
+
+def test_numbers_and_latin_are_kept():
+    assert tokenize("Число 11, Life Path") == ["числ", "11", "life", "path"]
+
+
+def test_inflected_query_finds_passage():
+    index = BM25Index(["Число судьбы 7 указывает на склонность к анализу.",
+                       "Совместимость партнёров по дате рождения."])
+    hits = index.search("судьба числа", 2)
+    assert hits and hits[0][0] == 0 and hits[0][1] > 0
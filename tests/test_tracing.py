@@ -0,0 +1,16 @@
+"""Учёт стоимости ответов OpenAI."""
+from tracing import Tracer
+
+USAGE = {"prompt_tokens": 1_000_000, "completion_tokens": 1_000_000}
+
+
+def test_usage_is_priced_by_answering_model():
+    tracer = Tracer(prompt_price=2.5, completion_price=10,
+                    model_prices={"gpt-4o": (2.5, 10), "gpt-4o-mini": (0.15, 0.6)})
+    tracer.record_usage(USAGE, "gpt-4o-mini-2024-07-18")
+    assert tracer.cost == 0.75
+    tracer.record_usage(USAGE, "gpt-4o-2024-08-06")
+    assert tracer.cost == 13.25
+    # Неизвестная модель считается по ценам основной
+    tracer.record_usage(USAGE)
+    assert tracer.cost == 25.75
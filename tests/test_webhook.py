@@ -0,0 +1,67 @@
+"""Приём обновлений webhook на keep-alive соединении."""
+import http.client
+import json
+import threading
+
+import pytest
+
+from webhook import WEBHOOK_MAX_BODY, SECRET_HEADER, WebhookServer
+
+SECRET = "secret"
+
+
+class FakeBot:
+    def __init__(self):
+        self.updates = []
+
+    def process_new_updates(self, updates):
+        self.updates.extend(update.update_id for update in updates)
+
+
+@pytest.fixture
+def server():
+    server = WebhookServer(FakeBot(), url="https://bot.test/hook", secret=SECRET, host="127.0.0.1", port=0)
+    threading.Thread(target=server.run, kwargs={"register": False}, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def post(conn, body, headers=None):
+    conn.request("POST", "/hook", body=body, headers={SECRET_HEADER: SECRET, **(headers or {})})
+    response = conn.getresponse()
+    response.read()
+    return response
+
+
+def test_update_is_processed(server):
+    conn = http.client.HTTPConnection("127.0.0.1", server.port)
+    assert post(conn, json.dumps({"update_id": 1})).status == 200
+    assert post(conn, json.dumps({"update_id": 1})).status == 200
+    assert server.bot.updates == [1]
+
+
+def test_non_object_body_is_rejected(server):
+    conn = http.client.HTTPConnection("127.0.0.1", server.port)
+    assert post(conn, "[]").status == 400
+    assert post(conn, "42").status == 400
+    # Соединение остаётся рабочим
+    assert post(conn, json.dumps({"update_id": 2})).status == 200
+    assert server.bot.updates == [2]
+
+
+def test_oversized_body_closes_connection(server):
+    conn = http.client.HTTPConnection("127.0.0.1", server.port)
+    conn.putrequest("POST", "/hook")
+    conn.putheader(SECRET_HEADER, SECRET)
+    conn.putheader("Content-Length", str(WEBHOOK_MAX_BODY + 1))
+    conn.endheaders()
+    # Тело не отправлено: сервер отвечает сразу и закрывает соединение, не читая его
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 413
+    assert response.will_close
+    conn.close()
+
+    conn = http.client.HTTPConnection("127.0.0.1", server.port)
+    assert post(conn, json.dumps({"update_id": 3})).status == 200
+    assert server.bot.updates == [3]
@@ -0,0 +1,283 @@
+import bisect
+import functools
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+# Доля сообщений, для которых замеряются этапы обработки (0 — трассировка выключена)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+# Трассы медленнее этого порога пишутся в лог на уровне INFO, остальные — DEBUG, секунд
+TRACE_SLOW_THRESHOLD = float(os.getenv("TRACE_SLOW_THRESHOLD", "10"))
+# Порт HTTP-эндпоинта /metrics в формате Prometheus (0 — не запускать)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Цены OpenAI за миллион токенов, долларов: запрос и ответ основной модели
+OPENAI_PROMPT_PRICE = float(os.getenv("OPENAI_PROMPT_PRICE", "2.5"))
+OPENAI_COMPLETION_PRICE = float(os.getenv("OPENAI_COMPLETION_PRICE", "10"))
+# То же для запасной модели; ответы других моделей считаются по ценам основной
+OPENAI_FALLBACK_PROMPT_PRICE = float(os.getenv("OPENAI_FALLBACK_PROMPT_PRICE", "0.15"))
+OPENAI_FALLBACK_COMPLETION_PRICE = float(os.getenv("OPENAI_FALLBACK_COMPLETION_PRICE", "0.6"))
+OPENAI_MODEL_PRICES = {
+    "gpt-4o": (OPENAI_PROMPT_PRICE, OPENAI_COMPLETION_PRICE),
+    "gpt-4o-mini": (OPENAI_FALLBACK_PROMPT_PRICE, OPENAI_FALLBACK_COMPLETION_PRICE),
+}
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current = ContextVar("trace", default=None)
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными границами корзин, как в Prometheus."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля линейной интерполяцией внутри корзины, как histogram_quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+
+class Trace:
+    """Длительности этапов одного сообщения; этапы с одним именем суммируются."""
+
+    __slots__ = ("name", "started", "stages", "prompt_tokens", "completion_tokens", "cost")
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+class _Span:
+    __slots__ = ("trace", "stage", "started")
+
+    def __init__(self, trace, stage):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.trace.add(self.stage, time.perf_counter() - self.started)
+
+
+# Для сообщений без трассы span не создаёт объектов
+_NO_SPAN = nullcontext()
+
+
+class Tracer:
+    """Замеры этапов обработки сообщений, счётчики токенов OpenAI и метрики для Prometheus.
+
+    ``traced`` оборачивает обработчик сообщения, ``span`` замеряет этап внутри
+    него: текущая трасса хранится в контекстной переменной, поэтому этапы можно
+    отмечать в любой функции, вызванной из обработчика. Трассируется доля
+    ``sample_rate`` сообщений; у остальных ``span`` ничего не замеряет. Токены и
+    стоимость запросов к OpenAI считаются для всех сообщений. Счётчики других
+    компонентов (очередей, кэшей) подключаются через ``register``.
+    """
+
+    def __init__(self, sample_rate=TRACE_SAMPLE_RATE, slow_threshold=TRACE_SLOW_THRESHOLD,
+                 prompt_price=OPENAI_PROMPT_PRICE, completion_price=OPENAI_COMPLETION_PRICE, model_prices=None):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.prompt_price = prompt_price
+        self.completion_price = completion_price
+        self.model_prices = OPENAI_MODEL_PRICES if model_prices is None else model_prices
+        self.requests = {}  # имя обработчика -> Histogram всего времени
+        self.stages = {}  # (обработчик, этап) -> Histogram
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.traced_count = 0
+        self._collected = {}
+        self._lock = threading.Lock()
+
+    def traced(self, name):
+        """Декоратор обработчика: замеряет его целиком и этапы внутри."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+                    return fn(*args, **kwargs)
+                trace = Trace(name)
+                token = _current.set(trace)
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    _current.reset(token)
+                    self._finish(trace)
+            return wrapper
+        return decorator
+
+    def span(self, stage):
+        """Контекстный менеджер, замеряющий этап ``stage`` текущей трассы."""
+        trace = _current.get()
+        return _NO_SPAN if trace is None else _Span(trace, stage)
+
+    def observe(self, stage, seconds):
+        """Добавляет к текущей трассе уже измеренный этап, например время до первого текста."""
+        trace = _current.get()
+        if trace is not None and seconds is not None:
+            trace.add(stage, seconds)
+
+    def prices(self, model=None):
+        """Цены модели за миллион токенов: (запрос, ответ).
+
+        ``model`` из ответа OpenAI бывает с датой версии («gpt-4o-mini-2024-07-18»),
+        поэтому выбирается самое длинное совпадающее начало имени из таблицы.
+        """
+        if model:
+            for name in sorted(self.model_prices, key=len, reverse=True):
+                if model == name or model.startswith(name + "-"):
+                    return self.model_prices[name]
+        return self.prompt_price, self.completion_price
+
+    def record_usage(self, usage, model=None):
+        """Учитывает ``usage`` из ответа OpenAI: токены и стоимость по ценам ответившей модели ``model``."""
+        if not usage:
+            return
+        prompt = usage.get("prompt_tokens", 0)
+        completion = usage.get("completion_tokens", 0)
+        prompt_price, completion_price = self.prices(model)
+        cost = (prompt * prompt_price + completion * completion_price) / 1_000_000
+        with self._lock:
+            self.prompt_tokens += prompt
+            self.completion_tokens += completion
+            self.cost += cost
+        trace = _current.get()
+        if trace is not None:
+            trace.prompt_tokens += prompt
+            trace.completion_tokens += completion
+            trace.cost += cost
+
+    def register(self, name, collect, help_text="", kind="gauge"):
+        """Регистрирует метрику, значение которой читается при каждом запросе /metrics.
+
+        ``collect`` возвращает число или None, если значения пока нет.
+        """
+        self._collected[name] = (collect, help_text, kind)
+
+    def _finish(self, trace):
+        total = time.perf_counter() - trace.started
+        with self._lock:
+            self.traced_count += 1
+            self.requests.setdefault(trace.name, Histogram()).observe(total)
+            for stage, seconds in trace.stages.items():
+                self.stages.setdefault((trace.name, stage), Histogram()).observe(seconds)
+        stages = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in trace.stages.items())
+        logger.log("INFO" if total >= self.slow_threshold else "DEBUG",
+                   f"Trace {trace.name}: {total:.2f}s ({stages}); tokens {trace.prompt_tokens}+"
+                   f"{trace.completion_tokens}, ${trace.cost:.4f}")
+
+    def summary(self):
+        """Медианы и p99 этапов по каждому обработчику, секунд."""
+        with self._lock:
+            return {f"{name}.{stage}": (histogram.quantile(0.5), histogram.quantile(0.99), histogram.count)
+                    for (name, stage), histogram in sorted(self.stages.items())}
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            self._render_histograms(lines, "bot_request_seconds", "Message handling time",
+                                    {(("handler", name),): h for name, h in self.requests.items()})
+            self._render_histograms(lines, "bot_stage_seconds", "Time spent in a message handling stage",
+                                    {(("handler", name), ("stage", stage)): h
+                                     for (name, stage), h in self.stages.items()})
+            lines += ["# HELP bot_openai_tokens_total OpenAI tokens used", "# TYPE bot_openai_tokens_total counter",
+                      f'bot_openai_tokens_total{{type="prompt"}} {self.prompt_tokens}',
+                      f'bot_openai_tokens_total{{type="completion"}} {self.completion_tokens}',
+                      "# HELP bot_openai_cost_dollars_total Estimated OpenAI cost",
+                      "# TYPE bot_openai_cost_dollars_total counter",
+                      f"bot_openai_cost_dollars_total {self.cost:.6f}"]
+        for name, (collect, help_text, kind) in self._collected.items():
+            try:
+                value = collect()
+            except Exception as e:
+                logger.warning(f"Error collecting metric {name}: {e}")
+                continue
+            if value is None:
+                continue
+            lines += [f"# HELP {name} {help_text or name}", f"# TYPE {name} {kind}", f"{name} {float(value):g}"]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histograms(lines, metric, help_text, histograms):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+        for labels, histogram in sorted(histograms.items()):
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f"{metric}_sum{{{label_text}}} {histogram.sum:.6f}")
+            lines.append(f"{metric}_count{{{label_text}}} {histogram.count}")
+
+
+class MetricsServer:
+    """HTTP-эндпоинт ``GET /metrics`` для сборщика Prometheus."""
+
+    def __init__(self, tracer, host=METRICS_HOST, port=METRICS_PORT):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = tracer.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"Metrics available on port {self.port}")
+        return self
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,142 @@
+import hmac
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from loguru import logger
+from telebot import types
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Сколько последних update_id помнить для отсева повторных доставок
+WEBHOOK_DEDUP_SIZE = int(os.getenv("WEBHOOK_DEDUP_SIZE", "10000"))
+WEBHOOK_MAX_BODY = 1024 * 1024
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateDeduplicator:
+    """Помнит последние ``max_size`` идентификаторов обновлений."""
+
+    def __init__(self, max_size=WEBHOOK_DEDUP_SIZE):
+        self.max_size = max_size
+        self.duplicates = 0
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_new(self, update_id) -> bool:
+        with self._lock:
+            if update_id in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen[update_id] = None
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return True
+
+
+class WebhookServer:
+    """HTTP-сервер, принимающий обновления Telegram вместо long polling.
+
+    Запрос без верного секрета из ``X-Telegram-Bot-Api-Secret-Token`` отклоняется,
+    повторная доставка того же ``update_id`` пропускается. Обработчики бота только
+    ставят задачи в очередь чата, поэтому обновления передаются в них по одному:
+    так сохраняется порядок сообщений чата, а ответ Telegram уходит сразу.
+    ``GET /healthz`` отвечает прокси или системе мониторинга, что процесс жив.
+    """
+
+    def __init__(self, bot, url=WEBHOOK_URL, secret=WEBHOOK_SECRET, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+        if not secret:
+            raise Exception("WEBHOOK_SECRET не определен в переменных окружения")
+        self.bot = bot
+        self.url = url
+        self.secret = secret.encode("utf-8")
+        self.path = urlparse(url).path or "/"
+        self.dedup = UpdateDeduplicator()
+        self.received = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._reply(200 if self.path == "/healthz" else 404)
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= WEBHOOK_MAX_BODY:
+                    # Тело не читается, поэтому соединение нельзя использовать для следующего запроса
+                    self._reply(413 if length > WEBHOOK_MAX_BODY else 400, close=True)
+                    return
+                body = self.rfile.read(length)
+                token = (self.headers.get(SECRET_HEADER) or "").encode("utf-8")
+                if not hmac.compare_digest(token, server.secret):
+                    server.rejected += 1
+                    self._reply(403)
+                    return
+                try:
+                    update = json.loads(body)
+                except ValueError:
+                    self._reply(400)
+                    return
+                if not isinstance(update, dict):
+                    self._reply(400)
+                    return
+                server.handle_update(update)
+                self._reply(200)
+
+            def _reply(self, status, close=False):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                if close:
+                    self.send_header("Connection", "close")
+                    self.close_connection = True
+                self.end_headers()
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+
+    def handle_update(self, data):
+        self.received += 1
+        if not self.dedup.is_new(data.get("update_id")):
+            logger.debug(f"Skipping duplicate update {data.get('update_id')}")
+            return
+        try:
+            update = types.Update.de_json(data)
+            with self._lock:
+                self.bot.process_new_updates([update])
+        except Exception as e:
+            logger.error(f"Error processing update {data.get('update_id')}: {e}")
+
+    def run(self, register=True):
+        """Регистрирует webhook в Telegram и обслуживает запросы до остановки процесса."""
+        if register:
+            self.bot.set_webhook(url=self.url, secret_token=self.secret.decode("utf-8"),
+                                 max_connections=WEBHOOK_MAX_CONNECTIONS,
+                                 allowed_updates=["message", "callback_query"])
+            logger.info(f"Webhook set to {self.url}, listening on port {self.port}")
+        self._httpd.serve_forever()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()